@@ -0,0 +1,359 @@
+"""
+Rebuild subscription state from the bot wallet's on-chain history.
+
+    python backfill.py                          # live RPC, resumes from the checkpoint
+    python backfill.py --fixture history.json   # replay recorded RPC responses
+    python backfill.py --record history.json    # record responses while backfilling
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from blockchain_monitor import apply_subscription_payment, get_bot_wallet_address
+from entitlements import entitlement_index
+from models import MonitorCursor, User
+from payment_attribution import attribute, decode_transfers, wallet_index
+from payment_ledger import insert_payment, payment_ledger
+from payment_watcher import load_cursor, save_cursor
+from plan_pricing import RateUnavailable, plan_pricing
+from referrals import record_payment
+from request_scheduler import set_background_priority
+from rpc_gateway import close_rpc_gateway, get_rpc_gateway
+from storage import db_writer
+from user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+CURSOR_NAME = 'payment_backfill'
+
+
+def decode_page(transactions, destination):
+    """
+    Decode a page of transactions into transfers to `destination`.
+
+    Runs in a worker process.
+
+    Returns:
+        list: (IncomingTransfer, block time as epoch seconds or None) tuples
+    """
+    block_times = {signature: (transaction or {}).get('blockTime') for signature, transaction in transactions}
+    return [
+        (transfer, block_times.get(transfer.signature))
+        for transfer in decode_transfers(transactions, destination)
+    ]
+
+
+def apply_backfilled_payment(session, payment, paid_at):
+    """
+    Credit a historical payment without committing.
+
+    Pages arrive newest first, so a payment older than the user's latest
+    one only adds to their paid total and leaves the subscription dates
+    alone.
+
+    Returns:
+        bool: Whether the payment was credited
+    """
+    plan = plan_pricing.match(payment.amount, paid_at)
+    if plan is None:
+        return False
+    user = User.query.filter_by(telegram_id=payment.telegram_id).first()
+    if not user or not insert_payment(session, payment):
+        return False
+    if user.last_payment_date and paid_at <= user.last_payment_date:
+        user.total_paid_amount += payment.amount
+    else:
+        apply_subscription_payment(user, payment.amount, paid_at, plan)
+    if user.referrer_id:
+        record_payment(session, user.referrer_id, user.telegram_id, payment.amount)
+    return True
+
+
+def apply_page(session, payments, checkpoint):
+    """
+    Credit one page of payments and move the backfill checkpoint without committing.
+
+    Returns:
+        list: (telegram_id, subscription_end_date, auto_renew) of credited users
+    """
+    credited = {}
+    for payment, paid_at in payments:
+        if apply_backfilled_payment(session, payment, paid_at):
+            user = User.query.filter_by(telegram_id=payment.telegram_id).first()
+            credited[user.telegram_id] = (user.telegram_id, user.subscription_end_date, bool(user.auto_renew))
+    save_cursor(session, CURSOR_NAME, checkpoint)
+    return list(credited.values())
+
+
+def reset_checkpoint(session):
+    session.query(MonitorCursor).filter_by(name=CURSOR_NAME).delete()
+
+
+class FixtureRpcClient:
+    """
+    Serve getSignaturesForAddress and getTransaction from a recorded file.
+
+    The fixture is JSON with "signatures" (records newest first, as the RPC
+    returns them) and "transactions" (signature -> jsonParsed transaction).
+    """
+
+    def __init__(self, path):
+        with open(path) as fixture:
+            data = json.load(fixture)
+        self.records = data['signatures']
+        self.transactions = data['transactions']
+        self._positions = {record['signature']: index for index, record in enumerate(self.records)}
+
+    async def call(self, method, params=None):
+        if method != 'getSignaturesForAddress':
+            raise ValueError(f"Fixture has no responses for {method}")
+        options = params[1] if len(params) > 1 else {}
+        start = self._positions[options['before']] + 1 if options.get('before') else 0
+        end = self._positions.get(options.get('until'), len(self.records))
+        return self.records[start:min(end, start + options.get('limit', 1000))]
+
+    async def get_transactions(self, signatures, commitment='confirmed', return_exceptions=False):
+        return [self.transactions.get(signature) for signature in signatures]
+
+    async def close(self):
+        pass
+
+
+class RecordingRpcClient:
+    """Pass calls through to an RPC client and save the responses as a fixture."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.records = []
+        self.transactions = {}
+
+    async def call(self, method, params=None):
+        result = await self.client.call(method, params)
+        if method == 'getSignaturesForAddress':
+            self.records.extend(result)
+        return result
+
+    async def get_transactions(self, signatures, commitment='confirmed', return_exceptions=False):
+        results = await self.client.get_transactions(signatures, commitment, return_exceptions)
+        self.transactions.update(zip(signatures, results))
+        return results
+
+    async def close(self):
+        with open(self.path, 'w') as fixture:
+            json.dump({'signatures': self.records, 'transactions': self.transactions}, fixture)
+        logger.info(f"Recorded {len(self.records)} signatures to {self.path}")
+
+
+class BackfillStats:
+    """Throughput counters for a backfill run."""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.pages = 0
+        self.signatures = 0
+        self.transactions = 0
+        self.transfers = 0
+        self.credited = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    @property
+    def transactions_per_second(self):
+        return self.transactions / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.pages} pages, {self.signatures} signatures, {self.transactions} transactions, "
+            f"{self.transfers} transfers, {self.credited} credited in {self.elapsed:.1f}s "
+            f"({self.transactions_per_second:.1f} tx/s)"
+        )
+
+
+class PaymentBackfill:
+    """
+    Walk the bot wallet's signature history backwards and credit payments.
+
+    Signature pages are listed one after another (each page starts before
+    the previous one's oldest signature), while up to `concurrency` pages
+    have their transactions fetched and decoded at once; with
+    `decode_workers` decoding runs in a process pool. Pages are applied in order, each in one writer
+    transaction that also moves the checkpoint, so an interrupted run
+    resumes after the last applied page and the payments ledger keeps a
+    page from being credited twice.
+    """
+
+    def __init__(self, wallet_address, rpc=None, commitment='confirmed', page_limit=1000,
+                 concurrency=4, decode_workers=0, dry_run=False, writer=db_writer):
+        self.wallet_address = wallet_address
+        self.rpc = rpc or get_rpc_gateway()
+        self.commitment = commitment
+        self.page_limit = page_limit
+        self.concurrency = concurrency
+        self.decode_workers = decode_workers
+        self.dry_run = dry_run
+        self.writer = writer
+        self.stats = BackfillStats()
+
+    async def _signature_pages(self, before):
+        while True:
+            options = {'limit': self.page_limit, 'commitment': self.commitment}
+            if before:
+                options['before'] = before
+            page = await self.rpc.call('getSignaturesForAddress', [self.wallet_address, options])
+            if not page:
+                return
+            yield page
+            before = page[-1]['signature']
+
+    async def _fetch_and_decode(self, page, pool):
+        confirmed = [record['signature'] for record in page if record.get('err') is None]
+        if not self.dry_run:
+            confirmed = payment_ledger.new_signatures(confirmed)
+        transactions = await self.rpc.get_transactions(confirmed, self.commitment) if confirmed else []
+        pairs = list(zip(confirmed, transactions))
+        if pool is None:
+            decoded = decode_page(pairs, self.wallet_address)
+        else:
+            decoded = await asyncio.get_running_loop().run_in_executor(pool, decode_page, pairs, self.wallet_address)
+        return page, len(pairs), decoded
+
+    async def _apply(self, page, transaction_count, decoded):
+        self.stats.pages += 1
+        self.stats.signatures += len(page)
+        self.stats.transactions += transaction_count
+        self.stats.transfers += len(decoded)
+        if self.dry_run:
+            return
+
+        block_times = {transfer.signature: block_time for transfer, block_time in decoded}
+        attributed, _ = attribute([transfer for transfer, _ in decoded], wallet_index)
+        payments = [
+            (payment, datetime.utcfromtimestamp(block_times[payment.signature])
+             if block_times.get(payment.signature) else datetime.utcnow())
+            for payment in attributed
+        ]
+        # One rate fetch per uncovered span of the page, not per payment
+        uncovered = await plan_pricing.ensure(paid_at for _, paid_at in payments)
+        checkpoint = page[-1]['signature']
+        if uncovered:
+            # Stop before the page; a rerun resumes from the last applied checkpoint
+            raise RateUnavailable(f"No SOL/USD rate for {len(uncovered)} payments in the page ending at {checkpoint}")
+        credited = await self.writer.write(lambda session: apply_page(session, payments, checkpoint))
+        payment_ledger.remember(payment.signature for payment, _ in payments)
+        self.stats.credited += len(credited)
+        for telegram_id, end_date, auto_renew in credited:
+            entitlement_index.update(telegram_id, end_date, auto_renew)
+            invalidate_user(telegram_id)
+
+    async def run(self, report_interval=10.0):
+        """
+        Backfill until the start of the wallet's history.
+
+        Returns:
+            BackfillStats: Throughput metrics for the run
+        """
+        set_background_priority()
+        before = None if self.dry_run else load_cursor(CURSOR_NAME)
+        if before:
+            logger.info(f"Resuming backfill before {before}")
+
+        pool = ProcessPoolExecutor(self.decode_workers) if self.decode_workers else None
+        # Bounded so listing stays at most `concurrency` pages ahead of applying
+        in_flight = asyncio.Queue(maxsize=self.concurrency)
+
+        async def list_pages():
+            async for page in self._signature_pages(before):
+                await in_flight.put(asyncio.ensure_future(self._fetch_and_decode(page, pool)))
+            await in_flight.put(None)
+
+        lister = asyncio.ensure_future(list_pages())
+        last_report = time.monotonic()
+        try:
+            while True:
+                task = await in_flight.get()
+                if task is None:
+                    break
+                await self._apply(*await task)
+                if time.monotonic() - last_report >= report_interval:
+                    last_report = time.monotonic()
+                    logger.info(f"Backfill progress: {self.stats}")
+            await lister
+        finally:
+            lister.cancel()
+            while not in_flight.empty():
+                task = in_flight.get_nowait()
+                if task is not None:
+                    task.cancel()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        logger.info(f"Backfill complete: {self.stats}")
+        return self.stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild subscription state from the bot wallet's history")
+    parser.add_argument('--fixture', help="Replay recorded RPC responses from this file instead of the network")
+    parser.add_argument('--record', help="Save RPC responses to this file for later --fixture runs")
+    parser.add_argument('--page-limit', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4, help="Pages fetched and decoded at once")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Decode processes (default 0 decodes in the event loop)")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the newest page")
+    parser.add_argument('--dry-run', action='store_true', help="Fetch and decode only; write nothing")
+    return parser.parse_args()
+
+
+async def run_backfill(args):
+    rpc = FixtureRpcClient(args.fixture) if args.fixture else get_rpc_gateway()
+    if args.record:
+        rpc = RecordingRpcClient(rpc, args.record)
+    backfill = PaymentBackfill(
+        get_bot_wallet_address(),
+        rpc=rpc,
+        page_limit=args.page_limit,
+        concurrency=args.concurrency,
+        decode_workers=args.workers,
+        dry_run=args.dry_run,
+    )
+    try:
+        return await backfill.run()
+    finally:
+        if args.record:
+            await rpc.close()
+        await close_rpc_gateway()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    if not get_bot_wallet_address():
+        logger.error("BOT_SOLANA_WALLET_ADDRESS is not set.")
+        return
+
+    from db_migrations import apply_migrations
+    from shared_resources import app, db
+    with app.app_context():
+        apply_migrations(db.engine, db.Model, "migrations")
+
+    db_writer.start()
+    try:
+        if not args.dry_run:
+            if args.restart:
+                db_writer.submit(reset_checkpoint).result()
+            wallet_index.load()
+            payment_ledger.load()
+            plan_pricing.load()
+        asyncio.run(run_backfill(args))
+    finally:
+        db_writer.stop()
+
+
+if __name__ == '__main__':
+    main()
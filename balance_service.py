@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from rpc_gateway import LAMPORTS_PER_SOL, get_rpc_gateway
+from request_scheduler import set_background_priority
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+# getMultipleAccounts accepts at most 100 addresses per request
+MAX_ACCOUNTS_PER_REQUEST = 100
+
+
+class BalanceEntry:
+    __slots__ = ('lamports', 'slot', 'fetched_at')
+
+    def __init__(self, lamports, slot, fetched_at):
+        self.lamports = lamports
+        self.slot = slot
+        self.fetched_at = fetched_at
+
+
+class BalanceService:
+    """
+    Shared wallet balance lookups.
+
+    Concurrent requests for the same wallet share one in-flight lookup, and
+    every wallet requested within `batch_window` seconds is fetched with a
+    single getMultipleAccounts call. Results are cached for `ttl` seconds
+    and tagged with the slot they were read at, so an older read never
+    overwrites a newer one and writers can invalidate everything before a
+    given slot. Wallets that are actively trading are kept current through
+    accountSubscribe and served from the cache while the stream is up.
+    """
+
+    def __init__(self, rpc=None, ws_url=None, commitment='confirmed', ttl=2.0,
+                 batch_window=0.005, active_ttl=300.0, subscribe_interval=1.0):
+        self.rpc = rpc
+        self.ws_url = ws_url
+        self.commitment = commitment
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.active_ttl = active_ttl
+        self.subscribe_interval = subscribe_interval
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self._entries = {}
+        self._inflight = {}
+        self._queued = []
+        self._flush_handle = None
+        self._active = {}
+        self._subscriptions = {}
+        self._live = set()
+
+    @classmethod
+    def from_env(cls):
+        """Build a balance service from environment variables."""
+        return cls(
+            ws_url=os.getenv('SOLANA_WS_ENDPOINT'),
+            commitment=os.getenv('BALANCE_COMMITMENT', 'confirmed'),
+            ttl=float(os.getenv('BALANCE_CACHE_TTL', '2')),
+            batch_window=float(os.getenv('BALANCE_BATCH_WINDOW', '0.005')),
+            active_ttl=float(os.getenv('BALANCE_SUBSCRIPTION_TTL', '300')),
+        )
+
+    @property
+    def client(self):
+        return self.rpc or get_rpc_gateway()
+
+    def _fresh(self, address, entry):
+        if entry is None:
+            return False
+        return address in self._live or time.monotonic() - entry.fetched_at < self.ttl
+
+    async def get_balance(self, address):
+        """Return a wallet's balance in lamports."""
+        entry = self._entries.get(address)
+        if self._fresh(address, entry):
+            self.hits += 1
+            return entry.lamports
+        self.misses += 1
+
+        future = self._inflight.get(address)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._inflight[address] = loop.create_future()
+            self._queued.append(address)
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await asyncio.shield(future)
+
+    async def get_sol_balance(self, address):
+        """Return a wallet's balance in SOL."""
+        return await self.get_balance(address) / LAMPORTS_PER_SOL
+
+    async def get_balances(self, addresses):
+        """Return balances in lamports for many wallets."""
+        return await asyncio.gather(*(self.get_balance(address) for address in addresses))
+
+    def _flush(self):
+        self._flush_handle = None
+        queued, self._queued = self._queued, []
+        for start in range(0, len(queued), MAX_ACCOUNTS_PER_REQUEST):
+            asyncio.ensure_future(self._fetch(queued[start:start + MAX_ACCOUNTS_PER_REQUEST]))
+
+    async def _fetch(self, addresses):
+        self.requests += 1
+        try:
+            slot, accounts = await self.client.get_multiple_accounts(addresses, self.commitment)
+        except Exception as e:
+            for address in addresses:
+                future = self._inflight.pop(address)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for address, account in zip(addresses, accounts):
+            lamports = self._store(address, account['lamports'] if account else 0, slot)
+            future = self._inflight.pop(address)
+            if not future.done():
+                future.set_result(lamports)
+
+    def _store(self, address, lamports, slot):
+        """Cache a balance unless a newer slot is already cached. Returns the cached value."""
+        entry = self._entries.get(address)
+        if entry is not None and entry.slot > slot:
+            return entry.lamports
+        self._entries[address] = BalanceEntry(lamports, slot, time.monotonic())
+        return lamports
+
+    def invalidate(self, address, before_slot=None):
+        """
+        Drop a cached balance after a write to the wallet.
+
+        Args:
+            address (str): Wallet address
+            before_slot (int): Keep the entry if it was read at or after this slot
+        """
+        entry = self._entries.get(address)
+        if entry is not None and (before_slot is None or entry.slot < before_slot):
+            del self._entries[address]
+            self._live.discard(address)
+
+    def track(self, address):
+        """Keep a trading wallet's balance current through an account subscription."""
+        if not address or not self.ws_url:
+            return
+        self._active[address] = time.monotonic() + self.active_ttl
+
+    async def run(self):
+        """Maintain account subscriptions for tracked wallets until cancelled."""
+        set_background_priority()
+        if not self.ws_url:
+            return
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    await self._follow_accounts(session)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Balance subscription error: {str(e)}")
+                finally:
+                    # Subscriptions die with the connection
+                    self._subscriptions.clear()
+                    self._live.clear()
+                await asyncio.sleep(1.0)
+
+    async def _follow_accounts(self, session):
+        request_ids = {}
+        next_id = 0
+        async with session.ws_connect(self.ws_url, heartbeat=30) as ws:
+            while True:
+                now = time.monotonic()
+                subscribed = set(self._subscriptions.values()) | set(request_ids.values())
+                for address, expires_at in list(self._active.items()):
+                    if expires_at <= now:
+                        del self._active[address]
+                        self._live.discard(address)
+                        for subscription_id, subscribed_address in list(self._subscriptions.items()):
+                            if subscribed_address == address:
+                                del self._subscriptions[subscription_id]
+                                next_id += 1
+                                await ws.send_json({'jsonrpc': '2.0', 'id': next_id,
+                                                    'method': 'accountUnsubscribe', 'params': [subscription_id]})
+                    elif address not in subscribed:
+                        next_id += 1
+                        request_ids[next_id] = address
+                        await ws.send_json({
+                            'jsonrpc': '2.0', 'id': next_id, 'method': 'accountSubscribe',
+                            'params': [address, {'encoding': 'base64', 'commitment': self.commitment}],
+                        })
+
+                try:
+                    # Short timeout so newly tracked wallets are subscribed promptly
+                    message = await ws.receive(timeout=self.subscribe_interval)
+                except asyncio.TimeoutError:
+                    continue
+
+                if message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    logger.warning("Account subscription closed, reconnecting")
+                    return
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                data = json.loads(message.data)
+                if data.get('id') in request_ids:
+                    address = request_ids.pop(data['id'])
+                    if 'result' in data:
+                        self._subscriptions[data['result']] = address
+                elif data.get('method') == 'accountNotification':
+                    params = data['params']
+                    address = self._subscriptions.get(params['subscription'])
+                    if address is not None:
+                        result = params['result']
+                        self._store(address, result['value']['lamports'], result['context']['slot'])
+                        self._live.add(address)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'cached': len(self._entries),
+            'subscribed': len(self._subscriptions),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'rpc_requests': self.requests,
+        }
+
+
+balance_service = BalanceService.from_env()
+stats_registry.register('balances', balance_service.stats)
@@ -0,0 +1,73 @@
+"""
+Measure matching engine throughput and per-order match latency.
+
+    python benchmarks/bench_matching_engine.py --orders 200000 --tokens 4
+
+Orders are random limit buys and sells around a drifting mid price, so a
+mix of them cross immediately, fill partially or rest on the book. Only
+the in-memory engine is timed; persistence is batched separately.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from order_book import MatchingEngine, Order  # noqa: E402
+
+
+def generate_orders(count, tokens, seed):
+    rng = random.Random(seed)
+    symbols = [f"TOKEN{n}" for n in range(tokens)]
+    mids = {symbol: 100.0 for symbol in symbols}
+    orders = []
+    for order_id in range(count):
+        symbol = rng.choice(symbols)
+        mids[symbol] *= 1 + rng.gauss(0, 0.0005)
+        side = rng.choice(('buy', 'sell'))
+        offset = rng.gauss(0, 0.5)
+        price = round(mids[symbol] + (offset if side == 'buy' else -offset), 2)
+        amount = round(rng.uniform(0.1, 10.0), 3)
+        orders.append(Order(order_id, rng.randrange(10_000), symbol, side, price, amount))
+    return orders
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=200_000)
+    parser.add_argument('--tokens', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    orders = generate_orders(args.orders, args.tokens, args.seed)
+    engine = MatchingEngine()
+    latencies = []
+    fills = 0
+
+    clock = time.perf_counter_ns
+    started = clock()
+    for order in orders:
+        before = clock()
+        fills += len(engine.submit(order))
+        latencies.append(clock() - before)
+    elapsed = (clock() - started) / 1e9
+
+    latencies.sort()
+    resting = sum(book.depth() for book in engine.books.values())
+    print(f"orders: {args.orders}  fills: {fills}  resting: {resting}")
+    print(f"throughput: {args.orders / elapsed:,.0f} orders/s ({elapsed:.2f}s)")
+    print("latency (us): " + "  ".join(
+        f"p{label}={percentile(latencies, fraction) / 1000:.1f}"
+        for label, fraction in (('50', 0.50), ('90', 0.90), ('99', 0.99), ('99.9', 0.999))
+    ) + f"  max={latencies[-1] / 1000:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure order book recovery time from snapshot + journal as history grows.
+
+    python benchmarks/bench_order_recovery.py --orders 1000000 --snapshot-every 50000
+
+Random orders are matched and journaled exactly as TradeEngine does, with a
+snapshot every --snapshot-every events. At each checkpoint the journal is
+recovered from disk in a fresh OrderJournal and the time is reported next to
+what replaying the full history would cost.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_matching_engine import generate_orders  # noqa: E402
+from order_book import MatchingEngine  # noqa: E402
+from order_journal import OrderJournal, fill_event, order_event  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--tokens', type=int, default=4)
+    parser.add_argument('--snapshot-every', type=int, default=50_000)
+    parser.add_argument('--checkpoints', type=int, default=4)
+    args = parser.parse_args()
+
+    orders = generate_orders(args.orders, args.tokens, seed=11)
+    checkpoint_every = max(1, args.orders // args.checkpoints)
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = OrderJournal(directory, snapshot_every=args.snapshot_every, fsync=False)
+        engine = MatchingEngine()
+        started = time.perf_counter()
+        for n, order in enumerate(orders, 1):
+            fills = engine.submit(order)
+            journal.append(order_event(order))
+            for fill in fills:
+                journal.append(fill_event(fill))
+            if journal.snapshot_due():
+                journal.snapshot(engine, order.order_id)
+
+            if n % checkpoint_every == 0:
+                journal.sync()
+                elapsed = time.perf_counter() - started
+                recover_started = time.perf_counter()
+                state = OrderJournal(directory).recover()
+                recovery = time.perf_counter() - recover_started
+                resting = sum(book.depth() for book in state.engine.books.values())
+                print(f"history {n:>9} orders ({journal.last_sequence:>9} events, "
+                      f"{n / elapsed:,.0f} orders/s journaled): recovered {resting} resting orders, "
+                      f"{state.replayed} tail records in {recovery * 1000:.0f} ms")
+        journal.close()
+
+
+if __name__ == '__main__':
+    main()
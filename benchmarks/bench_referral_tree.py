@@ -0,0 +1,133 @@
+"""
+Compare referral tree queries on the closure table with recursive scans.
+
+    python benchmarks/bench_referral_tree.py --users 1000000
+
+A synthetic tree is generated where about half the users signed up through
+a referral link of a random earlier user. The closure table is built with
+the backfill from migrations/025_create_referral_closure.sql, then subtree
+aggregates and depth-N uplines for random users are timed against a
+recursive CTE over users.referrer_id and one-hop lookups respectively.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATION = os.path.join(ROOT, 'migrations', '025_create_referral_closure.sql')
+
+SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    referrer_id INTEGER,
+    total_paid_amount REAL DEFAULT 0.0
+);
+"""
+
+CLOSURE_SUBTREE = """
+SELECT COUNT(c.descendant_id), COALESCE(SUM(u.total_paid_amount), 0.0)
+FROM referral_closure c JOIN users u ON u.telegram_id = c.descendant_id
+WHERE c.ancestor_id = ? AND c.depth > 0
+"""
+
+RECURSIVE_SUBTREE = """
+WITH RECURSIVE tree(telegram_id) AS (
+    SELECT telegram_id FROM users WHERE referrer_id = ?
+    UNION ALL
+    SELECT users.telegram_id FROM users JOIN tree ON users.referrer_id = tree.telegram_id
+)
+SELECT COUNT(*), COALESCE(SUM(u.total_paid_amount), 0.0)
+FROM tree JOIN users u ON u.telegram_id = tree.telegram_id
+"""
+
+CLOSURE_UPLINE = """
+SELECT ancestor_id, depth FROM referral_closure
+WHERE descendant_id = ? AND depth > 0 AND depth <= ? ORDER BY depth
+"""
+
+
+def generate_users(count, referral_share, seed):
+    rng = random.Random(seed)
+    for telegram_id in range(1, count + 1):
+        referrer_id = rng.randint(1, telegram_id - 1) if telegram_id > 1 and rng.random() < referral_share else None
+        paid = rng.choice((0.0, 0.0, 5.0, 1000.0))
+        yield telegram_id, referrer_id, paid
+
+
+def one_hop_upline(connection, telegram_id, depth):
+    chain = []
+    current = telegram_id
+    for level in range(1, depth + 1):
+        row = connection.execute("SELECT referrer_id FROM users WHERE telegram_id = ?", (current,)).fetchone()
+        if not row or row[0] is None:
+            break
+        current = row[0]
+        chain.append((current, level))
+    return chain
+
+
+def time_queries(label, fn, samples):
+    timings = []
+    results = []
+    for sample in samples:
+        started = time.perf_counter()
+        results.append(fn(sample))
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"  {label:<28} p50 {statistics.median(timings):8.3f} ms   "
+          f"p99 {timings[int(0.99 * (len(timings) - 1))]:8.3f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--referral-share', type=float, default=0.5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'tree.db'))
+        connection.executescript(SCHEMA)
+        connection.executemany(
+            "INSERT INTO users (telegram_id, referrer_id, total_paid_amount) VALUES (?, ?, ?)",
+            generate_users(args.users, args.referral_share, seed=5)
+        )
+        connection.commit()
+
+        started = time.perf_counter()
+        with open(MIGRATION) as migration:
+            connection.executescript(migration.read())
+        backfill = time.perf_counter() - started
+        rows, max_depth = connection.execute("SELECT COUNT(*), MAX(depth) FROM referral_closure").fetchone()
+        print(f"{args.users:,} users: closure backfill {backfill:.1f}s, "
+              f"{rows:,} rows ({rows / args.users:.1f} per user), max depth {max_depth}")
+
+        rng = random.Random(9)
+        # Low ids sit near the top of the tree and have the largest subtrees
+        roots = [rng.randint(1, max(1, args.users // 1000)) for _ in range(args.queries)]
+        leaves = [rng.randint(1, args.users) for _ in range(args.queries)]
+
+        print(f"subtree aggregate ({args.queries} users near the top of the tree):")
+        closure = time_queries('closure table', lambda r: connection.execute(CLOSURE_SUBTREE, (r,)).fetchone(), roots)
+        recursive = time_queries('recursive CTE', lambda r: connection.execute(RECURSIVE_SUBTREE, (r,)).fetchone(), roots)
+        assert [row[0] for row in closure] == [row[0] for row in recursive], "subtree counts differ"
+
+        print(f"depth-{args.depth} upline ({args.queries} random users):")
+        closure = time_queries(
+            'closure table', lambda u: connection.execute(CLOSURE_UPLINE, (u, args.depth)).fetchall(), leaves
+        )
+        hops = time_queries('one-hop lookups', lambda u: one_hop_upline(connection, u, args.depth), leaves)
+        assert closure == hops, "uplines differ"
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
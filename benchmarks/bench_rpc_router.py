@@ -0,0 +1,137 @@
+"""
+Drive the RPC gateway against local fake RPC servers that inject latency and faults.
+
+    python benchmarks/bench_rpc_router.py --requests 2000 --concurrency 20
+
+Each fake endpoint answers getSlot/getBalance/getHealth with a configurable
+base latency, a slow-tail probability, an HTTP 503 fault rate and a slot
+lag. The same workload runs once against the first endpoint alone and once
+through the router over all of them; latency percentiles, error counts and
+the router's per-endpoint health are printed for both.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rpc_gateway import RpcGateway  # noqa: E402
+from rpc_router import RpcRouter  # noqa: E402
+
+# name: (base latency s, slow-tail probability, slow-tail latency s, fault rate, slot lag)
+PROFILES = {
+    'flaky': (0.020, 0.00, 0.0, 0.30, 0),
+    'slow-tail': (0.010, 0.10, 0.400, 0.00, 0),
+    'healthy': (0.015, 0.01, 0.100, 0.00, 0),
+    'lagging': (0.005, 0.00, 0.0, 0.00, 200),
+}
+
+TIP_SLOT = 250_000_000
+
+
+def fake_rpc_app(name, rng):
+    base, tail_probability, tail_latency, fault_rate, slot_lag = PROFILES[name]
+
+    def answer(request):
+        method = request.get('method')
+        if method == 'getSlot':
+            result = TIP_SLOT - slot_lag
+        elif method == 'getBalance':
+            result = {'context': {'slot': TIP_SLOT - slot_lag}, 'value': 1_000_000_000}
+        else:
+            result = 'ok'
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    async def handle(request):
+        payload = await request.json()
+        delay = tail_latency if rng.random() < tail_probability else base
+        await asyncio.sleep(delay)
+        if rng.random() < fault_rate:
+            return web.Response(status=503, text='injected fault')
+        if isinstance(payload, list):
+            return web.json_response([answer(item) for item in payload])
+        return web.json_response(answer(payload))
+
+    app = web.Application()
+    app.router.add_post('/', handle)
+    return app
+
+
+async def start_servers(seed):
+    rng = random.Random(seed)
+    runners, urls = [], []
+    for name in PROFILES:
+        runner = web.AppRunner(fake_rpc_app(name, rng))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        runners.append(runner)
+        urls.append(f"http://127.0.0.1:{port}/")
+    return runners, urls
+
+
+async def run_workload(gateway, requests, concurrency):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await gateway.get_balance('11111111111111111111111111111111')
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return sorted(latencies), errors, time.perf_counter() - started
+
+
+def report(label, latencies, errors, elapsed):
+    def pct(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+    print(f"{label:<10} {len(latencies) / elapsed:8.0f} req/s  p50={pct(0.50):6.1f}ms  "
+          f"p95={pct(0.95):6.1f}ms  p99={pct(0.99):6.1f}ms  errors={errors}")
+
+
+async def main_async(args):
+    runners, urls = await start_servers(args.seed)
+    try:
+        single = RpcGateway(urls[0], max_concurrency=args.concurrency)
+        report('single', *await run_workload(single, args.requests, args.concurrency))
+        await single.close()
+
+        router = RpcRouter(urls, failure_threshold=3, cooldown=2.0)
+        routed = RpcGateway(urls[0], max_concurrency=args.concurrency, router=router)
+        await router.probe(routed._send)
+        report('routed', *await run_workload(routed, args.requests, args.concurrency))
+        stats = router.stats()
+        print(f"hedged={stats['hedged']} hedges_won={stats['hedges_won']} failovers={stats['failovers']}")
+        for name, endpoint in zip(PROFILES, stats['endpoints']):
+            print(f"  {name:<10} requests={endpoint['requests']:5d} failures={endpoint['failures']:4d} "
+                  f"circuit={endpoint['circuit']:<6} slot_lag={endpoint['slot_lag']}")
+        await routed.close()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=3)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Compare write throughput of the default SQLite setup with the storage profile.
+
+    python benchmarks/bench_sqlite_commits.py --writers 8 --writes 500
+
+The baseline gives every writer thread its own default connection (rollback
+journal, synchronous=FULL) committing each write. The tuned run applies the
+WAL pragmas from storage.py and funnels the same writes through the
+group-committing DatabaseWriter.
+"""
+import argparse
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import DatabaseWriter, SQLITE_PRAGMAS, apply_sqlite_pragmas  # noqa: E402
+
+SCHEMA = "CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, payload TEXT)"
+INSERT = "INSERT INTO events (user_id, payload) VALUES (?, ?)"
+
+
+def run_baseline(path, writers, writes):
+    errors = []
+
+    def worker(writer_id):
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            for i in range(writes):
+                connection.execute(INSERT, (writer_id, f"payload-{i}"))
+                connection.commit()
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        finally:
+            connection.close()
+
+    return _timed(writers, worker), errors
+
+
+def run_group_commit(path, writers, writes):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    apply_sqlite_pragmas(connection, SQLITE_PRAGMAS)
+
+    @contextlib.contextmanager
+    def session_scope():
+        yield connection
+
+    writer = DatabaseWriter(session_scope=session_scope).start()
+    errors = []
+
+    def worker(writer_id):
+        futures = []
+        for i in range(writes):
+            payload = (writer_id, f"payload-{i}")
+            futures.append(writer.submit(lambda conn, payload=payload: conn.execute(INSERT, payload)))
+        for future in futures:
+            try:
+                future.result()
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    elapsed = _timed(writers, worker)
+    writer.stop()
+    connection.close()
+    return elapsed, errors, writer.commits
+
+
+def _timed(writers, worker):
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def fresh_database(directory, name):
+    path = os.path.join(directory, name)
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    connection.commit()
+    connection.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=500, help="Writes per writer thread")
+    args = parser.parse_args()
+    total = args.writers * args.writes
+
+    with tempfile.TemporaryDirectory() as directory:
+        elapsed, errors = run_baseline(fresh_database(directory, 'baseline.db'), args.writers, args.writes)
+        baseline_rate = total / elapsed
+        print(f"default journal, commit per write: {baseline_rate:10.0f} writes/s "
+              f"({elapsed:.2f}s, {len(errors)} errors)")
+
+        elapsed, errors, commits = run_group_commit(fresh_database(directory, 'tuned.db'), args.writers, args.writes)
+        tuned_rate = total / elapsed
+        print(f"WAL + group-commit writer:         {tuned_rate:10.0f} writes/s "
+              f"({elapsed:.2f}s, {commits} commits, {len(errors)} errors)")
+
+    print(f"speedup: {tuned_rate / baseline_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
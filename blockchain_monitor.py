@@ -1,165 +1,354 @@
+import asyncio
 import logging
 import os
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from shared_resources import db, app
+
 from models import User
-from sqlalchemy import func
+from rpc_gateway import close_rpc_gateway, get_rpc_gateway
+from user_cache import invalidate_user
+from entitlements import entitlement_index
+from referrals import record_payment
+from payment_attribution import attribute, decode_transfers, wallet_index
+from payment_ledger import insert_payment, payment_ledger
+from plan_pricing import plan_pricing, to_epoch
+from message_dispatcher import message_dispatcher
+from request_scheduler import set_background_priority
+from storage import AdvisoryLease, db_writer, read_session
+from health import stats_registry
 
 logger = logging.getLogger(__name__)
 
+# Arbitrary key for pg_try_advisory_lock; its holder is the one sweeping worker
+RECONCILE_LOCK_KEY = 7274117
+
 def get_bot_wallet_address():
     """Retrieve bot's Solana wallet address from environment variables."""
     return os.getenv('BOT_SOLANA_WALLET_ADDRESS')
 
-import requests
-from solana.rpc.async_api import AsyncClient
-from solana.transaction import Transaction
-import asyncio
+def apply_subscription_payment(user, payment_amount, current_time=None, plan=None):
+    """
+    Apply a subscription payment to a user row without committing.
+
+    Args:
+        user (User): User object bound to the current session
+        payment_amount (float): Amount paid in SOL
+        current_time (datetime): Payment time, defaults to now
+        plan (Plan): Plan paid for, matched from the amount at current_time if omitted
+    """
+    current_time = current_time or datetime.utcnow()
 
-async def verify_blockchain_payment(transaction_details):
+    # Determine subscription type from the USD value of the payment
+    plan = plan or plan_pricing.match(payment_amount, current_time)
+    if plan:
+        user.subscription_type = plan.name
+        user.subscription_start_date = current_time
+        user.subscription_end_date = current_time + timedelta(days=plan.duration_days)
+
+    user.last_payment_date = current_time
+    user.last_payment_amount = payment_amount
+    user.total_paid_amount += payment_amount
+
+@dataclass(frozen=True)
+class CreditedPayment:
+    """A payment credited inside a writer transaction, for follow-up after commit."""
+
+    telegram_id: int
+    referrer_id: int
+    subscription_type: str
+    subscription_end_date: datetime
+    auto_renew: bool
+    amount: float
+
+    def notify(self):
+        """Tell the payer that the payment landed."""
+        message_dispatcher.notify(
+            self.telegram_id,
+            f"✅ Payment of {self.amount} SOL received.\n"
+            f"Your {self.subscription_type} subscription is active until "
+            f"{self.subscription_end_date.strftime('%Y-%m-%d %H:%M UTC')}."
+        )
+
+def credit_payment(session, payment, paid_at=None):
     """
-    Verify blockchain payment details using Solana RPC.
-    
+    Credit an attributed on-chain payment to its user.
+
+    Runs inside a writer transaction; the caller commits.
+
     Args:
-        transaction_details (dict): Details of the blockchain transaction
-    
+        session: Writer session
+        payment (AttributedPayment): Transfer matched to the sending user
+        paid_at (datetime): Block time the amount is priced at, defaults to now
+
     Returns:
-        bool: Whether the payment is valid
+        CreditedPayment: The credited payment, or None if it was not credited
     """
-    try:
-        # Use environment variable for Solana RPC endpoint
-        solana_rpc_url = os.getenv('SOLANA_RPC_ENDPOINT', 'https://api.mainnet-beta.solana.com')
-        client = AsyncClient(solana_rpc_url)
-        
-        # Validate transaction details
-        if not all(key in transaction_details for key in ['from_address', 'to_address', 'amount']):
-            logger.warning("Incomplete transaction details")
-            return False
-        
-        # Check transaction to bot's wallet
-        bot_wallet = get_bot_wallet_address()
-        if transaction_details['to_address'] != bot_wallet:
-            logger.warning(f"Transaction not to bot wallet: {transaction_details['to_address']}")
-            return False
-        
-        # Validate transaction amount
-        if transaction_details['amount'] not in [5.0, 1000.0]:
-            logger.warning(f"Invalid payment amount: {transaction_details['amount']}")
-            return False
-        
-        # Additional Solana-specific transaction verification
-        # Check network connectivity
-        if not await client.is_connected():
-            logger.warning("Unable to connect to Solana network")
-            return False
-        
-        # Verify transaction signature and status
-        transaction_signature = transaction_details.get('transaction_signature')
-        if transaction_signature:
-            try:
-                transaction_status = await client.get_transaction(transaction_signature)
-                if not transaction_status or transaction_status.get('status') != 'Success':
-                    logger.warning("Transaction verification failed")
-                    return False
-            except Exception as e:
-                logger.error(f"Transaction signature verification error: {str(e)}")
-                return False
-        
-        return True
-    except Exception as e:
-        logger.error(f"Blockchain payment verification error: {str(e)}")
-        return False
+    amount, signature = payment.amount, payment.signature
+    plan = plan_pricing.match(amount, paid_at or datetime.utcnow())
+    if plan is None:
+        logger.info(f"Ignoring non-plan payment of {amount} SOL from {payment.source_address}")
+        return None
+
+    user = User.query.filter_by(telegram_id=payment.telegram_id).first()
+    if not user:
+        logger.warning(f"Payment {signature} attributed to missing user {payment.telegram_id}")
+        return None
+
+    if not insert_payment(session, payment):
+        logger.info(f"Payment {signature} was already credited")
+        return None
+
+    apply_subscription_payment(user, amount, datetime.utcnow(), plan)
+    user.last_transaction_signature = signature
+
+    if user.referrer_id:
+        record_payment(session, user.referrer_id, user.telegram_id, amount)
+
+    logger.info(f"Processed payment {signature} for user {user.username}")
+    return CreditedPayment(
+        telegram_id=user.telegram_id,
+        referrer_id=user.referrer_id,
+        subscription_type=user.subscription_type,
+        subscription_end_date=user.subscription_end_date,
+        auto_renew=bool(user.auto_renew),
+        amount=amount,
+    )
+
+def settle(credited):
+    """Refresh caches and notify payers after credits commit."""
+    for payment in credited:
+        entitlement_index.update(payment.telegram_id, payment.subscription_end_date, payment.auto_renew)
+        invalidate_user(payment.telegram_id)
+        payment.notify()
+
+def block_time_of(transaction):
+    """Return a transaction's block time as a naive UTC datetime, or now if it has none."""
+    block_time = (transaction or {}).get('blockTime')
+    return datetime.utcfromtimestamp(block_time) if block_time else datetime.utcnow()
 
-def process_subscription_payment(user, payment_amount):
+class SweepStats:
+    """Throughput counters for one reconciliation sweep."""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.chunks = 0
+        self.users_scanned = 0
+        self.signatures_checked = 0
+        self.transactions_fetched = 0
+        self.payments_applied = 0
+        self.referral_rewards = 0
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started_at
+        return self
+
+    @property
+    def users_per_second(self):
+        return self.users_scanned / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'chunks': self.chunks,
+            'users_scanned': self.users_scanned,
+            'signatures_checked': self.signatures_checked,
+            'transactions_fetched': self.transactions_fetched,
+            'payments_applied': self.payments_applied,
+            'referral_rewards': self.referral_rewards,
+            'elapsed': self.elapsed,
+            'users_per_second': self.users_per_second,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.users_scanned} users in {self.chunks} chunks, "
+            f"{self.signatures_checked} signatures, {self.transactions_fetched} transactions, "
+            f"{self.payments_applied} payments, {self.referral_rewards} referral rewards, "
+            f"{self.elapsed:.2f}s ({self.users_per_second:.1f} users/s)"
+        )
+
+def fetch_lapsed_users(after_id, limit, sweep_time):
+    """Return (id, wallet_address) for the next chunk of users with a wallet and no running subscription."""
+    with read_session() as session:
+        return session.query(User.id, User.wallet_address).filter(
+            User.id > after_id,
+            User.wallet_address.isnot(None),
+            User.subscription_end_date.is_(None) | (User.subscription_end_date < sweep_time)
+        ).order_by(User.id).limit(limit).all()
+
+def reconcile_chunk(session, payments):
     """
-    Process subscription payment for a user.
-    
+    Credit the payments found for one chunk of users without committing.
+
     Args:
-        user (User): User object
-        payment_amount (float): Amount paid in SOL
+        session: Writer session
+        payments (list): (AttributedPayment, block time) per payment
+
+    Returns:
+        list: CreditedPayment for every credited payment
     """
-    with app.app_context():
-        current_time = datetime.utcnow()
-        
-        # Determine subscription type based on payment
-        if payment_amount == 5.0:  # Weekly plan
-            user.subscription_type = 'weekly'
-            user.subscription_start_date = current_time
-            user.subscription_end_date = current_time + timedelta(days=7)
-        elif payment_amount == 1000.0:  # Annual plan
-            user.subscription_type = 'annual'
-            user.subscription_start_date = current_time
-            user.subscription_end_date = current_time + timedelta(days=365)
-        
-        user.last_payment_date = current_time
-        user.last_payment_amount = payment_amount
-        user.total_paid_amount += payment_amount
-        
-        db.session.commit()
-
-def process_referral_rewards(user, payment_amount):
+    credited = []
+    for payment, paid_at in payments:
+        credit = credit_payment(session, payment, paid_at)
+        if credit:
+            credited.append(credit)
+    return credited
+
+async def find_chunk_payments(rpc, wallets, bot_wallet, since, signature_limit, stats, commitment='confirmed'):
     """
-    Process referral rewards for a user's referrer.
-    
-    Args:
-        user (User): User who made the payment
-        payment_amount (float): Amount paid in SOL
+    Find uncredited transfers from a chunk's wallets to the bot wallet.
+
+    Each wallet's recent signatures are listed in one JSON-RPC batch;
+    signatures already in the payment ledger are dropped before the
+    remaining transactions are fetched in a second batch. Wallets or
+    transactions the node cannot serve are skipped until the next sweep.
+
+    Returns:
+        list: (AttributedPayment, block time) per payment
     """
-    with app.app_context():
-        referrer = User.query.filter_by(telegram_id=user.referrer_id).first()
-        
-        if referrer:
-            reward_percentage = referrer.calculate_referral_reward_percentage()
-            referral_reward = payment_amount * (reward_percentage / 100)
-            
-            # Track first referral reward
-            if not referrer.first_referral_reward_claimed:
-                referrer.first_referral_reward_claimed = True
-                referrer.referral_rewards += referral_reward * 2  # 100% reward
-            else:
-                referrer.referral_rewards += referral_reward
-            
-            referrer.paid_referrals += 1
-            
-            # Update referral tier
-            if referrer.paid_referrals % 100 == 0:
-                referrer.referral_tier = min(referrer.referral_tier + 1, 3)
-            
-            db.session.commit()
-
-async def monitor_blockchain_payments():
+    options = {'limit': signature_limit, 'commitment': commitment}
+    pages = await rpc.batch(
+        [('getSignaturesForAddress', [wallet, options]) for wallet in wallets],
+        return_exceptions=True
+    )
+    signatures = []
+    seen = set()
+    for wallet, page in zip(wallets, pages):
+        if isinstance(page, Exception):
+            logger.warning(f"Could not list signatures for {wallet}: {str(page)}")
+            continue
+        for record in page:
+            signature = record['signature']
+            if record.get('err') is not None or signature in seen:
+                continue
+            if record.get('blockTime') and record['blockTime'] < since:
+                continue
+            seen.add(signature)
+            signatures.append(signature)
+    stats.signatures_checked += len(signatures)
+
+    signatures = payment_ledger.new_signatures(signatures)
+    if not signatures:
+        return []
+    transactions = await rpc.get_transactions(signatures, commitment, return_exceptions=True)
+    fetched = {
+        signature: transaction for signature, transaction in zip(signatures, transactions)
+        if transaction and not isinstance(transaction, Exception)
+    }
+    stats.transactions_fetched += len(fetched)
+
+    attributed, _ = attribute(decode_transfers(fetched.items(), bot_wallet), wallet_index)
+    return [(payment, block_time_of(fetched[payment.signature])) for payment in attributed]
+
+async def monitor_blockchain_payments(chunk_size=None, rpc=None):
     """
-    Background service to monitor Solana blockchain for payments
-    - Check for new payments to bot's wallet
-    - Verify and process subscriptions
-    - Distribute referral rewards
+    Reconcile lapsed subscriptions against the chain.
+
+    The payment watcher credits transfers as they reach the bot wallet, but
+    it cannot credit a transfer from a wallet that was registered with
+    /wallet only afterwards, or one that landed before its cursor existed.
+    This sweep walks users with a wallet and no running subscription in
+    keyset-paginated chunks, looks up each wallet's recent transfers to
+    the bot wallet, and credits the ones missing from the payment ledger.
+
+    Args:
+        chunk_size (int): Users per chunk, defaults to RECONCILE_CHUNK_SIZE
+        rpc (RpcGateway): Gateway to query, defaults to the shared one
+
+    Returns:
+        SweepStats: Throughput metrics for the sweep
     """
+    chunk_size = chunk_size or int(os.getenv('RECONCILE_CHUNK_SIZE', '500'))
+    signature_limit = int(os.getenv('RECONCILE_SIGNATURE_LIMIT', '20'))
+    lookback = timedelta(days=int(os.getenv('RECONCILE_LOOKBACK_DAYS', '30')))
+    stats = SweepStats()
     try:
-        # TODO: Replace with actual Solana blockchain transaction retrieval
-        # This is a placeholder for blockchain payment monitoring
-        with app.app_context():
-            # Find users with pending subscriptions
-            users_to_check = User.query.filter(
-                User.wallet_address.isnot(None),
-                User.subscription_end_date.is_(None) | (User.subscription_end_date < datetime.utcnow())
-            ).all()
-            
-            for user in users_to_check:
-                # Simulate blockchain payment check
-                transaction_details = {
-                    'from_address': user.wallet_address,
-                    'to_address': get_bot_wallet_address(),
-                    'amount': 5.0  # Simulated weekly payment
-                }
-                
-                if await verify_blockchain_payment(transaction_details):
-                    process_subscription_payment(user, transaction_details['amount'])
-                    process_referral_rewards(user, transaction_details['amount'])
-                    
-                    logger.info(f"Processed payment for user {user.username}")
-    
+        rpc = rpc or get_rpc_gateway()
+        bot_wallet = get_bot_wallet_address()
+        if not bot_wallet:
+            logger.error("BOT_SOLANA_WALLET_ADDRESS is not set, skipping payment reconciliation.")
+            return stats.finish()
+        sweep_time = datetime.utcnow()
+        since = to_epoch(sweep_time - lookback)
+        last_id = 0
+
+        while True:
+            users = fetch_lapsed_users(last_id, chunk_size, sweep_time)
+            if not users:
+                break
+            last_id = users[-1][0]
+
+            payments = await find_chunk_payments(
+                rpc, [wallet for _, wallet in users], bot_wallet, since, signature_limit, stats
+            )
+            # Amounts are priced at block time; unpriced ones wait for the next sweep
+            uncovered = set(await plan_pricing.ensure(paid_at for _, paid_at in payments))
+            payments = [(payment, paid_at) for payment, paid_at in payments if paid_at not in uncovered]
+            credited = await db_writer.write(lambda session: reconcile_chunk(session, payments)) if payments else []
+            payment_ledger.remember(payment.signature for payment, _ in payments)
+            settle(credited)
+
+            stats.chunks += 1
+            stats.users_scanned += len(users)
+            stats.payments_applied += len(credited)
+            stats.referral_rewards += sum(1 for credit in credited if credit.referrer_id)
+
     except Exception as e:
         logger.error(f"Error in blockchain payment monitoring: {str(e)}")
 
+    logger.info(f"Payment reconciliation sweep: {stats.finish()}")
+    return stats
+
+class PaymentReconciler:
+    """
+    Runs the reconciliation sweep every `interval` seconds.
+
+    Only the worker holding the reconciliation lease sweeps, so several
+    workers on one PostgreSQL database don't each query every wallet.
+    """
+
+    def __init__(self, interval=3600.0, lease=None):
+        self.interval = interval
+        self.lease = lease or AdvisoryLease(RECONCILE_LOCK_KEY, 'Reconciliation')
+        self.sweeps = 0
+        self.last_sweep = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a reconciler from environment variables."""
+        return cls(interval=float(os.getenv('RECONCILE_INTERVAL', '3600')))
+
+    async def run(self):
+        """Sweep on the interval until cancelled."""
+        set_background_priority()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self.lease.check() or self.lease.acquire():
+                    self.last_sweep = await monitor_blockchain_payments()
+                    self.sweeps += 1
+        finally:
+            self.lease.release()
+
+    def stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'last_sweep': self.last_sweep.as_dict() if self.last_sweep else None,
+        }
+
+payment_reconciler = PaymentReconciler.from_env()
+stats_registry.register('reconciliation', payment_reconciler.stats)
+
 def run_monitoring():
-    asyncio.run(monitor_blockchain_payments())
\ No newline at end of file
+    """Run one reconciliation sweep outside the bot, e.g. from a cron job."""
+    async def sweep():
+        try:
+            return await monitor_blockchain_payments()
+        finally:
+            await close_rpc_gateway()
+
+    try:
+        return asyncio.run(sweep())
+    finally:
+        db_writer.stop()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import time
+
+from rpc_gateway import get_rpc_gateway
+from request_scheduler import set_background_priority
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+# Average Solana block time used to estimate the current block height
+SECONDS_PER_BLOCK = 0.4
+
+FEE_PERCENTILES = (25, 50, 75, 90)
+
+
+def fee_percentiles(fees, percentiles=FEE_PERCENTILES):
+    """
+    Summarize getRecentPrioritizationFees results.
+
+    Returns:
+        dict: Percentile -> micro-lamports per compute unit
+    """
+    values = sorted(int(entry.get('prioritizationFee', 0)) for entry in fees or [])
+    if not values:
+        return {percentile: 0 for percentile in percentiles}
+    return {
+        percentile: values[min(len(values) - 1, percentile * len(values) // 100)]
+        for percentile in percentiles
+    }
+
+
+class BlockhashInfo:
+    """A recent blockhash with the fee estimates fetched alongside it."""
+
+    __slots__ = ('blockhash', 'last_valid_block_height', 'block_height', 'priority_fees', 'fetched_at')
+
+    def __init__(self, blockhash, last_valid_block_height, block_height, priority_fees, fetched_at):
+        self.blockhash = blockhash
+        self.last_valid_block_height = last_valid_block_height
+        self.block_height = block_height
+        self.priority_fees = priority_fees
+        self.fetched_at = fetched_at
+
+    def age(self, now=None):
+        return (now or time.monotonic()) - self.fetched_at
+
+    def blocks_remaining(self, now=None):
+        """Estimate how many blocks remain before the blockhash expires."""
+        estimated_height = self.block_height + self.age(now) / SECONDS_PER_BLOCK
+        return self.last_valid_block_height - estimated_height
+
+    def priority_fee(self, percentile):
+        return self.priority_fees.get(percentile, 0)
+
+
+class BlockhashCache:
+    """
+    Background-refreshed recent blockhash and priority fee estimates.
+
+    The latest blockhash, current block height and recent prioritization
+    fees are fetched in one batched round trip every `refresh_interval`
+    seconds, so building a transaction needs no RPC call. The refresh runs
+    well before the blockhash's last valid block height; a read only falls
+    back to fetching when the cached value is older than `max_age` or too
+    close to expiry.
+    """
+
+    def __init__(self, rpc=None, commitment='confirmed', refresh_interval=10.0,
+                 max_age=30.0, min_blocks_remaining=60):
+        self.rpc = rpc
+        self.commitment = commitment
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.min_blocks_remaining = min_blocks_remaining
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._current = None
+        self._refreshing = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache from environment variables."""
+        return cls(
+            commitment=os.getenv('BLOCKHASH_COMMITMENT', 'confirmed'),
+            refresh_interval=float(os.getenv('BLOCKHASH_REFRESH_INTERVAL', '10')),
+            max_age=float(os.getenv('BLOCKHASH_MAX_AGE', '30')),
+        )
+
+    @property
+    def client(self):
+        return self.rpc or get_rpc_gateway()
+
+    def _usable(self, info, now=None):
+        return (
+            info is not None
+            and info.age(now) < self.max_age
+            and info.blocks_remaining(now) > self.min_blocks_remaining
+        )
+
+    async def get(self):
+        """
+        Return a usable blockhash, fetching only if the cache is stale.
+
+        Returns:
+            BlockhashInfo: Current blockhash and fee estimates
+        """
+        info = self._current
+        if self._usable(info):
+            self.hits += 1
+            return info
+        self.misses += 1
+        return await self.refresh()
+
+    async def refresh(self):
+        """Fetch a new blockhash; concurrent callers share one request."""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._fetch())
+        refreshing = self._refreshing
+        try:
+            return await asyncio.shield(refreshing)
+        finally:
+            if self._refreshing is refreshing and refreshing.done():
+                self._refreshing = None
+
+    async def _fetch(self):
+        try:
+            blockhash, block_height, fees = await self.client.batch([
+                ('getLatestBlockhash', [{'commitment': self.commitment}]),
+                ('getBlockHeight', [{'commitment': self.commitment}]),
+                ('getRecentPrioritizationFees', []),
+            ])
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        info = BlockhashInfo(
+            blockhash['value']['blockhash'],
+            blockhash['value']['lastValidBlockHeight'],
+            block_height,
+            fee_percentiles(fees),
+            time.monotonic()
+        )
+        self._current = info
+        self.refreshes += 1
+        return info
+
+    async def run(self):
+        """Refresh on a fixed interval until cancelled."""
+        set_background_priority()
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Blockhash refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self):
+        """Return hit/miss counters and the age of the cached blockhash."""
+        info = self._current
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'staleness': info.age() if info else None,
+            'blocks_remaining': info.blocks_remaining() if info else None,
+        }
+
+
+blockhash_cache = BlockhashCache.from_env()
+stats_registry.register('blockhash_cache', blockhash_cache.stats)
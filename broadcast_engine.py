@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden
+
+from models import Broadcast, User
+from request_scheduler import set_background_priority
+from storage import AdvisoryLease, db_writer, read_session
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_KEYS = {'type': 'subscription_type', 'tier': 'min_referral_tier', 'active': 'active_days'}
+
+# Arbitrary key for pg_try_advisory_lock; its holder is the one delivering worker
+BROADCAST_LOCK_KEY = 7274116
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Recipient filter for a broadcast. Unset fields match everyone."""
+
+    subscription_type: str = None  # 'weekly', 'annual' or 'none'
+    min_referral_tier: int = None
+    active_days: int = None  # traded or paid within this many days
+
+    @classmethod
+    def parse(cls, tokens):
+        """
+        Build a segment from 'type=weekly', 'tier=2' and 'active=30' tokens.
+
+        Raises:
+            ValueError: On an unknown key or a malformed value
+        """
+        fields = {}
+        for token in tokens:
+            key, _, value = token.partition('=')
+            if key not in SEGMENT_KEYS or not value:
+                raise ValueError(f"Unknown segment filter: {token}")
+            fields[SEGMENT_KEYS[key]] = value if key == 'type' else int(value)
+        return cls(**fields)
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(**json.loads(value or '{}'))
+
+    def to_json(self):
+        return json.dumps({key: value for key, value in asdict(self).items() if value is not None})
+
+    def apply(self, query, now):
+        if self.subscription_type == 'none':
+            query = query.filter(User.subscription_type.is_(None))
+        elif self.subscription_type:
+            query = query.filter(User.subscription_type == self.subscription_type)
+        if self.min_referral_tier is not None:
+            query = query.filter(User.referral_tier >= self.min_referral_tier)
+        if self.active_days is not None:
+            cutoff = now - timedelta(days=self.active_days)
+            query = query.filter((User.last_trade_date >= cutoff) | (User.last_payment_date >= cutoff))
+        return query
+
+    def describe(self):
+        filters = [f"{key}={getattr(self, field)}" for key, field in SEGMENT_KEYS.items()
+                   if getattr(self, field) is not None]
+        return ', '.join(filters) or 'all users'
+
+
+class BroadcastJob:
+    """In-memory progress of the broadcast being delivered."""
+
+    def __init__(self, row):
+        self.id = row.id
+        self.text = row.text
+        self.segment = Segment.from_json(row.segment)
+        self.last_user_id = row.last_user_id
+        self.total = row.total
+        self.sent = row.sent
+        self.failed = row.failed
+        self.cancelled = False
+        self.started_at = time.monotonic()
+        self.processed_at_start = row.sent + row.failed
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @property
+    def sends_per_second(self):
+        elapsed = time.monotonic() - self.started_at
+        return (self.processed - self.processed_at_start) / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self):
+        """Seconds until every recipient has been tried, or None before a rate is known."""
+        rate = self.sends_per_second
+        return max(0, self.total - self.processed) / rate if rate else None
+
+    def stats(self):
+        return {
+            'id': self.id,
+            'segment': self.segment.describe(),
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'last_user_id': self.last_user_id,
+            'sends_per_second': self.sends_per_second,
+            'eta_seconds': self.eta,
+        }
+
+
+def count_recipients(segment, now):
+    with read_session() as session:
+        return segment.apply(session.query(User.id), now).count()
+
+
+def fetch_recipients(segment, after_id, limit, now):
+    """Return (id, telegram_id) for the next page of recipients after a users.id."""
+    with read_session() as session:
+        query = session.query(User.id, User.telegram_id).filter(User.id > after_id)
+        return segment.apply(query, now).order_by(User.id).limit(limit).all()
+
+
+def save_checkpoint(session, job, status='running'):
+    """Persist a broadcast's progress without committing."""
+    broadcast = session.get(Broadcast, job.id)
+    if broadcast.status == 'cancelled':
+        job.cancelled = True
+        return
+    broadcast.last_user_id = job.last_user_id
+    broadcast.sent = job.sent
+    broadcast.failed = job.failed
+    broadcast.status = status
+    if status != 'running':
+        broadcast.completed_at = datetime.utcnow()
+
+
+class BroadcastEngine:
+    """
+    Resumable announcements to every user, or a segment of them.
+
+    Recipients are streamed in pages with keyset pagination over users.id,
+    so a page costs the same however far into the table the job is. Each
+    page fans out across `workers` concurrent sends; the bot's rate limiter
+    paces them at the maximum global send rate, at background priority so
+    replies to user commands go first. The last users.id of a finished page
+    is checkpointed with the counters, and a restart resumes from there.
+    Recipients never see more than the page that was in flight twice.
+
+    Only the worker holding the broadcast lease delivers, so several
+    workers on one PostgreSQL database don't each send every announcement.
+    The others retry the lease every `poll_interval`; a worker that takes
+    it over resumes from the last checkpoint.
+    """
+
+    def __init__(self, bot=None, workers=32, page_size=500, progress_interval=30.0, writer=db_writer,
+                 poll_interval=5.0, lease=None):
+        self.bot = bot
+        self.workers = workers
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.writer = writer
+        self.poll_interval = poll_interval
+        self.lease = lease or AdvisoryLease(BROADCAST_LOCK_KEY, 'Broadcast')
+        self.job = None
+        self._wakeup = asyncio.Event()
+
+    @classmethod
+    def from_env(cls):
+        """Build a broadcast engine from environment variables."""
+        return cls(
+            workers=int(os.getenv('BROADCAST_WORKERS', '32')),
+            page_size=int(os.getenv('BROADCAST_PAGE_SIZE', '500')),
+            progress_interval=float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '30')),
+            poll_interval=float(os.getenv('BROADCAST_POLL_INTERVAL', '5')),
+        )
+
+    def attach(self, bot):
+        self.bot = bot
+
+    async def create(self, text, segment, created_by=None):
+        """
+        Queue a broadcast for delivery.
+
+        Returns:
+            tuple: (broadcast id, number of recipients)
+        """
+        total = count_recipients(segment, datetime.utcnow())
+
+        def insert(session):
+            broadcast = Broadcast(text=text, segment=segment.to_json(), total=total, created_by=created_by)
+            session.add(broadcast)
+            session.flush()
+            return broadcast.id
+
+        broadcast_id = await self.writer.write(insert)
+        self._wakeup.set()
+        return broadcast_id, total
+
+    async def cancel(self):
+        """
+        Cancel every unfinished broadcast.
+
+        Returns:
+            int: Number of broadcasts cancelled
+        """
+        def cancel_running(session):
+            return session.query(Broadcast).filter_by(status='running').update(
+                {'status': 'cancelled', 'completed_at': datetime.utcnow()}, synchronize_session=False
+            )
+
+        cancelled = await self.writer.write(cancel_running)
+        if self.job:
+            self.job.cancelled = True
+        return cancelled
+
+    def _next_broadcast(self):
+        with read_session() as session:
+            return session.query(Broadcast).filter_by(status='running').order_by(Broadcast.id).first()
+
+    async def run(self):
+        """Deliver queued broadcasts one at a time until cancelled."""
+        set_background_priority()
+        try:
+            while True:
+                self._wakeup.clear()
+                # Broadcasts queued on other workers only show up by polling
+                row = self._next_broadcast() if self.lease.check() or self.lease.acquire() else None
+                if row is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self.job = BroadcastJob(row)
+                try:
+                    await self._deliver(self.job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Broadcast {row.id} stopped: {str(e)}")
+                    await asyncio.sleep(self.progress_interval)
+                finally:
+                    self.job = None
+        finally:
+            self.lease.release()
+
+    async def _deliver(self, job):
+        logger.info(f"Broadcast {job.id} to {job.segment.describe()} resuming after user {job.last_user_id}")
+        semaphore = asyncio.Semaphore(self.workers)
+        now = datetime.utcnow()
+        last_report = time.monotonic()
+
+        while not job.cancelled:
+            page = fetch_recipients(job.segment, job.last_user_id, self.page_size, now)
+            if not page:
+                await self.writer.write(lambda session: save_checkpoint(session, job, 'completed'))
+                logger.info(f"Broadcast {job.id} completed: {job.sent} sent, {job.failed} failed")
+                return
+            await asyncio.gather(*(self._send(job, telegram_id, semaphore) for _, telegram_id in page))
+            job.last_user_id = page[-1][0]
+            await self.writer.write(lambda session: save_checkpoint(session, job))
+            if not self.lease.check():
+                # Another worker may resume from the checkpoint now; stop sending here
+                logger.error(f"Broadcast lease lost; handing broadcast {job.id} over after user {job.last_user_id}")
+                return
+
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                eta = f"{job.eta:.0f}s" if job.eta is not None else 'unknown'
+                logger.info(
+                    f"Broadcast {job.id}: {job.processed}/{job.total} "
+                    f"({job.sends_per_second:.1f} sends/s, ETA {eta})"
+                )
+        logger.info(f"Broadcast {job.id} cancelled after {job.processed} recipients")
+
+    async def _send(self, job, telegram_id, semaphore):
+        async with semaphore:
+            if job.cancelled:
+                return
+            try:
+                await self.bot.send_message(chat_id=telegram_id, text=job.text)
+                job.sent += 1
+            except Forbidden:
+                # User blocked the bot
+                job.failed += 1
+            except Exception as e:
+                job.failed += 1
+                logger.debug(f"Broadcast {job.id} to {telegram_id} failed: {str(e)}")
+
+    def stats(self):
+        """Progress of the running broadcast, from its last checkpoint if another worker delivers it."""
+        if self.job:
+            return self.job.stats()
+        row = self._next_broadcast()
+        return BroadcastJob(row).stats() if row else None
+
+
+broadcast_engine = BroadcastEngine.from_env()
+stats_registry.register('broadcast', broadcast_engine.stats)
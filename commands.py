@@ -1,4 +1,11 @@
-from blockchain_monitor import AsyncClient
+import base64
+
+from solana.transaction import Transaction
+from solders.compute_budget import set_compute_unit_price
+from solders.hash import Hash
+from solders.pubkey import Pubkey
+from solders.system_program import TransferParams, transfer
+from solders.transaction import Transaction as SignedTransaction
 
 from shared_resources import os
 
@@ -7,13 +14,121 @@ from blockchain_monitor import datetime
 from shared_resources import app
 
 from telegram import Update
-from telegram.ext import CallbackContext
+from telegram.ext import ContextTypes
 from models import db, User
+from trade_engine import trade_engine
+from user_cache import get_user_snapshot, invalidate_user
+from entitlements import entitlement_index, is_entitled
+from storage import db_writer
+from tx_outbox import delete_unsigned, load_unsigned, save_unsigned, tx_outbox
+from blockhash_cache import blockhash_cache
+from balance_service import balance_service
+from message_dispatcher import message_dispatcher
+from broadcast_engine import Segment, broadcast_engine
+from token_registry import token_registry
+from plan_pricing import PLANS, plan_pricing
 import logging
 
 logger = logging.getLogger(__name__)
 
-def subscribe_command(update: Update, context: CallbackContext) -> None:
+# Percentile of recent prioritization fees paid on bot-built transactions
+PRIORITY_FEE_PERCENTILE = int(os.getenv('TX_PRIORITY_FEE_PERCENTILE', '75'))
+
+# Telegram ids allowed to run admin commands
+ADMIN_TELEGRAM_IDS = {int(value) for value in os.getenv('ADMIN_TELEGRAM_IDS', '').split(',') if value.strip()}
+
+def build_transfer_transaction(from_address, to_address, lamports, recent_blockhash=None, priority_fee=0):
+    """Build an unsigned native SOL transfer transaction paid for by the sender."""
+    transaction = Transaction(
+        recent_blockhash=Hash.from_string(recent_blockhash) if recent_blockhash else None,
+        fee_payer=Pubkey.from_string(from_address)
+    )
+    if priority_fee:
+        # Micro-lamports per compute unit
+        transaction.add(set_compute_unit_price(priority_fee))
+    return transaction.add(
+        transfer(TransferParams(
+            from_pubkey=Pubkey.from_string(from_address),
+            to_pubkey=Pubkey.from_string(to_address),
+            lamports=lamports
+        ))
+    )
+
+class UnsignedOrder:
+    """A /buy or /sell transaction waiting for the user's wallet signature."""
+    
+    __slots__ = ('chat_id', 'kind', 'token', 'amount', 'message', 'unsigned', 'last_valid_block_height')
+    
+    def __init__(self, chat_id, kind, token, amount, transaction, last_valid_block_height):
+        self.chat_id = chat_id
+        self.kind = kind
+        self.token = token
+        self.amount = amount
+        self.message = bytes(transaction.serialize_message())
+        self.unsigned = bytes(transaction.serialize(verify_signatures=False))
+        self.last_valid_block_height = last_valid_block_height
+    
+    def encoded(self):
+        return base64.b64encode(self.unsigned).decode('ascii')
+    
+    async def save(self, telegram_id):
+        """Persist the order as the user's latest; a new /buy or /sell replaces it."""
+        await db_writer.write(lambda session: save_unsigned(
+            session, telegram_id, self.chat_id, self.kind, self.token, self.amount,
+            self.message, self.last_valid_block_height
+        ))
+
+def unknown_token_message(text):
+    """Tell the user a token symbol is unknown and suggest close matches."""
+    suggestions = token_registry.suggest(text)
+    message = f"❌ Unknown token: {text}"
+    if suggestions:
+        message += "\nDid you mean: " + ", ".join(token.symbol for token in suggestions) + "?"
+    return message
+
+async def quote_line(token, amount):
+    """Describe what `amount` SOL is worth in a token at the cached quote, or '' without a quote."""
+    price = await token_registry.price_in_sol(token)
+    if not price:
+        return ""
+    return f"Quote: 1 {token.symbol} = {price:.6g} SOL (≈ {amount / price:,.6g} {token.symbol})\n"
+
+async def record_trade(telegram_id, signature):
+    """Update a user's trading stats after a verified transaction."""
+    def update_stats(session):
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        db_user.total_trades += 1
+        db_user.last_trade_date = datetime.utcnow()
+        db_user.is_trading_enabled = True
+        db_user.last_transaction_signature = signature
+    
+    await db_writer.write(update_stats)
+    invalidate_user(telegram_id)
+
+async def handle_settled_transaction(pending):
+    """Notify a user that a submitted transaction confirmed, failed or expired."""
+    label = pending.kind.capitalize()
+    snapshot = get_user_snapshot(pending.telegram_id)
+    if snapshot and snapshot.wallet_address:
+        balance_service.invalidate(snapshot.wallet_address, pending.slot)
+    if pending.status == 'confirmed':
+        await record_trade(pending.telegram_id, pending.signature)
+        text = (
+            f"✅ {label} order confirmed!\n"
+            f"Token: {pending.token}\n"
+            f"Amount: {pending.amount} SOL\n"
+            f"Transaction Signature: {pending.signature}"
+        )
+    elif pending.status == 'expired':
+        text = (
+            f"⌛ {label} order expired before it was confirmed and will not be executed.\n"
+            f"Please try again."
+        )
+    else:
+        text = f"❌ {label} order failed on-chain: {pending.error}"
+    message_dispatcher.send(pending.chat_id, text)
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /subscribe command."""
     subscription_text = """
 💰 Available Subscription Plans:
@@ -36,343 +151,414 @@ To subscribe:
 Your subscription will activate automatically
 once payment is confirmed on-chain.
 """
-    update.message.reply_text(subscription_text)
+    # Plans are priced in USD; show what they cost in SOL at the current rate
+    amounts = [(plan, plan_pricing.expected_amount(plan)) for plan in PLANS]
+    if all(amount for _, amount in amounts):
+        subscription_text += "\nAt the current SOL price:\n" + "\n".join(
+            f"   • {plan.name.capitalize()}: {amount:.4f} SOL" for plan, amount in amounts
+        ) + "\n"
+    message_dispatcher.reply(update, subscription_text)
 
-def autopay_command(update: Update, context: CallbackContext) -> None:
+async def autopay_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /autopay command."""
     user = update.effective_user
     
     if not context.args:
-        update.message.reply_text("Usage: /autopay on - Enable auto-renewal\n"
-                                 "       /autopay off - Disable auto-renewal")
+        message_dispatcher.reply(update, "Usage: /autopay on - Enable auto-renewal\n"
+                                       "       /autopay off - Disable auto-renewal")
         return
     
     setting = context.args[0].lower()
     if setting not in ['on', 'off']:
-        update.message.reply_text("Invalid option. Use 'on' or 'off'.")
+        message_dispatcher.reply(update, "Invalid option. Use 'on' or 'off'.")
         return
     
-    with app.app_context():
+    cached_user = get_user_snapshot(user.id)
+    if not cached_user:
+        message_dispatcher.reply(update, "Please start the bot first with /start")
+        return
+    
+    if not cached_user.wallet_address:
+        message_dispatcher.reply(update, "Please set your wallet first using /wallet")
+        return
+    
+    def set_auto_renew(session):
         db_user = User.query.filter_by(telegram_id=user.id).first()
-        if not db_user:
-            update.message.reply_text("Please start the bot first with /start")
-            return
-        
-        if not db_user.wallet_address:
-            update.message.reply_text("Please set your wallet first using /wallet")
-            return
-        
         db_user.auto_renew = (setting == 'on')
-        db.session.commit()
-        
-        status = "enabled" if setting == 'on' else "disabled"
-        update.message.reply_text(f"Auto-renewal has been {status}.")
+        return db_user.subscription_end_date
+    
+    end_date = await db_writer.write(set_auto_renew)
+    entitlement_index.update(user.id, end_date, setting == 'on')
+    invalidate_user(user.id)
+    
+    status = "enabled" if setting == 'on' else "disabled"
+    message_dispatcher.reply(update, f"Auto-renewal has been {status}.")
 
-def buy_command(update: Update, context: CallbackContext) -> None:
+async def buy_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /buy command for executing buy transactions."""
     user = update.effective_user
     
     # Validate command arguments
     if not context.args or len(context.args) != 2:
-        update.message.reply_text(
+        message_dispatcher.reply(update,
             "Usage: /buy <token_symbol> <amount>\n"
             "Example: /buy SOL 0.5"
         )
         return
     
-    token_symbol = context.args[0].upper()
+    token = token_registry.resolve(context.args[0])
+    if token is None:
+        message_dispatcher.reply(update, unknown_token_message(context.args[0]))
+        return
     try:
         amount = float(context.args[1])
         if amount <= 0:
             raise ValueError("Amount must be positive")
     except ValueError:
-        update.message.reply_text("Invalid amount. Please enter a positive number.")
+        message_dispatcher.reply(update, "Invalid amount. Please enter a positive number.")
         return
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        
-        # Check if user is authenticated and has a wallet
-        if not db_user or not db_user.wallet_address:
-            update.message.reply_text("Please set up your wallet first using /wallet command.")
+    db_user = get_user_snapshot(user.id)
+    
+    # Check if user is authenticated and has a wallet
+    if not db_user or not db_user.wallet_address:
+        message_dispatcher.reply(update, "Please set up your wallet first using /wallet command.")
+        return
+    
+    # Check if user has an active subscription
+    if not is_entitled(user.id):
+        message_dispatcher.reply(update, "You need an active subscription to use trading features. Use /subscribe to activate.")
+        return
+    
+    try:
+        # Validate wallet balance (coalesced and cached across commands)
+        wallet_balance = await balance_service.get_sol_balance(db_user.wallet_address)
+        balance_service.track(db_user.wallet_address)
+        if wallet_balance < amount:
+            message_dispatcher.reply(update, f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
             return
         
-        # Check if user has an active subscription
-        if not db_user.is_subscription_active():
-            update.message.reply_text("You need an active subscription to use trading features. Use /subscribe to activate.")
-            return
+        # Prepare transaction
+        recent = await blockhash_cache.get()
+        transaction = build_transfer_transaction(
+            db_user.wallet_address,
+            os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
+            int(amount * 1_000_000_000),  # Convert SOL to lamports
+            recent_blockhash=recent.blockhash,
+            priority_fee=recent.priority_fee(PRIORITY_FEE_PERCENTILE)
+        )
         
-        try:
-            # Connect to Solana blockchain
-            solana_rpc_url = os.getenv('SOLANA_RPC_ENDPOINT')
-            client = AsyncClient(solana_rpc_url)
-            
-            # Validate wallet balance
-            wallet_balance = await client.get_balance(db_user.wallet_address)
-            if wallet_balance < amount:
-                update.message.reply_text(f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
-                return
-            
-            # Prepare transaction
-            transaction = Transaction().add(
-                client.transfer(
-                    from_pubkey=db_user.wallet_address, 
-                    to_pubkey=os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    lamports=int(amount * 1_000_000_000)  # Convert SOL to lamports
-                )
-            )
+        # The bot holds no user keys: the user's wallet signs, /submit broadcasts
+        unsigned = UnsignedOrder(
+            update.effective_chat.id, 'buy', token.symbol, amount, transaction, recent.last_valid_block_height
+        )
+        await unsigned.save(user.id)
+        
+        message_dispatcher.reply(update,
+            f"✍️ Buy order ready to sign\n"
+            f"Token: {token.symbol}\n"
+            f"Amount: {amount} SOL\n"
+            f"{await quote_line(token, amount)}\n"
+            f"Sign this transaction with your wallet and send it back with\n"
+            f"/submit <signed transaction in base64>\n\n"
+            f"{unsigned.encoded()}"
+        )
             
-            # Sign and send transaction
-            try:
-                signature = await client.send_transaction(transaction)
-                
-                # Verify transaction
-                transaction_details = {
-                    'from_address': db_user.wallet_address,
-                    'to_address': os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    'amount': amount,
-                    'transaction_signature': signature
-                }
-                
-                # Verify blockchain payment
-                from blockchain_monitor import verify_blockchain_payment
-                is_valid = await verify_blockchain_payment(transaction_details)
-                
-                if is_valid:
-                    # Update user's trading stats
-                    db_user.total_trades += 1
-                    db_user.last_trade_date = datetime.utcnow()
-                    db_user.is_trading_enabled = True
-                    db_user.last_transaction_signature = signature
-                    db.session.commit()
-                    
-                    update.message.reply_text(
-                        f"📈 Buy order executed successfully!\n"
-                        f"Token: {token_symbol}\n"
-                        f"Amount: {amount} SOL\n"
-                        f"Transaction Signature: {signature}"
-                    )
-                else:
-                    update.message.reply_text("❌ Transaction verification failed.")
-                    
-            except Exception as e:
-                logger.error(f"Buy transaction failed: {str(e)}")
-                update.message.reply_text("❌ Failed to execute buy order. Please try again later.")
-                
-        except Exception as e:
-            logger.error(f"Error connecting to blockchain: {str(e)}")
-            update.message.reply_text("❌ Failed to connect to blockchain. Please try again later.")
-def sell_command(update: Update, context: CallbackContext) -> None:
+    except Exception as e:
+        logger.error(f"Error connecting to blockchain: {str(e)}")
+        message_dispatcher.reply(update, "❌ Failed to connect to blockchain. Please try again later.")
+async def sell_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /sell command for executing sell transactions."""
     user = update.effective_user
     
     # Validate command arguments
     if not context.args or len(context.args) != 2:
-        update.message.reply_text(
+        message_dispatcher.reply(update,
             "Usage: /sell <token_symbol> <amount>\n"
             "Example: /sell SOL 0.5"
         )
         return
     
-    token_symbol = context.args[0].upper()
+    token = token_registry.resolve(context.args[0])
+    if token is None:
+        message_dispatcher.reply(update, unknown_token_message(context.args[0]))
+        return
     try:
         amount = float(context.args[1])
         if amount <= 0:
             raise ValueError("Amount must be positive")
     except ValueError:
-        update.message.reply_text("Invalid amount. Please enter a positive number.")
+        message_dispatcher.reply(update, "Invalid amount. Please enter a positive number.")
         return
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        
-        # Check if user is authenticated and has a wallet
-        if not db_user or not db_user.wallet_address:
-            update.message.reply_text("Please set up your wallet first using /wallet command.")
+    db_user = get_user_snapshot(user.id)
+    
+    # Check if user is authenticated and has a wallet
+    if not db_user or not db_user.wallet_address:
+        message_dispatcher.reply(update, "Please set up your wallet first using /wallet command.")
+        return
+    
+    # Check if user has an active subscription
+    if not is_entitled(user.id):
+        message_dispatcher.reply(update, "You need an active subscription to use trading features. Use /subscribe to activate.")
+        return
+    
+    try:
+        # Validate wallet balance (coalesced and cached across commands)
+        wallet_balance = await balance_service.get_sol_balance(db_user.wallet_address)
+        balance_service.track(db_user.wallet_address)
+        if wallet_balance < amount:
+            message_dispatcher.reply(update, f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
             return
         
-        # Check if user has an active subscription
-        if not db_user.is_subscription_active():
-            update.message.reply_text("You need an active subscription to use trading features. Use /subscribe to activate.")
-            return
+        # Prepare transaction
+        recent = await blockhash_cache.get()
+        transaction = build_transfer_transaction(
+            db_user.wallet_address,
+            os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
+            int(amount * 1_000_000_000),  # Convert SOL to lamports
+            recent_blockhash=recent.blockhash,
+            priority_fee=recent.priority_fee(PRIORITY_FEE_PERCENTILE)
+        )
         
-        try:
-            # Connect to Solana blockchain
-            solana_rpc_url = os.getenv('SOLANA_RPC_ENDPOINT')
-            client = AsyncClient(solana_rpc_url)
-            
-            # Validate wallet balance
-            wallet_balance = await client.get_balance(db_user.wallet_address)
-            if wallet_balance < amount:
-                update.message.reply_text(f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
-                return
-            
-            # Prepare transaction
-            transaction = Transaction().add(
-                client.transfer(
-                    from_pubkey=db_user.wallet_address, 
-                    to_pubkey=os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    lamports=int(amount * 1_000_000_000)  # Convert SOL to lamports
-                )
-            )
+        # The bot holds no user keys: the user's wallet signs, /submit broadcasts
+        unsigned = UnsignedOrder(
+            update.effective_chat.id, 'sell', token.symbol, amount, transaction, recent.last_valid_block_height
+        )
+        await unsigned.save(user.id)
+        
+        message_dispatcher.reply(update,
+            f"✍️ Sell order ready to sign\n"
+            f"Token: {token.symbol}\n"
+            f"Amount: {amount} SOL\n"
+            f"{await quote_line(token, amount)}\n"
+            f"Sign this transaction with your wallet and send it back with\n"
+            f"/submit <signed transaction in base64>\n\n"
+            f"{unsigned.encoded()}"
+        )
             
-            # Sign and send transaction
-            try:
-                signature = await client.send_transaction(transaction)
-                
-                # Verify transaction
-                transaction_details = {
-                    'from_address': db_user.wallet_address,
-                    'to_address': os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    'amount': amount,
-                    'transaction_signature': signature
-                }
-                
-                # Verify blockchain payment
-                from blockchain_monitor import verify_blockchain_payment
-                is_valid = await verify_blockchain_payment(transaction_details)
-                
-                if is_valid:
-                    # Update user's trading stats
-                    db_user.total_trades += 1
-                    db_user.last_trade_date = datetime.utcnow()
-                    db_user.is_trading_enabled = True
-                    db_user.last_transaction_signature = signature
-                    db.session.commit()
-                    
-                    update.message.reply_text(
-                        f"📉 Sell order executed successfully!\n"
-                        f"Token: {token_symbol}\n"
-                        f"Amount: {amount} SOL\n"
-                        f"Transaction Signature: {signature}"
-                    )
-                else:
-                    update.message.reply_text("❌ Transaction verification failed.")
-                    
-def trade_command(update: Update, context: CallbackContext) -> None:
+    except Exception as e:
+        logger.error(f"Error connecting to blockchain: {str(e)}")
+        message_dispatcher.reply(update, "❌ Failed to connect to blockchain. Please try again later.")
+
+async def trade_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /trade command for P2P trading."""
     user = update.effective_user
     
     # Validate command arguments
     if not context.args or len(context.args) != 4:
-        update.message.reply_text(
+        message_dispatcher.reply(update,
             "Usage: /trade <token_symbol> <amount> <price> <trade_type>\n"
             "Example: /trade SOL 0.5 50 buy\n"
             "Trade types: buy, sell"
         )
         return
     
-    token_symbol = context.args[0].upper()
+    token = token_registry.resolve(context.args[0])
+    if token is None:
+        message_dispatcher.reply(update, unknown_token_message(context.args[0]))
+        return
     try:
         amount = float(context.args[1])
         price = float(context.args[2])
         if amount <= 0 or price <= 0:
             raise ValueError("Amount and price must be positive")
     except ValueError:
-        update.message.reply_text("Invalid amount or price. Please enter positive numbers.")
+        message_dispatcher.reply(update, "Invalid amount or price. Please enter positive numbers.")
         return
     
     trade_type = context.args[3].lower()
     if trade_type not in ['buy', 'sell']:
-        update.message.reply_text("Invalid trade type. Use 'buy' or 'sell'.")
+        message_dispatcher.reply(update, "Invalid trade type. Use 'buy' or 'sell'.")
         return
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = get_user_snapshot(user.id)
+    
+    # Check if user is authenticated and has a wallet
+    if not db_user or not db_user.wallet_address:
+        message_dispatcher.reply(update, "Please set up your wallet first using /wallet command.")
+        return
+    
+    # Check if user has an active subscription
+    if not is_entitled(user.id):
+        message_dispatcher.reply(update, "You need an active subscription to use trading features. Use /subscribe to activate.")
+        return
+    
+    try:
+        # Validate wallet balance for trade
+        wallet_balance = await balance_service.get_sol_balance(db_user.wallet_address)
+        balance_service.track(db_user.wallet_address)
         
-        # Check if user is authenticated and has a wallet
-        if not db_user or not db_user.wallet_address:
-            update.message.reply_text("Please set up your wallet first using /wallet command.")
+        if wallet_balance < amount * price:
+            message_dispatcher.reply(update, f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
             return
-        
-        # Check if user has an active subscription
-        if not db_user.is_subscription_active():
-            update.message.reply_text("You need an active subscription to use trading features. Use /subscribe to activate.")
+    except Exception as e:
+        logger.error(f"Error connecting to blockchain: {str(e)}")
+        message_dispatcher.reply(update, "❌ Failed to connect to blockchain. Please try again later.")
+        return
+    
+    try:
+        # Store the order and cross it against the token's order book
+        order, fills = await trade_engine.place(
+            db_user.telegram_id,
+            db_user.wallet_address,
+            token.symbol,
+            trade_type,
+            amount,
+            price
+        )
+    except Exception as e:
+        logger.error(f"P2P trade order failed: {str(e)}")
+        message_dispatcher.reply(update, "❌ Failed to place trade order. Please try again later.")
+        return
+    
+    if order.status == 'routed':
+        fill_text = "Filled: pending, matching runs on another worker\n"
+    elif fills:
+        average_price = sum(fill.price * fill.amount for fill in fills) / order.filled
+        fill_text = f"Filled: {order.filled} at avg ${average_price:.6g}\n"
+    else:
+        fill_text = "Filled: 0\n"
+    
+    quote = await token_registry.quote(token)
+    market_text = f"Market: ${quote.price:.6g}\n" if quote else ""
+    
+    message_dispatcher.reply(update,
+        f"🤝 P2P Trade Order {'Executed' if order.status == 'completed' else 'Queued' if order.status == 'routed' else 'Placed'}!\n"
+        f"Order ID: {order.order_id}\n"
+        f"Token: {token.symbol}\n"
+        f"Amount: {amount}\n"
+        f"Price: ${price}\n"
+        f"{market_text}"
+        f"Type: {trade_type.upper()}\n"
+        f"{fill_text}"
+        f"Resting: {order.remaining if order.is_active or order.status == 'routed' else 0}"
+    )
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /cancel command for resting P2P trade orders."""
+    user = update.effective_user
+    
+    if not context.args or len(context.args) != 1 or not context.args[0].isdigit():
+        message_dispatcher.reply(update,
+            "Usage: /cancel <order_id>\n"
+            "Example: /cancel 42"
+        )
+        return
+    order_id = int(context.args[0])
+    
+    try:
+        result = await trade_engine.cancel_order(user.id, order_id)
+    except Exception as e:
+        logger.error(f"Cancelling order {order_id} failed: {str(e)}")
+        message_dispatcher.reply(update, "❌ Failed to cancel the order. Please try again later.")
+        return
+    
+    if result == 'cancelled':
+        message_dispatcher.reply(update, f"🛑 Order {order_id} cancelled.")
+    elif result == 'requested':
+        message_dispatcher.reply(update, f"🛑 Cancelling order {order_id}; it leaves the book within a few seconds.")
+    else:
+        message_dispatcher.reply(update, f"❌ You have no open order {order_id}. It may already be filled or cancelled.")
+
+async def submit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /submit with a wallet-signed /buy or /sell transaction."""
+    user = update.effective_user
+    
+    if not context.args or len(context.args) != 1:
+        message_dispatcher.reply(update, "Usage: /submit <signed transaction in base64>")
+        return
+    
+    order = load_unsigned(user.id)
+    if order is None:
+        message_dispatcher.reply(update, "Nothing to submit. Start an order with /buy or /sell first.")
+        return
+    
+    try:
+        raw = base64.b64decode(context.args[0], validate=True)
+        signed = SignedTransaction.from_bytes(raw)
+    except Exception:
+        message_dispatcher.reply(update, "❌ That is not a base64-encoded Solana transaction.")
+        return
+    
+    # Only the exact transaction the bot issued is accepted, signed by its fee payer
+    if bytes(signed.message) != base64.b64decode(order.message) or not all(signed.verify_with_results()):
+        message_dispatcher.reply(update, "❌ The transaction does not match your order or is not signed by your wallet.")
+        return
+    
+    # Persist and broadcast; the outbox reports back once it settles
+    try:
+        signature = await tx_outbox.submit(
+            user.id,
+            order.chat_id,
+            order.kind,
+            raw,
+            order.last_valid_block_height,
+            token=order.token,
+            amount=order.amount
+        )
+    except Exception as e:
+        logger.error(f"{order.kind.capitalize()} transaction failed: {str(e)}")
+        message_dispatcher.reply(update, f"❌ Failed to execute {order.kind} order. Please try again later.")
+        return
+    await db_writer.write(lambda session: delete_unsigned(session, user.id, order.message))
+    
+    message_dispatcher.reply(update,
+        f"⏳ {order.kind.capitalize()} order submitted!\n"
+        f"Token: {order.token}\n"
+        f"Amount: {order.amount} SOL\n"
+        f"Transaction Signature: {signature}\n\n"
+        f"You will be notified once it is confirmed."
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the admin /broadcast command."""
+    if update.effective_user.id not in ADMIN_TELEGRAM_IDS:
+        return
+    
+    usage = (
+        "Usage: /broadcast [type=weekly|annual|none] [tier=N] [active=DAYS] <message>\n"
+        "       /broadcast status\n"
+        "       /broadcast cancel"
+    )
+    # Split the raw text rather than context.args so the message keeps its line breaks
+    parts = update.message.text.split(None, 1)
+    body = parts[1] if len(parts) > 1 else ''
+    
+    if body.strip() == 'status':
+        progress = broadcast_engine.stats()
+        if not progress:
+            message_dispatcher.reply(update, "No broadcast is running.")
             return
-        
-        try:
-            # Create P2P trade order
-            order = {
-                'user_id': db_user.telegram_id,
-                'wallet_address': db_user.wallet_address,
-                'token': token_symbol,
-                'amount': amount,
-                'price': price,
-                'type': trade_type,
-                'timestamp': datetime.utcnow()
-            }
-            
-            # Validate wallet balance for trade
-            solana_rpc_url = os.getenv('SOLANA_RPC_ENDPOINT')
-            client = AsyncClient(solana_rpc_url)
-            wallet_balance = await client.get_balance(db_user.wallet_address)
-            
-            if wallet_balance < amount * price:
-                update.message.reply_text(f"❌ Insufficient balance. Current balance: {wallet_balance} SOL")
-                return
-            
-            # Store trade order in database
-            trade_order = TradeOrder(
-                user_id=db_user.telegram_id,
-                wallet_address=db_user.wallet_address,
-                token=token_symbol,
-                amount=amount,
-                price=price,
-                trade_type=trade_type,
-                status='open'
-            )
-            db.session.add(trade_order)
-            db.session.commit()
-            
-            # Prepare transaction for potential immediate execution
-            transaction = Transaction().add(
-                client.transfer(
-                    from_pubkey=db_user.wallet_address, 
-                    to_pubkey=os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    lamports=int(amount * price * 1_000_000_000)  # Convert SOL to lamports
-                )
-            )
-            
-            try:
-                signature = await client.send_transaction(transaction)
-                
-                # Verify transaction
-                transaction_details = {
-                    'from_address': db_user.wallet_address,
-                    'to_address': os.getenv('BOT_SOLANA_WALLET_ADDRESS'),
-                    'amount': amount * price,
-                    'transaction_signature': signature
-                }
-                
-                # Verify blockchain payment
-                from blockchain_monitor import verify_blockchain_payment
-                is_valid = await verify_blockchain_payment(transaction_details)
-                
-                if is_valid:
-                    # Update trade order status
-                    trade_order.status = 'completed'
-                    trade_order.transaction_signature = signature
-                    
-                    # Update user's trading stats
-                    db_user.total_trades += 1
-                    db_user.last_trade_date = datetime.utcnow()
-                    db_user.is_trading_enabled = True
-                    db_user.last_transaction_signature = signature
-                    db.session.commit()
-                    
-                    update.message.reply_text(
-                        f"🤝 P2P Trade Order Executed!\n"
-                        f"Token: {token_symbol}\n"
-                        f"Amount: {amount}\n"
-                        f"Price: ${price}\n"
-                        f"Type: {trade_type.upper()}\n"
-                        f"Transaction Signature: {signature}"
-                    )
-                else:
-                    update.message.reply_text("❌ Trade order verification failed.")
-            except Exception as e:
-                logger.error(f"P2P trade execution failed: {str(e)}")
-                update.message.reply_text("❌ Failed to execute trade order. Please try again later.")
-        except Exception as e:
-            logger.error(f"Error connecting to blockchain: {str(e)}")
-            update.message.reply_text("❌ Failed to connect to blockchain. Please try again later.")
\ No newline at end of file
+        eta = f"{progress['eta_seconds']:.0f}s" if progress['eta_seconds'] is not None else 'unknown'
+        message_dispatcher.reply(update,
+            f"📣 Broadcast {progress['id']} ({progress['segment']})\n"
+            f"Sent: {progress['sent']}, failed: {progress['failed']} of {progress['total']}\n"
+            f"Rate: {progress['sends_per_second']:.1f} msg/s, ETA {eta}"
+        )
+        return
+    
+    if body.strip() == 'cancel':
+        cancelled = await broadcast_engine.cancel()
+        message_dispatcher.reply(update, f"Cancelled {cancelled} broadcast(s).")
+        return
+    
+    filters = []
+    while body:
+        token, _, rest = body.partition(' ')
+        if '=' not in token or token.split('=', 1)[0] not in ('type', 'tier', 'active'):
+            break
+        filters.append(token)
+        body = rest.lstrip(' ')
+    
+    try:
+        segment = Segment.parse(filters)
+    except ValueError as e:
+        message_dispatcher.reply(update, f"{e}\n\n{usage}")
+        return
+    if not body.strip():
+        message_dispatcher.reply(update, usage)
+        return
+    
+    broadcast_id, total = await broadcast_engine.create(body, segment, created_by=update.effective_user.id)
+    message_dispatcher.reply(update, f"📣 Broadcast {broadcast_id} queued for {total} users ({segment.describe()}).")
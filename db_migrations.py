@@ -0,0 +1,93 @@
+import logging
+import os
+import re
+
+from sqlalchemy import text
+
+from storage import sqlite_foreign_keys_disabled
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = 'migrations'
+
+# Arbitrary key for pg_advisory_lock so concurrent workers migrate one at a time
+MIGRATION_LOCK_KEY = 727_001
+
+# SQLite-isms rewritten when a migration has no dialect-specific override
+POSTGRESQL_REWRITES = [
+    (re.compile(r'\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b', re.I), 'BIGSERIAL PRIMARY KEY'),
+    # Telegram ids do not fit in a 32-bit integer
+    (re.compile(r'\bINTEGER\b', re.I), 'BIGINT'),
+    (re.compile(r'\bREAL\b', re.I), 'DOUBLE PRECISION'),
+    (re.compile(r'\bBOOLEAN\s+DEFAULT\s+0\b', re.I), 'BOOLEAN DEFAULT FALSE'),
+    (re.compile(r'\bBOOLEAN\s+DEFAULT\s+1\b', re.I), 'BOOLEAN DEFAULT TRUE'),
+    (re.compile(r'\bADD\s+COLUMN\s+(?!IF\s+NOT\s+EXISTS)', re.I), 'ADD COLUMN IF NOT EXISTS '),
+]
+
+
+def migration_files(directory=MIGRATIONS_DIR):
+    """Return migration file names in apply order."""
+    return sorted(name for name in os.listdir(directory) if re.match(r'^\d+_.*\.sql$', name))
+
+
+def split_statements(sql):
+    """Split a migration script into statements, dropping comments."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def translate_sqlite_sql(sql):
+    """Rewrite SQLite column types and defaults for PostgreSQL."""
+    for pattern, replacement in POSTGRESQL_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def load_migration(name, dialect, directory=MIGRATIONS_DIR):
+    """
+    Return the SQL for a migration on a given dialect.
+
+    A file with the same name under `migrations/<dialect>/` replaces the
+    shared migration; otherwise the shared file is translated.
+    """
+    override = os.path.join(directory, dialect, name)
+    if os.path.exists(override):
+        with open(override) as f:
+            return f.read()
+    with open(os.path.join(directory, name)) as f:
+        sql = f.read()
+    return translate_sqlite_sql(sql) if dialect == 'postgresql' else sql
+
+
+def apply_migrations(engine, model=None, directory=MIGRATIONS_DIR):
+    """
+    Apply pending migrations for the engine's backend.
+
+    SQLite keeps using the platform migration runner and its bookkeeping.
+    Other backends record applied files in `schema_migrations`.
+    """
+    if engine.dialect.name == 'sqlite':
+        from abilities import apply_sqlite_migrations
+        # Table rebuilds drop tables that others reference
+        with sqlite_foreign_keys_disabled(engine):
+            apply_sqlite_migrations(engine, model, directory)
+        return
+
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        if dialect == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version TEXT PRIMARY KEY, "
+            "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+        for name in migration_files(directory):
+            if name in applied:
+                continue
+            for statement in split_statements(load_migration(name, dialect, directory)):
+                connection.exec_driver_sql(statement)
+            connection.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {'version': name})
+            logger.info(f"Applied migration {name}")
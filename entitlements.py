@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import inspect
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from message_dispatcher import message_dispatcher
+from models import User
+from plan_pricing import WEEKLY_PLAN, plan_pricing
+from storage import db_writer, read_session
+from user_cache import get_user_snapshot, invalidate_user
+
+logger = logging.getLogger(__name__)
+
+
+class EntitlementIndex:
+    """
+    In-process index of active subscriptions.
+
+    A dict maps telegram_id to subscription_end_date so gating checks are
+    O(1), and a min-heap keyed on the end date lets the scheduler sleep until
+    exactly the next expiry instead of scanning the users table. Superseded
+    heap entries are skipped lazily when they surface.
+    """
+
+    def __init__(self, reload_interval=600.0):
+        self.reload_interval = reload_interval
+        self.loaded = False
+        self._expiry = {}
+        self._auto_renew = set()
+        self._heap = []
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._wakeup = None
+
+    def load(self):
+        """Rebuild the index from users whose subscription has not ended."""
+        now = datetime.utcnow()
+        with read_session() as session:
+            rows = session.query(
+                User.telegram_id, User.subscription_end_date, User.auto_renew
+            ).filter(User.subscription_end_date > now).all()
+
+        with self._lock:
+            self._expiry = {telegram_id: end_date for telegram_id, end_date, _ in rows}
+            self._auto_renew = {telegram_id for telegram_id, _, auto_renew in rows if auto_renew}
+            self._heap = [(end_date, telegram_id) for telegram_id, end_date, _ in rows]
+            heapq.heapify(self._heap)
+            self.loaded = True
+        self._notify()
+        logger.info(f"Entitlement index loaded with {len(rows)} active subscriptions")
+
+    def update(self, telegram_id, end_date, auto_renew=False):
+        """Record a user's current subscription end date and auto-renew flag."""
+        with self._lock:
+            if auto_renew:
+                self._auto_renew.add(telegram_id)
+            else:
+                self._auto_renew.discard(telegram_id)
+
+            if not end_date or end_date <= datetime.utcnow():
+                self._expiry.pop(telegram_id, None)
+                return
+            if self._expiry.get(telegram_id) == end_date:
+                return
+            self._expiry[telegram_id] = end_date
+            heapq.heappush(self._heap, (end_date, telegram_id))
+            earliest = self._heap[0][1] == telegram_id
+        if earliest:
+            self._notify()
+
+    def is_active(self, telegram_id, now=None):
+        """
+        Return whether a user's subscription is active.
+
+        A payment credited by another worker reaches this index only on the
+        next reload, so a miss or an expired entry is checked against the
+        user snapshot; an active snapshot is recorded in the index.
+        """
+        now = now or datetime.utcnow()
+        end_date = self._expiry.get(telegram_id) if self.loaded else None
+        if end_date is not None and end_date > now:
+            return True
+        snapshot = get_user_snapshot(telegram_id)
+        if not (snapshot and snapshot.subscription_end_date and snapshot.subscription_end_date > now):
+            return False
+        if self.loaded:
+            self.update(telegram_id, snapshot.subscription_end_date, snapshot.auto_renew)
+        return True
+
+    def on_expire(self, callback):
+        """
+        Register a callback for expirations.
+
+        Args:
+            callback: Called as callback(telegram_id, auto_renew); may be async
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def pop_due(self, now=None):
+        """
+        Remove and return subscriptions that ended at or before `now`.
+
+        Returns:
+            list: (telegram_id, auto_renew) tuples in expiry order
+        """
+        now = now or datetime.utcnow()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                end_date, telegram_id = heapq.heappop(self._heap)
+                if self._expiry.get(telegram_id) != end_date:
+                    continue
+                del self._expiry[telegram_id]
+                due.append((telegram_id, telegram_id in self._auto_renew))
+        return due
+
+    def next_expiry(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Fire expiration callbacks as subscriptions become due."""
+        self._wakeup = asyncio.Event()
+        last_reload = asyncio.get_running_loop().time()
+        if not self.loaded:
+            self.load()
+
+        while True:
+            for telegram_id, auto_renew in self.pop_due():
+                await self._fire(telegram_id, auto_renew)
+
+            if asyncio.get_running_loop().time() - last_reload >= self.reload_interval:
+                # Pick up subscriptions written by other processes
+                self.load()
+                last_reload = asyncio.get_running_loop().time()
+
+            delay = self.reload_interval
+            next_expiry = self.next_expiry()
+            if next_expiry is not None:
+                delay = min(delay, max(0.0, (next_expiry - datetime.utcnow()).total_seconds()))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, telegram_id, auto_renew):
+        for callback in self._callbacks:
+            try:
+                result = callback(telegram_id, auto_renew)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Expiration callback failed for user {telegram_id}: {str(e)}")
+
+
+entitlement_index = EntitlementIndex(
+    reload_interval=float(os.getenv('ENTITLEMENT_RELOAD_INTERVAL', '600'))
+)
+
+
+def is_entitled(telegram_id):
+    """Return whether a user may use subscription-gated features."""
+    return entitlement_index.is_active(telegram_id)
+
+
+def record_subscription(user):
+    """Refresh the index from a committed user row."""
+    entitlement_index.update(user.telegram_id, user.subscription_end_date, bool(user.auto_renew))
+
+
+def claim_renewal_reminder(session, telegram_id, now):
+    """
+    Record a renewal reminder for a lapsed auto-renew subscription without committing.
+
+    Every worker fires the same expiry, so only the one whose update flips
+    `renewal_reminded_at` past the end date sends the reminder.
+
+    Returns:
+        bool: True if this caller should send the reminder
+    """
+    return session.query(User).filter(
+        User.telegram_id == telegram_id,
+        User.auto_renew.is_(True),
+        User.subscription_end_date <= now,
+        or_(User.renewal_reminded_at.is_(None), User.renewal_reminded_at < User.subscription_end_date)
+    ).update({User.renewal_reminded_at: now}, synchronize_session=False) == 1
+
+
+def renewal_reminder_text():
+    amount = plan_pricing.expected_amount(WEEKLY_PLAN)
+    price = f"{amount:.4f} SOL (${WEEKLY_PLAN.price_usd:g})" if amount else f"${WEEKLY_PLAN.price_usd:g} in SOL"
+    return (
+        "🔁 Your weekly subscription has ended and auto-renewal is on.\n"
+        f"Send {price} from your registered wallet to renew; see /subscribe for the address.\n"
+        "Access resumes once the payment is confirmed on-chain. Use /autopay off to stop these reminders."
+    )
+
+
+@entitlement_index.on_expire
+async def handle_subscription_expired(telegram_id, auto_renew):
+    invalidate_user(telegram_id)
+    if not auto_renew:
+        logger.info(f"Subscription expired for user {telegram_id}")
+        return
+    now = datetime.utcnow()
+    if await db_writer.write(lambda session: claim_renewal_reminder(session, telegram_id, now)):
+        logger.info(f"Sent renewal reminder to user {telegram_id}")
+        message_dispatcher.notify(telegram_id, renewal_reminder_text())
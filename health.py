@@ -0,0 +1,86 @@
+import logging
+import os
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class StatsRegistry:
+    """
+    Named stats() callables of the running components.
+
+    Components register themselves when they are created, so the health
+    endpoint does not need to know about every one of them.
+    """
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, name, source):
+        """
+        Add a stats source under a name, replacing an earlier one.
+
+        Args:
+            source: Callable returning a JSON-serializable value
+        """
+        self._sources[name] = source
+        return source
+
+    def unregister(self, name):
+        self._sources.pop(name, None)
+
+    def snapshot(self):
+        """Collect every source; one that fails reports its error instead of failing the rest."""
+        stats = {}
+        for name, source in self._sources.items():
+            try:
+                stats[name] = source()
+            except Exception as e:
+                logger.warning(f"Stats source {name} failed: {str(e)}")
+                stats[name] = {'error': str(e)}
+        return stats
+
+
+stats_registry = StatsRegistry()
+
+
+class HealthServer:
+    """Serve the registered component stats as JSON on GET /healthz, in any update mode."""
+
+    def __init__(self, registry=stats_registry, host='0.0.0.0', port=8080, path='/healthz'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a health server from environment variables. HEALTH_PORT=0 disables it."""
+        return cls(
+            host=os.getenv('HEALTH_HOST', '0.0.0.0'),
+            port=int(os.getenv('HEALTH_PORT', '8080')),
+            path=os.getenv('HEALTH_PATH', '/healthz'),
+        )
+
+    def build_app(self):
+        web_app = web.Application()
+        web_app.router.add_get(self.path, self.handle_health)
+        return web_app
+
+    async def start(self):
+        if not self.port:
+            return
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Health endpoint listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_health(self, request):
+        return web.json_response(self.registry.snapshot())
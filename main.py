@@ -1,13 +1,13 @@
 import time
 import os
 from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
+from telegram.ext import Application, CommandHandler, ContextTypes
 from models import db, User
-from abilities import apply_sqlite_migrations
+from db_migrations import apply_migrations
 from shared_resources import app
 from commands import (
     trade_command, sell_command, buy_command,
-    autopay_command, subscribe_command
+    autopay_command, subscribe_command, broadcast_command, submit_command, cancel_command
 )
 
 from utils import print_setup_instructions
@@ -16,9 +16,16 @@ import logging
 from datetime import datetime
 from flask import Flask
 from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
 from models import db, User
-from abilities import apply_sqlite_migrations
+from update_processor import PerUserUpdateProcessor
+from telegram_rate_limiter import TelegramRateLimiter
+from user_cache import UserSnapshot, get_user_snapshot, invalidate_user
+from storage import db_writer
+from message_dispatcher import message_dispatcher
+from referrals import record_signup
+import referral_tree
+from payment_attribution import wallet_index
+from payment_ledger import payment_ledger
 
 TELEGRAM_API_TOKEN = os.getenv('TELEGRAM_API_TOKEN')
 
@@ -27,24 +34,37 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 
 # Import Flask app
 from shared_resources import app
-db.init_app(app)
 
-def register_user(telegram_id: int, username: str, referrer_id: int = None) -> User:
+def create_user(telegram_id: int, username: str, referrer_id: int = None) -> bool:
+    """Insert a user row unless it exists. Runs inside a writer transaction."""
+    if User.query.filter_by(telegram_id=telegram_id).first():
+        return False
+    if referrer_id and (referrer_id == telegram_id or not User.query.filter_by(telegram_id=referrer_id).first()):
+        # users.referrer_id references users.telegram_id
+        referrer_id = None
+    db.session.add(User(
+        telegram_id=telegram_id,
+        username=username,
+        referrer_id=referrer_id
+    ))
+    referral_tree.add_user(db.session, telegram_id, referrer_id)
+    if referrer_id:
+        # Folded into the referrer's stats by the referral aggregator
+        record_signup(db.session, referrer_id, telegram_id)
+    return True
+
+async def register_user(telegram_id: int, username: str, referrer_id: int = None) -> UserSnapshot:
     """Register a new user or return existing one."""
-    with app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        if not user:
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                referrer_id=referrer_id
-            )
-            db.session.add(user)
-            db.session.commit()
+    user = get_user_snapshot(telegram_id)
+    if not user:
+        created = await db_writer.write(lambda session: create_user(telegram_id, username, referrer_id))
+        invalidate_user(telegram_id)
+        if created:
             logger.info(f"New user registered: {username} (ID: {telegram_id})")
-        return user
+        user = get_user_snapshot(telegram_id)
+    return user
 
-def start(update: Update, context: CallbackContext) -> None:
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command with enhanced referral tracking."""
     user = update.effective_user
     referrer_id = None
@@ -57,54 +77,22 @@ def start(update: Update, context: CallbackContext) -> None:
             logger.warning(f"Invalid referral code: {context.args[0]}")
     
     # Register user
-    registered_user = register_user(user.id, user.username, referrer_id)
+    registered_user = await register_user(user.id, user.username, referrer_id)
     
-    # Update referrer's stats if a valid referrer exists
-    if referrer_id:
-        with app.app_context():
-            referrer = User.query.filter_by(telegram_id=referrer_id).first()
-            if referrer:
-                # Increment total referrals
-                referrer.total_referrals += 1
-                
-                # Implement tiered referral rewards
-                base_reward = 5.00  # Base reward amount
-                tier_multipliers = {0: 1.0, 1: 1.1, 2: 1.15, 3: 1.2}
-                current_tier = min(referrer.referral_tier, 3)
-                
-                # Calculate and add referral rewards with more precise tracking
-                referral_reward = base_reward * tier_multipliers[current_tier]
-                referrer.referral_rewards += referral_reward
-                
-                # Implement advanced referral tier system
-                if referrer.total_referrals % 100 == 0:
-                    referrer.referral_tier = min(referrer.referral_tier + 1, 3)
-                    logger.info(
-                        f"User {referrer.username} advanced to referral tier {referrer.referral_tier}. "
-                        f"Total referrals: {referrer.total_referrals}"
-                    )
-                
-                # Log referral event for tracking
-                logger.info(
-                    f"Referral tracked: Referrer {referrer.username} (ID: {referrer.telegram_id}), "
-                    f"Reward: ${referral_reward:.2f}, Tier: {current_tier}"
-                )
-                
-                # Update referrer's tier multiplier
-                referrer.referral_tier_multiplier = tier_multipliers[current_tier]
-                
-                db.session.commit()
+    # Referrer stats are updated from the signup event recorded at registration
+    referrer = get_user_snapshot(referrer_id) if referrer_id else None
+    referrer_username = referrer.username if referrer else None
     
     # Prepare welcome message
     welcome_msg = f"Hi {user.first_name}! Welcome to the Solana Trading Bot!\n\n"
     
-    if referrer_id:
-        welcome_msg += f"You were referred by user {referrer.username}. You'll both earn rewards on your transactions!\n\n"
+    if referrer_username:
+        welcome_msg += f"You were referred by user {referrer_username}. You'll both earn rewards on your transactions!\n\n"
     
     welcome_msg += "🔑 Please set up your Solana wallet using the /wallet command before making any transactions.\n\n"
     welcome_msg += "Use /help to see all available commands."
     
-    update.message.reply_text(welcome_msg)
+    message_dispatcher.reply(update, welcome_msg)
 
 def is_valid_solana_wallet_address(address: str) -> bool:
     """Validate Solana wallet address."""
@@ -129,42 +117,44 @@ def is_valid_solana_wallet_address(address: str) -> bool:
     
     return True
 
-def wallet_command(update: Update, context: CallbackContext) -> None:
+async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /wallet command."""
     user = update.effective_user
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        
-        if not db_user:
-            update.message.reply_text("Please start the bot first with /start")
-            return
-        
-        # If no arguments provided, show current wallet
-        if not context.args:
-            if db_user.wallet_address:
-                update.message.reply_text(f"Your current Solana wallet address is:\n{db_user.wallet_address}")
-            else:
-                update.message.reply_text("You haven't set a wallet address yet.\nUse /wallet <address> to set your Solana wallet address.")
-            return
-        
-        # Update wallet address
-        new_address = context.args[0]
-        
-        # Validate Solana wallet address
-        if not is_valid_solana_wallet_address(new_address):
-            update.message.reply_text("❌ Invalid Solana wallet address. Please check and try again.\n\n"
-                                      "A valid Solana wallet address:\n"
-                                      "- Is 32-44 characters long\n"
-                                      "- Starts with 1, 2, 3, or 4\n"
-                                      "- Contains only base58 characters")
-            return
-        
-        db_user.wallet_address = new_address
-        db.session.commit()
-        update.message.reply_text(f"✅ Your Solana wallet address has been updated to:\n{new_address}")
+    cached_user = get_user_snapshot(user.id)
+    if not cached_user:
+        message_dispatcher.reply(update, "Please start the bot first with /start")
+        return
+    
+    # If no arguments provided, show current wallet
+    if not context.args:
+        if cached_user.wallet_address:
+            message_dispatcher.reply(update, f"Your current Solana wallet address is:\n{cached_user.wallet_address}")
+        else:
+            message_dispatcher.reply(update, "You haven't set a wallet address yet.\nUse /wallet <address> to set your Solana wallet address.")
+        return
+    
+    # Update wallet address
+    new_address = context.args[0]
+    
+    # Validate Solana wallet address
+    if not is_valid_solana_wallet_address(new_address):
+        message_dispatcher.reply(update, "❌ Invalid Solana wallet address. Please check and try again.\n\n"
+                                        "A valid Solana wallet address:\n"
+                                        "- Is 32-44 characters long\n"
+                                        "- Starts with 1, 2, 3, or 4\n"
+                                        "- Contains only base58 characters")
+        return
+    
+    def set_wallet(session):
+        User.query.filter_by(telegram_id=user.id).first().wallet_address = new_address
+    
+    await db_writer.write(set_wallet)
+    wallet_index.update(user.id, new_address, cached_user.wallet_address)
+    invalidate_user(user.id)
+    message_dispatcher.reply(update, f"✅ Your Solana wallet address has been updated to:\n{new_address}")
 
-def help_command(update: Update, context: CallbackContext) -> None:
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     help_text = """
 🤖 Solana Trading Bot Commands 🤖
@@ -189,7 +179,9 @@ def help_command(update: Update, context: CallbackContext) -> None:
 💹 Trading Commands:
 /buy - Initiate a buy transaction
 /sell - Initiate a sell transaction  
+/submit - Send back a /buy or /sell transaction signed by your wallet
 /trade - Start a peer-to-peer trade
+/cancel - Cancel one of your open trade orders
 
 🆘 Other Commands:
 /start - Start the bot and register
@@ -201,9 +193,9 @@ def help_command(update: Update, context: CallbackContext) -> None:
 3. Send SOL to bot's wallet
 4. Subscription activates automatically
 """
-    update.message.reply_text(help_text)
+    message_dispatcher.reply(update, help_text)
 
-def plans_command(update: Update, context: CallbackContext) -> None:
+async def plans_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display available subscription plans."""
     plans_text = """
 🚀 Solana Trading Bot Subscription Plans 🚀
@@ -223,86 +215,107 @@ def plans_command(update: Update, context: CallbackContext) -> None:
 - Wallet-to-wallet payment confirms your subscription
 - Referral discounts available!
 """
-    update.message.reply_text(plans_text)
+    message_dispatcher.reply(update, plans_text)
 
-def status_command(update: Update, context: CallbackContext) -> None:
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Check user's current subscription status."""
     user = update.effective_user
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        
-        if not db_user:
-            update.message.reply_text("Please start the bot first with /start")
-            return
-        
-        if not db_user.subscription_type:
-            update.message.reply_text("You currently have no active subscription. Use /plans to view available plans.")
-            return
-        
-        status_text = f"📊 Subscription Status:\n"
-        status_text += f"Plan: {db_user.subscription_type.capitalize()} Plan\n"
-        
-        if db_user.subscription_end_date:
-            from datetime import datetime
-            remaining_time = db_user.subscription_end_date - datetime.now()
-            days = remaining_time.days
-            hours = remaining_time.seconds // 3600
-            
-            status_text += f"Expires in: {days} days, {hours} hours\n"
-        
-        status_text += f"Auto-Renew: {'Enabled' if db_user.auto_renew else 'Disabled'}"
+    db_user = get_user_snapshot(user.id)
+    
+    if not db_user:
+        message_dispatcher.reply(update, "Please start the bot first with /start")
+        return
+    
+    if not db_user.subscription_type:
+        message_dispatcher.reply(update, "You currently have no active subscription. Use /plans to view available plans.")
+        return
+    
+    status_text = f"📊 Subscription Status:\n"
+    status_text += f"Plan: {db_user.subscription_type.capitalize()} Plan\n"
+    
+    if db_user.subscription_end_date:
+        remaining_time = db_user.subscription_end_date - datetime.now()
+        days = remaining_time.days
+        hours = remaining_time.seconds // 3600
         
-        update.message.reply_text(status_text)
+        status_text += f"Expires in: {days} days, {hours} hours\n"
+    
+    status_text += f"Auto-Renew: {'Enabled' if db_user.auto_renew else 'Disabled'}"
+    
+    message_dispatcher.reply(update, status_text)
 
-def referrals_command(update: Update, context: CallbackContext) -> None:
+async def referrals_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show user's referral statistics and generate referral link."""
     user = update.effective_user
     
-    with app.app_context():
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        
-        if not db_user:
-            update.message.reply_text("Please start the bot first with /start")
-            return
-        
-        # Generate or retrieve referral link
-        if not db_user.referral_link:
-            # Use utility function to get bot username
-            from utils import get_bot_username
-            bot_username = get_bot_username() or 'solana_trading_bot'
-            db_user.referral_link = f"https://t.me/{bot_username}?start=ref_{db_user.telegram_id}"
-            db.session.commit()
-        
-        # Calculate potential next tier and rewards
-        next_tier_threshold = (db_user.referral_tier + 1) * 100
-        referrals_to_next_tier = max(0, next_tier_threshold - db_user.total_referrals)
-        
-        # Calculate potential rewards with more precise calculation
-        tier_multipliers = {0: 1.0, 1: 1.1, 2: 1.15, 3: 1.2}
-        base_reward_percentage = 0.05  # 5% base referral reward
-        current_tier = min(db_user.referral_tier, 3)
-        potential_rewards = (
-            db_user.total_referrals * 
-            base_reward_percentage * 
-            db_user.referral_tier_multiplier
-        )
-        
-        referral_text = f"🤝 Your Referral Stats:\n"
-        referral_text += f"Total Referrals: {db_user.total_referrals}\n"
-        referral_text += f"Potential Referral Rewards: ${potential_rewards:.2f}\n"
-        referral_text += f"Current Referral Tier: {db_user.referral_tier}\n"
-        referral_text += f"Next Tier Progress: {db_user.total_referrals}/{next_tier_threshold} referrals\n"
-        referral_text += f"Referrals needed for next tier: {referrals_to_next_tier}\n\n"
-        referral_text += "📋 Share this link to earn rewards:\n"
-        referral_text += f"{db_user.referral_link}\n\n"
-        referral_text += "🏆 Referral Tier Benefits:\n"
-        referral_text += "- Tier 0: 5% referral rewards\n"
-        referral_text += "- Tier 1: 10% referral rewards\n"
-        referral_text += "- Tier 2: 15% referral rewards\n"
-        referral_text += "- Tier 3: 20% referral rewards\n"
+    db_user = get_user_snapshot(user.id)
+    
+    if not db_user:
+        message_dispatcher.reply(update, "Please start the bot first with /start")
+        return
+    
+    # Generate or retrieve referral link
+    if not db_user.referral_link:
+        # Use utility function to get bot username
+        from utils import get_bot_username
+        bot_username = await get_bot_username() or 'solana_trading_bot'
+        def set_referral_link(session):
+            row = User.query.filter_by(telegram_id=user.id).first()
+            row.referral_link = f"https://t.me/{bot_username}?start=ref_{row.telegram_id}"
         
-        update.message.reply_text(referral_text)
+        await db_writer.write(set_referral_link)
+        invalidate_user(user.id)
+        db_user = get_user_snapshot(user.id)
+    
+    # Calculate potential next tier and rewards
+    next_tier_threshold = (db_user.referral_tier + 1) * 100
+    referrals_to_next_tier = max(0, next_tier_threshold - db_user.total_referrals)
+    
+    # Calculate potential rewards with more precise calculation
+    tier_multipliers = {0: 1.0, 1: 1.1, 2: 1.15, 3: 1.2}
+    base_reward_percentage = 0.05  # 5% base referral reward
+    current_tier = min(db_user.referral_tier, 3)
+    potential_rewards = (
+        db_user.total_referrals * 
+        base_reward_percentage * 
+        db_user.referral_tier_multiplier
+    )
+    
+    referral_text = f"🤝 Your Referral Stats:\n"
+    referral_text += f"Total Referrals: {db_user.total_referrals}\n"
+    referral_text += f"Potential Referral Rewards: ${potential_rewards:.2f}\n"
+    referral_text += f"Current Referral Tier: {db_user.referral_tier}\n"
+    referral_text += f"Next Tier Progress: {db_user.total_referrals}/{next_tier_threshold} referrals\n"
+    referral_text += f"Referrals needed for next tier: {referrals_to_next_tier}\n\n"
+
+    network = referral_tree.network_of(user.id, referral_tree.leaderboard_cache.max_depth)
+    referral_text += "🌳 Your Referral Network:\n"
+    referral_text += f"Users in your network: {network.users}\n"
+    referral_text += f"Network payment volume: {network.paid_volume:.4f} SOL\n"
+    for depth, count in sorted(network.levels.items()):
+        referral_text += f"- Level {depth}: {count} users\n"
+    if network.upline_depth:
+        referral_text += f"Your network level: {network.upline_depth}\n"
+    referral_text += "\n"
+
+    ranked = referral_tree.leaderboard_cache.get()
+    if ranked:
+        referral_text += "🏅 Top Referral Networks:\n"
+        for rank, (telegram_id, username, users, paid) in enumerate(ranked, 1):
+            name = "You" if telegram_id == user.id else (f"@{username}" if username else f"User {telegram_id}")
+            referral_text += f"{rank}. {name}: {users} users, {paid:.4f} SOL\n"
+        referral_text += "\n"
+
+    referral_text += "📋 Share this link to earn rewards:\n"
+    referral_text += f"{db_user.referral_link}\n\n"
+    referral_text += "🏆 Referral Tier Benefits:\n"
+    referral_text += "- Tier 0: 5% referral rewards\n"
+    referral_text += "- Tier 1: 10% referral rewards\n"
+    referral_text += "- Tier 2: 15% referral rewards\n"
+    referral_text += "- Tier 3: 20% referral rewards\n"
+    
+    message_dispatcher.reply(update, referral_text)
 
 def setup_telegram_bot():
     if not TELEGRAM_API_TOKEN:
@@ -311,65 +324,143 @@ def setup_telegram_bot():
         return False
 
     try:
-        updater = Updater(TELEGRAM_API_TOKEN)
-        dispatcher = updater.dispatcher
+        application = (
+            Application.builder()
+            .token(TELEGRAM_API_TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor.from_env())
+            .rate_limiter(TelegramRateLimiter.from_env())
+            .build()
+        )
 
         # Add command handlers
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("wallet", wallet_command))
-        dispatcher.add_handler(CommandHandler("subscribe", subscribe_command))
-        dispatcher.add_handler(CommandHandler("status", status_command))
-        dispatcher.add_handler(CommandHandler("referral", referrals_command))
-        dispatcher.add_handler(CommandHandler("autopay", autopay_command))
-        dispatcher.add_handler(CommandHandler("buy", buy_command))
-        dispatcher.add_handler(CommandHandler("sell", sell_command))
-        dispatcher.add_handler(CommandHandler("trade", trade_command))
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("wallet", wallet_command))
+        application.add_handler(CommandHandler("subscribe", subscribe_command))
+        application.add_handler(CommandHandler("status", status_command))
+        application.add_handler(CommandHandler("referral", referrals_command))
+        application.add_handler(CommandHandler("autopay", autopay_command))
+        application.add_handler(CommandHandler("buy", buy_command))
+        application.add_handler(CommandHandler("sell", sell_command))
+        application.add_handler(CommandHandler("trade", trade_command))
+        application.add_handler(CommandHandler("cancel", cancel_command))
+        application.add_handler(CommandHandler("submit", submit_command))
+        application.add_handler(CommandHandler("broadcast", broadcast_command))
         
         logger.info("Bot has been set up successfully.")
-        return updater
+        return application
     except Exception as e:
         logger.error(f"Failed to set up Telegram bot: {str(e)}")
         return False
 
-def run_telegram_bot(updater):
+async def run_telegram_bot(application):
     logger.info("Starting Telegram bot")
-    updater.start_polling()
+    await application.updater.start_polling()
     logger.info("Bot is now running.")
     print("🎉 Bot is now connected and ready to use! 🎉")
-    print(f"🚀 Click here to start chatting: https://t.me/{updater.bot.username} 🚀")
-
-from blockchain_monitor import monitor_blockchain_payments
-import threading
-
-def periodic_blockchain_check():
-    """Run blockchain payment monitoring periodically."""
-    while True:
+    print(f"🚀 Click here to start chatting: https://t.me/{application.bot.username} 🚀")
+
+from payment_watcher import PaymentWatcher
+from rpc_gateway import close_rpc_gateway, get_rpc_gateway
+from webhook_server import WebhookServer
+from health import HealthServer
+from entitlements import entitlement_index
+from trade_engine import trade_engine
+from tx_outbox import tx_outbox
+from blockhash_cache import blockhash_cache
+from balance_service import balance_service
+from commands import handle_settled_transaction
+from broadcast_engine import broadcast_engine
+from referrals import referral_aggregator
+from token_registry import token_registry
+from plan_pricing import plan_pricing
+from blockchain_monitor import payment_reconciler
+import argparse
+import asyncio
+
+async def serve(application, mode='polling'):
+    """Run the bot and the payment watcher on one event loop until cancelled."""
+    async with application:
+        # Handlers read these indexes, so they are loaded before any update is received
+        db_writer.start()
+        entitlement_index.load()
+        wallet_index.load()
+        payment_ledger.load()
+        trade_engine.load()
+        tx_outbox.load()
+        token_registry.load()
+        plan_pricing.load()
+        tx_outbox.on_settled(handle_settled_transaction)
+        message_dispatcher.attach(application.bot)
+        broadcast_engine.attach(application.bot)
+        await application.start()
+        health = HealthServer.from_env()
+        await health.start()
+        webhook = None
+        if mode == 'webhook':
+            webhook = WebhookServer.from_env(application)
+            await webhook.start()
+        else:
+            await run_telegram_bot(application)
+        background_tasks = [
+            asyncio.create_task(PaymentWatcher.from_env().run()),
+            asyncio.create_task(entitlement_index.run()),
+            asyncio.create_task(trade_engine.run()),
+            asyncio.create_task(tx_outbox.run()),
+            asyncio.create_task(blockhash_cache.run()),
+            asyncio.create_task(balance_service.run()),
+            asyncio.create_task(get_rpc_gateway().run_health_checks()),
+            asyncio.create_task(message_dispatcher.run()),
+            asyncio.create_task(broadcast_engine.run()),
+            asyncio.create_task(referral_aggregator.run()),
+            asyncio.create_task(token_registry.run()),
+            asyncio.create_task(plan_pricing.run()),
+            asyncio.create_task(payment_reconciler.run()),
+        ]
         try:
-            monitor_blockchain_payments()
-        except Exception as e:
-            logger.error(f"Error in periodic blockchain check: {str(e)}")
-        
-        # Check every hour
-        time.sleep(3600)
+            await asyncio.Event().wait()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+            if webhook:
+                await webhook.stop()
+            else:
+                await application.updater.stop()
+            await health.stop()
+            await application.stop()
+            await close_rpc_gateway()
+            await token_registry.close()
+            db_writer.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Solana Trading Bot")
+    parser.add_argument(
+        '--mode',
+        choices=['polling', 'webhook'],
+        default=os.getenv('BOT_UPDATE_MODE', 'polling'),
+        help="How to receive Telegram updates (default: BOT_UPDATE_MODE or polling)"
+    )
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     # Initialize database
     with app.app_context():
-        apply_sqlite_migrations(db.engine, db.Model, "migrations")
+        apply_migrations(db.engine, db.Model, "migrations")
 
     # Set up the Telegram bot
-    updater = setup_telegram_bot()
-    if not updater:
+    application = setup_telegram_bot()
+    if not application:
         logger.error("Failed to set up Telegram bot. Exiting.")
         return
 
-    # Start blockchain monitoring in a separate thread
-    blockchain_thread = threading.Thread(target=periodic_blockchain_check, daemon=True)
-    blockchain_thread.start()
-
-    # Start the Telegram bot
-    run_telegram_bot(updater)
+    # The bot and the payment watcher share one event loop
+    try:
+        asyncio.run(serve(application, args.mode))
+    except KeyboardInterrupt:
+        logger.info("Bot stopped.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from models import MessageDeadLetter
+from storage import db_writer, read_session
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer message texts
+MAX_MESSAGE_LENGTH = 4096
+
+SHUTDOWN_ERROR = 'undelivered at shutdown'
+
+# The dispatcher pauses the chat on RetryAfter itself, so the limiter must not retry too
+SEND_RATE_LIMIT_ARGS = {'max_retries': 0}
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """Split text into chunks Telegram accepts, preferring line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class OutboundMessage:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'attempts')
+
+    def __init__(self, chat_id, text, kwargs=None, attempts=0):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs or {}
+        self.attempts = attempts
+
+
+def insert_dead_letters(session, messages, error):
+    session.bulk_insert_mappings(MessageDeadLetter, [
+        {'chat_id': message.chat_id, 'text': message.text, 'error': error, 'attempts': message.attempts}
+        for message in messages
+    ])
+
+
+def delete_dead_letters(session, ids):
+    session.query(MessageDeadLetter).filter(MessageDeadLetter.id.in_(ids)).delete(synchronize_session=False)
+
+
+class MessageDispatcher:
+    """
+    Asynchronous outbound Telegram messages.
+
+    Handlers enqueue replies and return; worker tasks deliver them. Each
+    chat has its own FIFO that only one worker drains at a time, so a
+    chat's messages arrive in order, and chats take turns so one busy chat
+    cannot hold up the rest. Global and per-chat send rates are enforced by
+    the bot's TelegramRateLimiter.
+
+    Notifications sent with notify() are held for `coalesce_window` seconds
+    and merged into one message per chat. A RetryAfter pauses the chat for
+    the requested time without holding a worker; the rate limiter is told
+    not to retry these sends. Other transient errors are retried with
+    backoff and messages that still fail, or that Telegram rejects
+    outright, are written to `message_dead_letters`. A message in flight
+    when run() is cancelled goes back to the front of its chat's queue, so
+    it is persisted with the rest.
+    """
+
+    def __init__(self, bot=None, workers=8, coalesce_window=2.0, max_attempts=5,
+                 retry_base_delay=1.0, writer=db_writer):
+        self.bot = bot
+        self.workers = workers
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.writer = writer
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.coalesced = 0
+        self._chats = {}
+        self._scheduled = set()
+        self._ready = None
+        self._notifications = {}
+
+    @classmethod
+    def from_env(cls):
+        """Build a dispatcher from environment variables."""
+        return cls(
+            workers=int(os.getenv('MESSAGE_DISPATCH_WORKERS', '8')),
+            coalesce_window=float(os.getenv('MESSAGE_COALESCE_WINDOW', '2')),
+            max_attempts=int(os.getenv('MESSAGE_MAX_ATTEMPTS', '5')),
+        )
+
+    def attach(self, bot):
+        self.bot = bot
+
+    def _ready_queue(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+        return self._ready
+
+    def send(self, chat_id, text, **kwargs):
+        """Queue a message for a chat without waiting for delivery."""
+        for chunk in split_text(text):
+            self._enqueue(OutboundMessage(chat_id, chunk, kwargs))
+
+    def reply(self, update, text, **kwargs):
+        """Queue a reply to the chat an update came from."""
+        self.send(update.effective_chat.id, text, **kwargs)
+
+    def notify(self, chat_id, text):
+        """Queue a notification, merged with others for the chat within the coalesce window."""
+        pending = self._notifications.get(chat_id)
+        if pending is not None:
+            pending.append(text)
+            self.coalesced += 1
+            return
+        self._notifications[chat_id] = [text]
+        asyncio.get_running_loop().call_later(self.coalesce_window, self._flush_notifications, chat_id)
+
+    def _flush_notifications(self, chat_id):
+        texts = self._notifications.pop(chat_id, None)
+        if texts:
+            self.send(chat_id, '\n\n'.join(texts))
+
+    def _enqueue(self, message):
+        self._chats.setdefault(message.chat_id, deque()).append(message)
+        self._mark_ready(message.chat_id)
+
+    def _mark_ready(self, chat_id):
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._ready_queue().put_nowait(chat_id)
+
+    async def _worker(self):
+        ready = self._ready_queue()
+        while True:
+            chat_id = await ready.get()
+            queue = self._chats.get(chat_id)
+            if not queue:
+                self._scheduled.discard(chat_id)
+                self._chats.pop(chat_id, None)
+                continue
+
+            message = queue.popleft()
+            try:
+                delay = await self._deliver(message)
+            except asyncio.CancelledError:
+                queue.appendleft(message)
+                raise
+            if delay is not None:
+                # Keep the chat claimed and its order intact until the retry
+                queue.appendleft(message)
+                asyncio.get_running_loop().call_later(delay, ready.put_nowait, chat_id)
+            elif queue:
+                # Round-robin: go to the back of the line behind other chats
+                ready.put_nowait(chat_id)
+            else:
+                self._scheduled.discard(chat_id)
+                del self._chats[chat_id]
+
+    async def _deliver(self, message):
+        """Send one message. Returns a retry delay, or None when done with it."""
+        try:
+            await self.bot.send_message(
+                chat_id=message.chat_id, text=message.text, rate_limit_args=SEND_RATE_LIMIT_ARGS, **message.kwargs
+            )
+            self.sent += 1
+            return None
+        except RetryAfter as e:
+            self.retried += 1
+            return e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted chat or malformed message: retrying cannot help
+            message.attempts += 1
+            await self._dead_letter([message], str(e))
+            return None
+        except Exception as e:
+            message.attempts += 1
+            if message.attempts >= self.max_attempts:
+                await self._dead_letter([message], str(e))
+                return None
+            self.retried += 1
+            logger.warning(f"Message to chat {message.chat_id} failed, retrying: {str(e)}")
+            return self.retry_base_delay * 2 ** (message.attempts - 1)
+
+    async def _dead_letter(self, messages, error):
+        try:
+            await self.writer.write(lambda session: insert_dead_letters(session, messages, error))
+            self.dead_lettered += len(messages)
+            logger.warning(f"Dead-lettered {len(messages)} message(s): {error}")
+        except Exception as e:
+            logger.error(f"Failed to persist {len(messages)} undelivered message(s): {str(e)}")
+
+    async def replay_dead_letters(self, limit=1000, error=None):
+        """
+        Re-queue persisted messages and remove them from the dead-letter table.
+
+        Args:
+            limit (int): Maximum rows to replay, oldest first
+            error (str): Only replay rows with this error
+
+        Returns:
+            int: Number of messages queued
+        """
+        with read_session() as session:
+            query = session.query(MessageDeadLetter)
+            if error is not None:
+                query = query.filter(MessageDeadLetter.error == error)
+            rows = query.order_by(MessageDeadLetter.id).limit(limit).all()
+        if not rows:
+            return 0
+        ids = [row.id for row in rows]
+        await self.writer.write(lambda session: delete_dead_letters(session, ids))
+        for row in rows:
+            self._enqueue(OutboundMessage(row.chat_id, row.text))
+        return len(rows)
+
+    async def run(self):
+        """Deliver queued messages until cancelled, then persist what is left."""
+        replayed = await self.replay_dead_letters(error=SHUTDOWN_ERROR)
+        if replayed:
+            logger.info(f"Re-queued {replayed} messages left undelivered at shutdown")
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for chat_id in list(self._notifications):
+                self._flush_notifications(chat_id)
+            unsent = [message for queue in self._chats.values() for message in queue]
+            self._chats.clear()
+            self._scheduled.clear()
+            if unsent:
+                await self._dead_letter(unsent, SHUTDOWN_ERROR)
+
+    def stats(self):
+        return {
+            'queued': sum(len(queue) for queue in self._chats.values()),
+            'chats': len(self._chats),
+            'pending_notifications': sum(len(texts) for texts in self._notifications.values()),
+            'sent': self.sent,
+            'retried': self.retried,
+            'coalesced': self.coalesced,
+            'dead_lettered': self.dead_lettered,
+        }
+
+
+message_dispatcher = MessageDispatcher.from_env()
+stats_registry.register('messages', message_dispatcher.stats)
@@ -0,0 +1,6 @@
+-- Migration to persist the payment watcher's last seen signature
+CREATE TABLE IF NOT EXISTS monitor_cursors (
+    name TEXT PRIMARY KEY,
+    last_signature TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+-- Migration to index subscription expiry for entitlement loading and sweeps
+CREATE INDEX IF NOT EXISTS idx_users_subscription_end_date ON users(subscription_end_date);
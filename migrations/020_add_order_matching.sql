@@ -0,0 +1,18 @@
+-- Migration to track partial fills and record matched trades
+ALTER TABLE trade_orders ADD COLUMN filled_amount REAL DEFAULT 0.0;
+
+CREATE TABLE IF NOT EXISTS trade_fills (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL,
+    buy_order_id INTEGER NOT NULL,
+    sell_order_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    seller_id INTEGER NOT NULL,
+    price REAL NOT NULL,
+    amount REAL NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (buy_order_id) REFERENCES trade_orders(id),
+    FOREIGN KEY (sell_order_id) REFERENCES trade_orders(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_trade_fills_token_timestamp ON trade_fills(token, timestamp);
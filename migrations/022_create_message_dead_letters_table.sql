@@ -0,0 +1,11 @@
+-- Migration to keep Telegram messages that could not be delivered
+CREATE TABLE IF NOT EXISTS message_dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_dead_letters_created_at ON message_dead_letters(created_at);
@@ -0,0 +1,41 @@
+-- Migration to record referral activity as an append-only event log
+CREATE TABLE IF NOT EXISTS referral_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    referrer_id INTEGER NOT NULL,
+    referred_id INTEGER,
+    payment_amount REAL,
+    reward REAL,
+    processed BOOLEAN DEFAULT 0 NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_events_processed ON referral_events(processed, id);
+CREATE INDEX IF NOT EXISTS idx_referral_events_referrer ON referral_events(referrer_id, id);
+
+-- Referral stats accumulated before the event log existed, the starting
+-- point when a referrer's totals are recomputed from their events
+CREATE TABLE IF NOT EXISTS referral_baselines (
+    referrer_id INTEGER PRIMARY KEY,
+    total_referrals INTEGER NOT NULL DEFAULT 0,
+    paid_referrals INTEGER NOT NULL DEFAULT 0,
+    referral_rewards REAL NOT NULL DEFAULT 0.0,
+    referral_tier INTEGER NOT NULL DEFAULT 0,
+    referral_tier_multiplier REAL NOT NULL DEFAULT 1.0,
+    first_referral_reward_claimed BOOLEAN DEFAULT 0 NOT NULL
+);
+
+INSERT INTO referral_baselines (
+    referrer_id, total_referrals, paid_referrals, referral_rewards,
+    referral_tier, referral_tier_multiplier, first_referral_reward_claimed
+)
+SELECT
+    telegram_id,
+    COALESCE(total_referrals, 0),
+    COALESCE(paid_referrals, 0),
+    COALESCE(referral_rewards, 0.0),
+    COALESCE(referral_tier, 0),
+    COALESCE(referral_tier_multiplier, 1.0),
+    first_referral_reward_claimed IS NOT NULL AND first_referral_reward_claimed
+FROM users
+WHERE total_referrals > 0 OR paid_referrals > 0 OR referral_rewards > 0;
@@ -0,0 +1,23 @@
+-- Migration to index the referral tree as a closure table: one row per
+-- (ancestor, descendant) pair, including each user paired with itself
+CREATE TABLE IF NOT EXISTS referral_closure (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_closure_descendant ON referral_closure(descendant_id, depth);
+CREATE INDEX IF NOT EXISTS idx_users_referrer_id ON users(referrer_id);
+
+-- Backfill from users.referrer_id; the depth guard and MIN() keep a
+-- referral cycle from recursing forever or duplicating pairs
+INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+    SELECT telegram_id, telegram_id, 0 FROM users
+    UNION ALL
+    SELECT tree.ancestor_id, users.telegram_id, tree.depth + 1
+    FROM tree JOIN users ON users.referrer_id = tree.descendant_id
+    WHERE tree.depth < 64 AND users.telegram_id <> users.referrer_id
+)
+SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id;
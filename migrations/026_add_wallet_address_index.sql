@@ -0,0 +1,2 @@
+-- Migration to index wallet addresses for attributing incoming payments
+CREATE INDEX IF NOT EXISTS idx_users_wallet_address ON users(wallet_address);
@@ -0,0 +1,14 @@
+-- Migration to record every credited on-chain payment exactly once
+-- A transaction may pay for several users, so rows are unique per signature and user
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    signature TEXT NOT NULL,
+    telegram_id INTEGER NOT NULL,
+    source_address TEXT,
+    amount REAL NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (telegram_id) REFERENCES users(telegram_id),
+    UNIQUE (signature, telegram_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_payments_telegram_id ON payments(telegram_id);
@@ -0,0 +1,2 @@
+-- Migration to remember when an auto-renewal reminder was last sent
+ALTER TABLE users ADD COLUMN renewal_reminded_at TIMESTAMP;
@@ -0,0 +1,11 @@
+-- Migration to hold attributed payments whose block time has no SOL/USD rate yet
+CREATE TABLE IF NOT EXISTS parked_payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    signature TEXT NOT NULL,
+    telegram_id INTEGER NOT NULL,
+    source_address TEXT,
+    amount REAL NOT NULL,
+    paid_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (signature, telegram_id)
+);
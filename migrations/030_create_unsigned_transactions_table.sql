@@ -0,0 +1,13 @@
+-- Migration to keep /buy and /sell transactions awaiting the user's signature
+-- One row per user, so a /submit can be verified by any worker
+CREATE TABLE IF NOT EXISTS unsigned_transactions (
+    telegram_id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    token TEXT,
+    amount REAL,
+    message TEXT NOT NULL,
+    last_valid_block_height INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
+);
@@ -0,0 +1,4 @@
+-- Migration to let any worker ask the order book owner to cancel a resting order
+ALTER TABLE trade_orders ADD COLUMN cancel_requested BOOLEAN DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_trade_orders_cancel_requested ON trade_orders(cancel_requested);
@@ -0,0 +1,4 @@
+-- PostgreSQL version of the referral tracking migration
+-- The SQLite file rebuilds the users table only to reset referral_tier_multiplier,
+-- which migration 005 already added; PostgreSQL keeps the table as is
+UPDATE users SET referral_tier_multiplier = 1.0;
@@ -13,6 +13,137 @@ class TradeOrder(db.Model):
     amount = db.Column(db.Float, nullable=False)
     price = db.Column(db.Float, nullable=False)
     trade_type = db.Column(db.String, nullable=False)  # 'buy' or 'sell'
-    status = db.Column(db.String, default='open')  # 'open', 'completed', 'cancelled'
+    status = db.Column(db.String, default='open')  # 'routed', 'open', 'partially_filled', 'completed', 'cancelled'
+    filled_amount = db.Column(db.Float, default=0.0)
+    cancel_requested = db.Column(db.Boolean, default=False)  # set by workers that don't own the books
     transaction_signature = db.Column(db.String, nullable=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class TradeFill(db.Model):
+    __tablename__ = 'trade_fills'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String, nullable=False)
+    buy_order_id = db.Column(db.Integer, db.ForeignKey('trade_orders.id'), nullable=False)
+    sell_order_id = db.Column(db.Integer, db.ForeignKey('trade_orders.id'), nullable=False)
+    buyer_id = db.Column(db.Integer, nullable=False)
+    seller_id = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OutboxTransaction(db.Model):
+    __tablename__ = 'tx_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String, unique=True, nullable=False)
+    telegram_id = db.Column(db.Integer, db.ForeignKey('users.telegram_id'), nullable=False)
+    chat_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String, nullable=False)  # 'buy' or 'sell'
+    token = db.Column(db.String, nullable=True)
+    amount = db.Column(db.Float, nullable=True)
+    raw_transaction = db.Column(db.String, nullable=False)  # base64 wire format
+    last_valid_block_height = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String, nullable=False, default='pending')  # 'pending', 'confirmed', 'failed', 'expired'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UnsignedTransaction(db.Model):
+    __tablename__ = 'unsigned_transactions'
+    
+    telegram_id = db.Column(db.Integer, db.ForeignKey('users.telegram_id'), primary_key=True)
+    chat_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String, nullable=False)  # 'buy' or 'sell'
+    token = db.Column(db.String, nullable=True)
+    amount = db.Column(db.Float, nullable=True)
+    message = db.Column(db.String, nullable=False)  # base64 message the user's wallet must sign
+    last_valid_block_height = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Payment(db.Model):
+    __tablename__ = 'payments'
+    __table_args__ = (db.UniqueConstraint('signature', 'telegram_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String, nullable=False)
+    telegram_id = db.Column(db.Integer, db.ForeignKey('users.telegram_id'), nullable=False)
+    source_address = db.Column(db.String, nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ParkedPayment(db.Model):
+    __tablename__ = 'parked_payments'
+    __table_args__ = (db.UniqueConstraint('signature', 'telegram_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String, nullable=False)
+    telegram_id = db.Column(db.Integer, nullable=False)
+    source_address = db.Column(db.String, nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+    paid_at = db.Column(db.DateTime, nullable=False)  # block time the amount is priced at
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class MessageDeadLetter(db.Model):
+    __tablename__ = 'message_dead_letters'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, nullable=False)
+    text = db.Column(db.String, nullable=False)
+    error = db.Column(db.String, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Broadcast(db.Model):
+    __tablename__ = 'broadcasts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String, nullable=False)
+    segment = db.Column(db.String, nullable=False, default='{}')  # JSON recipient filter
+    status = db.Column(db.String, nullable=False, default='running')  # 'running', 'completed', 'cancelled'
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)  # users.id checkpoint
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+class ReferralEvent(db.Model):
+    __tablename__ = 'referral_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)  # 'signup' or 'payment'
+    referrer_id = db.Column(db.Integer, nullable=False)
+    referred_id = db.Column(db.Integer, nullable=True)
+    payment_amount = db.Column(db.Float, nullable=True)
+    reward = db.Column(db.Float, nullable=True)  # set when aggregated
+    processed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ReferralBaseline(db.Model):
+    __tablename__ = 'referral_baselines'
+    
+    referrer_id = db.Column(db.Integer, primary_key=True)
+    total_referrals = db.Column(db.Integer, nullable=False, default=0)
+    paid_referrals = db.Column(db.Integer, nullable=False, default=0)
+    referral_rewards = db.Column(db.Float, nullable=False, default=0.0)
+    referral_tier = db.Column(db.Integer, nullable=False, default=0)
+    referral_tier_multiplier = db.Column(db.Float, nullable=False, default=1.0)
+    first_referral_reward_claimed = db.Column(db.Boolean, nullable=False, default=False)
+
+class ReferralClosure(db.Model):
+    __tablename__ = 'referral_closure'
+    
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    descendant_id = db.Column(db.Integer, primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)  # 0 for the user itself
+
+class MonitorCursor(db.Model):
+    __tablename__ = 'monitor_cursors'
+    
+    name = db.Column(db.String, primary_key=True)
+    last_signature = db.Column(db.String, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
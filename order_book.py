@@ -0,0 +1,202 @@
+import heapq
+import itertools
+from datetime import datetime
+
+# Amounts below this are treated as fully filled to absorb float rounding
+FILL_EPSILON = 1e-12
+
+
+class Order:
+    """Limit order resting in or crossing an order book."""
+
+    __slots__ = ('order_id', 'user_id', 'token', 'side', 'price', 'amount',
+                 'remaining', 'timestamp', 'sequence', 'status')
+
+    def __init__(self, order_id, user_id, token, side, price, amount, timestamp=None,
+                 remaining=None, status='open'):
+        if side not in ('buy', 'sell'):
+            raise ValueError(f"Invalid order side: {side}")
+        self.order_id = order_id
+        self.user_id = user_id
+        self.token = token
+        self.side = side
+        self.price = price
+        self.amount = amount
+        self.remaining = amount if remaining is None else remaining
+        self.timestamp = timestamp or datetime.utcnow()
+        self.sequence = None
+        self.status = status
+
+    @property
+    def filled(self):
+        return self.amount - self.remaining
+
+    @property
+    def is_active(self):
+        return self.status in ('open', 'partially_filled')
+
+    def apply_fill(self, amount):
+        self.remaining -= amount
+        if self.remaining <= FILL_EPSILON:
+            self.remaining = 0.0
+            self.status = 'completed'
+        else:
+            self.status = 'partially_filled'
+
+
+class Fill:
+    """One match between an incoming (taker) and a resting (maker) order."""
+
+    __slots__ = ('token', 'maker', 'taker', 'price', 'amount', 'timestamp')
+
+    def __init__(self, token, maker, taker, price, amount, timestamp):
+        self.token = token
+        self.maker = maker
+        self.taker = taker
+        self.price = price
+        self.amount = amount
+        self.timestamp = timestamp
+
+    @property
+    def buy_order(self):
+        return self.taker if self.taker.side == 'buy' else self.maker
+
+    @property
+    def sell_order(self):
+        return self.taker if self.taker.side == 'sell' else self.maker
+
+
+class OrderBook:
+    """
+    Limit order book for one token with price-time priority.
+
+    Bids and asks are heaps keyed on (price, arrival sequence); bids store
+    the negated price so the best bid is at the top. Cancelled and filled
+    orders are dropped lazily when they reach the top of their heap.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.orders = {}
+        self._bids = []
+        self._asks = []
+        self._sequence = itertools.count()
+
+    def _heap_for(self, side):
+        return self._bids if side == 'buy' else self._asks
+
+    def _push(self, order):
+        if order.sequence is None:
+            order.sequence = next(self._sequence)
+        key = -order.price if order.side == 'buy' else order.price
+        heapq.heappush(self._heap_for(order.side), (key, order.sequence, order))
+        self.orders[order.order_id] = order
+
+    def _top(self, side):
+        heap = self._heap_for(side)
+        while heap and not heap[0][2].is_active:
+            heapq.heappop(heap)
+        return heap[0][2] if heap else None
+
+    def best_bid(self):
+        order = self._top('buy')
+        return order.price if order else None
+
+    def best_ask(self):
+        order = self._top('sell')
+        return order.price if order else None
+
+    def submit(self, order, now=None):
+        """
+        Match an incoming order against resting orders, then rest the remainder.
+
+        Args:
+            order (Order): Incoming limit order
+            now (datetime): Fill timestamp, defaults to utcnow
+
+        Returns:
+            list: Fill objects in execution order
+        """
+        now = now or datetime.utcnow()
+        opposite = 'sell' if order.side == 'buy' else 'buy'
+        fills = []
+
+        while order.remaining > FILL_EPSILON:
+            maker = self._top(opposite)
+            if maker is None:
+                break
+            if order.side == 'buy' and maker.price > order.price:
+                break
+            if order.side == 'sell' and maker.price < order.price:
+                break
+
+            amount = min(order.remaining, maker.remaining)
+            maker.apply_fill(amount)
+            order.apply_fill(amount)
+            fills.append(Fill(self.token, maker, order, maker.price, amount, now))
+
+            if not maker.is_active:
+                heapq.heappop(self._heap_for(opposite))
+                del self.orders[maker.order_id]
+
+        if order.is_active:
+            self._push(order)
+        return fills
+
+    def rest(self, order):
+        """Add an order recovered from storage without matching it."""
+        if order.is_active:
+            self._push(order)
+
+    def replay_fill(self, order_id, amount):
+        """Apply a journaled fill to an order in the book."""
+        order = self.orders.get(order_id)
+        if order is not None:
+            order.apply_fill(amount)
+            if not order.is_active:
+                del self.orders[order_id]
+        return order
+
+    def cancel(self, order_id):
+        """Cancel a resting order. Returns the order, or None if unknown."""
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            order.status = 'cancelled'
+        return order
+
+    def open_orders(self):
+        """Return resting orders in arrival order."""
+        return sorted(self.orders.values(), key=lambda order: order.sequence)
+
+    def depth(self):
+        return len(self.orders)
+
+
+class MatchingEngine:
+    """Routes orders to a per-token order book."""
+
+    def __init__(self):
+        self.books = {}
+
+    def book(self, token):
+        book = self.books.get(token)
+        if book is None:
+            book = self.books[token] = OrderBook(token)
+        return book
+
+    def submit(self, order, now=None):
+        return self.book(order.token).submit(order, now)
+
+    def rest(self, order):
+        self.book(order.token).rest(order)
+
+    def replay_fill(self, token, order_id, amount):
+        book = self.books.get(token)
+        return book.replay_fill(order_id, amount) if book else None
+
+    def cancel(self, token, order_id):
+        book = self.books.get(token)
+        return book.cancel(order_id) if book else None
+
+    def open_orders(self):
+        return [order for book in self.books.values() for order in book.open_orders()]
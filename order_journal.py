@@ -0,0 +1,270 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+from order_book import Fill, MatchingEngine, Order
+
+logger = logging.getLogger(__name__)
+
+# length, crc32 of the payload, sequence number
+RECORD_HEADER = struct.Struct('<IIQ')
+
+SNAPSHOT_FILE = 'snapshot.bin'
+SEGMENT_PATTERN = 'journal-*.log'
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def encode_record(sequence, event):
+    payload = json.dumps(event, separators=(',', ':')).encode()
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload), sequence) + payload
+
+
+def read_records(path):
+    """
+    Yield (sequence, event, end_offset) for each intact record in a file.
+
+    The file is memory-mapped so replay does not copy it into Python buffers.
+    Reading stops at the first short or corrupt record, which is where a
+    crash interrupted the last append.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            offset = 0
+            while offset + RECORD_HEADER.size <= size:
+                length, checksum, sequence = RECORD_HEADER.unpack_from(view, offset)
+                start = offset + RECORD_HEADER.size
+                end = start + length
+                if end > size:
+                    return
+                payload = view[start:end]
+                if zlib.crc32(payload) != checksum:
+                    return
+                yield sequence, json.loads(payload), end
+                offset = end
+
+
+def order_event(order):
+    return ['o', order.order_id, order.user_id, order.token, order.side,
+            order.price, order.amount, to_epoch(order.timestamp)]
+
+
+def fill_event(fill):
+    return ['f', fill.token, fill.maker.order_id, fill.taker.order_id,
+            fill.price, fill.amount, to_epoch(fill.timestamp)]
+
+
+def cancel_event(order):
+    return ['c', order.token, order.order_id]
+
+
+def snapshot_event(order):
+    return ['r', order.order_id, order.user_id, order.token, order.side, order.price,
+            order.amount, order.remaining, order.status, to_epoch(order.timestamp)]
+
+
+class RecoveredState:
+    """Trading state rebuilt from the latest snapshot and the journal tail."""
+
+    def __init__(self, engine, last_sequence, max_order_id, unflushed_fills, unflushed_cancels, replayed):
+        self.engine = engine
+        self.last_sequence = last_sequence
+        self.max_order_id = max_order_id
+        self.unflushed_fills = unflushed_fills
+        self.unflushed_cancels = unflushed_cancels
+        self.replayed = replayed
+
+
+class OrderJournal:
+    """
+    Append-only journal of order book events with periodic snapshots.
+
+    Every new order, fill and cancel is appended as a length-prefixed,
+    checksummed record. A snapshot holds only the resting orders and the
+    sequence it covers; after writing one the journal rolls to a new segment
+    and older segments are deleted. Recovery loads the snapshot and replays
+    just the segment written since, so it is bounded by the book size and
+    the snapshot interval rather than by total order history.
+
+    'p' records mark the sequence up to which fills reached the database, so
+    fills journaled but lost with an unflushed batch can be written again.
+    """
+
+    def __init__(self, directory, snapshot_every=50000, fsync=True):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.last_sequence = 0
+        self.events_since_snapshot = 0
+        self._segment = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a journal from environment variables."""
+        return cls(
+            directory=os.getenv('TRADE_JOURNAL_DIR', 'data/trade_journal'),
+            snapshot_every=int(os.getenv('TRADE_SNAPSHOT_EVERY', '50000')),
+            fsync=os.getenv('TRADE_JOURNAL_FSYNC', 'true').lower() == 'true',
+        )
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segments(self):
+        return sorted(glob.glob(self._path(SEGMENT_PATTERN)))
+
+    def recover(self):
+        """
+        Rebuild the books from disk.
+
+        Returns:
+            RecoveredState: Recovered state, or None if nothing was journaled yet
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_path = self._path(SNAPSHOT_FILE)
+        segments = self._segments()
+        if not os.path.exists(snapshot_path) and not segments:
+            return None
+
+        engine = MatchingEngine()
+        orders = {}
+        last_sequence = max_order_id = 0
+        if os.path.exists(snapshot_path):
+            for _, event, _ in read_records(snapshot_path):
+                if event[0] == 's':
+                    _, last_sequence, max_order_id = event
+                    continue
+                _, order_id, user_id, token, side, price, amount, remaining, status, timestamp = event
+                order = Order(order_id, user_id, token, side, price, amount,
+                              timestamp=from_epoch(timestamp), remaining=remaining, status=status)
+                engine.rest(order)
+                orders[order_id] = order
+
+        flushed_sequence = last_sequence
+        pending_fills = []
+        pending_cancels = []
+        replayed = 0
+        for path in segments:
+            valid_end = 0
+            for sequence, event, end in read_records(path):
+                valid_end = end
+                if sequence <= last_sequence:
+                    continue
+                last_sequence = sequence
+                replayed += 1
+                kind = event[0]
+                if kind == 'o':
+                    _, order_id, user_id, token, side, price, amount, timestamp = event
+                    order = Order(order_id, user_id, token, side, price, amount,
+                                  timestamp=from_epoch(timestamp))
+                    engine.rest(order)
+                    orders[order_id] = order
+                    max_order_id = max(max_order_id, order_id)
+                elif kind == 'f':
+                    _, token, maker_id, taker_id, price, amount, timestamp = event
+                    engine.replay_fill(token, maker_id, amount)
+                    engine.replay_fill(token, taker_id, amount)
+                    if maker_id in orders and taker_id in orders:
+                        pending_fills.append((sequence, Fill(
+                            token, orders[maker_id], orders[taker_id], price, amount, from_epoch(timestamp)
+                        )))
+                elif kind == 'c':
+                    order = engine.cancel(event[1], event[2])
+                    if order is not None:
+                        pending_cancels.append((sequence, order))
+                elif kind == 'p':
+                    flushed_sequence = max(flushed_sequence, event[1])
+            self._truncate(path, valid_end)
+
+        self.last_sequence = last_sequence
+        self.events_since_snapshot = replayed
+        unflushed = [fill for sequence, fill in pending_fills if sequence > flushed_sequence]
+        cancels = [order for sequence, order in pending_cancels if sequence > flushed_sequence]
+        logger.info(f"Recovered order books at sequence {last_sequence}, "
+                    f"replayed {replayed} journal records, {len(unflushed)} unflushed fills")
+        return RecoveredState(engine, last_sequence, max_order_id, unflushed, cancels, replayed)
+
+    @staticmethod
+    def _truncate(path, valid_end):
+        """Drop a torn record left by a crash mid-append."""
+        if os.path.getsize(path) > valid_end:
+            logger.warning(f"Truncating torn journal tail in {path} at offset {valid_end}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        path = segments[-1] if segments else self._path(f"journal-{self.last_sequence + 1:020d}.log")
+        self._segment = open(path, 'ab')
+
+    def append(self, event):
+        """Append an event and return its sequence number."""
+        if self._segment is None:
+            self._open_segment()
+        self.last_sequence += 1
+        self.events_since_snapshot += 1
+        self._segment.write(encode_record(self.last_sequence, event))
+        return self.last_sequence
+
+    def mark_flushed(self, sequence):
+        """Record that fills up to `sequence` are committed to the database."""
+        self.append(['p', sequence])
+
+    def sync(self):
+        """Make appended events durable."""
+        if self._segment is not None:
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+
+    def snapshot_due(self):
+        return self.events_since_snapshot >= self.snapshot_every
+
+    def snapshot(self, engine, max_order_id):
+        """
+        Write the resting orders as a new snapshot and start a new segment.
+
+        The snapshot is written to a temporary file and renamed over the old
+        one, so a crash leaves either the previous or the new snapshot intact.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.sync()
+        temporary = self._path(SNAPSHOT_FILE + '.tmp')
+        with open(temporary, 'wb') as f:
+            f.write(encode_record(0, ['s', self.last_sequence, max_order_id]))
+            for order in engine.open_orders():
+                f.write(encode_record(0, snapshot_event(order)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._path(SNAPSHOT_FILE))
+
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        for path in self._segments():
+            os.remove(path)
+        self.events_since_snapshot = 0
+        logger.info(f"Wrote order book snapshot at sequence {self.last_sequence}")
+
+    def close(self):
+        self.sync()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from models import User
+from rpc_gateway import LAMPORTS_PER_SOL
+from storage import read_session
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IncomingTransfer:
+    """A native SOL transfer to the bot wallet."""
+
+    source_address: str
+    lamports: int
+    signature: str
+
+    @property
+    def amount(self):
+        return self.lamports / LAMPORTS_PER_SOL
+
+
+@dataclass(frozen=True)
+class AttributedPayment:
+    """An incoming transfer matched to the user owning the sending wallet."""
+
+    telegram_id: int
+    source_address: str
+    amount: float
+    signature: str
+
+
+def extract_transfers_to(transaction, destination):
+    """
+    Extract native SOL transfers to an address from a jsonParsed transaction.
+
+    Args:
+        transaction (dict): Result of getTransaction with jsonParsed encoding
+        destination (str): Receiving wallet address
+
+    Returns:
+        list: (source, lamports) tuples, top-level and inner instructions
+    """
+    if not transaction or (transaction.get('meta') or {}).get('err') is not None:
+        return []
+
+    instructions = list(transaction['transaction']['message'].get('instructions', []))
+    for inner in (transaction.get('meta') or {}).get('innerInstructions') or []:
+        instructions.extend(inner.get('instructions', []))
+
+    transfers = []
+    for instruction in instructions:
+        parsed = instruction.get('parsed')
+        if instruction.get('program') != 'system' or not isinstance(parsed, dict):
+            continue
+        if parsed.get('type') not in ('transfer', 'transferWithSeed'):
+            continue
+        info = parsed.get('info', {})
+        if info.get('destination') == destination:
+            transfers.append((info.get('source'), int(info.get('lamports', 0))))
+    return transfers
+
+
+def decode_transfers(transactions, destination):
+    """
+    Decode a batch of transactions into transfers to `destination`.
+
+    Args:
+        transactions: (signature, jsonParsed transaction) pairs in ledger order
+        destination (str): Receiving wallet address
+
+    Returns:
+        list: IncomingTransfer per transfer instruction
+    """
+    return [
+        IncomingTransfer(source, lamports, signature)
+        for signature, transaction in transactions
+        for source, lamports in extract_transfers_to(transaction, destination)
+    ]
+
+
+class WalletIndex:
+    """
+    In-memory map of wallet_address to telegram_id.
+
+    Loaded once from the users table and kept current by /wallet. Addresses
+    missing from the map, such as wallets set through another worker, are
+    resolved with one indexed IN query per batch and cached.
+
+    Addresses the query does not find either are remembered as unknown for
+    `unknown_ttl` seconds, or until /wallet registers them on this worker,
+    so a sender that keeps paying from an unregistered wallet costs one
+    query per TTL instead of one per batch.
+    """
+
+    def __init__(self, unknown_ttl=60.0, max_unknown=10000):
+        self.unknown_ttl = unknown_ttl
+        self.max_unknown = max_unknown
+        self.loaded = False
+        self.misses = 0
+        self.unknown_hits = 0
+        self._owners = {}
+        self._unknown = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a wallet index from environment variables."""
+        return cls(
+            unknown_ttl=float(os.getenv('WALLET_INDEX_UNKNOWN_TTL', '60')),
+            max_unknown=int(os.getenv('WALLET_INDEX_MAX_UNKNOWN', '10000')),
+        )
+
+    def load(self):
+        """Rebuild the index from every user with a wallet."""
+        with read_session() as session:
+            rows = session.query(User.wallet_address, User.telegram_id).filter(
+                User.wallet_address.isnot(None)
+            ).order_by(User.id).all()
+        with self._lock:
+            # Later registrations win if a wallet was set by several users
+            self._owners = dict(rows)
+            self.loaded = True
+        logger.info(f"Wallet index loaded with {len(rows)} wallets")
+
+    def update(self, telegram_id, wallet_address, previous_address=None):
+        """Record a user's new wallet address."""
+        with self._lock:
+            if previous_address and self._owners.get(previous_address) == telegram_id:
+                del self._owners[previous_address]
+            if wallet_address:
+                self._owners[wallet_address] = telegram_id
+                self._unknown.pop(wallet_address, None)
+
+    def owners(self, addresses):
+        """
+        Map wallet addresses to telegram ids.
+
+        Returns:
+            dict: address -> telegram_id for every address that belongs to a user
+        """
+        now = time.monotonic()
+        with self._lock:
+            found = {address: self._owners[address] for address in addresses if address in self._owners}
+            missing = set()
+            for address in addresses:
+                if address in found:
+                    continue
+                expires = self._unknown.get(address)
+                if expires is not None and expires > now:
+                    self.unknown_hits += 1
+                else:
+                    missing.add(address)
+        if missing:
+            self.misses += len(missing)
+            with read_session() as session:
+                rows = session.query(User.wallet_address, User.telegram_id).filter(
+                    User.wallet_address.in_(missing)
+                ).order_by(User.id).all()
+            with self._lock:
+                for address, telegram_id in rows:
+                    self._owners[address] = telegram_id
+                    found[address] = telegram_id
+                self._remember_unknown(missing - found.keys(), now + self.unknown_ttl)
+        return found
+
+    def _remember_unknown(self, addresses, expires):
+        for address in addresses:
+            self._unknown[address] = expires
+            self._unknown.move_to_end(address)
+        while len(self._unknown) > self.max_unknown:
+            self._unknown.popitem(last=False)
+
+    def __len__(self):
+        return len(self._owners)
+
+
+def attribute(transfers, index):
+    """
+    Hash-join incoming transfers against the wallet index.
+
+    Cost is one dict probe per transfer plus, at most, one indexed query
+    for senders the index has not seen. Transfers from one user within a
+    transaction are summed into one payment, since the ledger credits each
+    (signature, user) pair once.
+
+    Returns:
+        tuple: (AttributedPayment list, IncomingTransfer list from unknown wallets)
+    """
+    owners = index.owners({transfer.source_address for transfer in transfers})
+    lamports = {}
+    sources = {}
+    unattributed = []
+    for transfer in transfers:
+        telegram_id = owners.get(transfer.source_address)
+        if telegram_id is None:
+            unattributed.append(transfer)
+            continue
+        key = (transfer.signature, telegram_id)
+        lamports[key] = lamports.get(key, 0) + transfer.lamports
+        sources.setdefault(key, transfer.source_address)
+    attributed = [
+        AttributedPayment(telegram_id, sources[signature, telegram_id], total / LAMPORTS_PER_SOL, signature)
+        for (signature, telegram_id), total in lamports.items()
+    ]
+    return attributed, unattributed
+
+
+wallet_index = WalletIndex.from_env()
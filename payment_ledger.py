@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Payment
+from storage import read_session
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+# Signatures per IN query when confirming possible duplicates
+LOOKUP_CHUNK = 500
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class SignatureFilter:
+    """
+    Membership filter for processed payment signatures.
+
+    An exact LRU set of recent signatures answers "seen" with certainty.
+    Behind it, a scalable Bloom filter (a new, larger filter is added when
+    the current one fills up) answers "never seen" with certainty and
+    "maybe seen" otherwise.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001, recent_size=10000):
+        self.error_rate = error_rate
+        self.recent_size = recent_size
+        self._filters = [BloomFilter(capacity, error_rate)]
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, signature):
+        with self._lock:
+            if signature in self._recent:
+                self._recent.move_to_end(signature)
+                return
+            current = self._filters[-1]
+            if current.count >= current.capacity:
+                current = BloomFilter(current.capacity * 2, self.error_rate)
+                self._filters.append(current)
+            current.add(signature)
+            self._recent[signature] = None
+            self._recent.move_to_end(signature)
+            while len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+
+    def check(self, signature):
+        """
+        Returns:
+            bool: True if seen, False if never seen, None if it may have been seen
+        """
+        with self._lock:
+            if signature in self._recent:
+                return True
+            if any(signature in bloom for bloom in self._filters):
+                return None
+            return False
+
+    def stats(self):
+        return {
+            'signatures': sum(bloom.count for bloom in self._filters),
+            'filters': len(self._filters),
+            'bytes': sum(len(bloom._bits) for bloom in self._filters),
+            'recent': len(self._recent),
+        }
+
+
+def insert_payment(session, payment):
+    """
+    Add a payment to the ledger unless its signature is already credited to the user.
+
+    Runs inside the writer transaction that credits the payment, so the
+    ledger row and the subscription update commit or roll back together.
+
+    Args:
+        session: Writer session
+        payment: Object with telegram_id, source_address, amount and signature
+
+    Returns:
+        bool: Whether the row was inserted
+    """
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(Payment).values(
+        signature=payment.signature,
+        telegram_id=payment.telegram_id,
+        source_address=payment.source_address,
+        amount=payment.amount,
+    ).on_conflict_do_nothing(index_elements=['signature', 'telegram_id'])
+    return session.execute(statement).rowcount == 1
+
+
+class PaymentLedger:
+    """
+    Dedupe front for the `payments` table.
+
+    new_signatures() drops signatures that were already credited before any
+    transaction is fetched or written: recent ones are rejected from memory,
+    ones the Bloom filter has never seen pass straight through, and only
+    possible duplicates are confirmed with one indexed IN query. Every
+    transfer in a transaction is credited in the same batch, so a known
+    signature means the whole transaction was handled. The unique
+    (signature, telegram_id) constraint stays the final guard across workers.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001, recent_size=10000):
+        self.filter = SignatureFilter(capacity, error_rate, recent_size)
+        self.loaded = False
+        self.rejected_in_memory = 0
+        self.passed_in_memory = 0
+        self.db_checks = 0
+
+    @classmethod
+    def from_env(cls):
+        """Build a ledger filter from environment variables."""
+        return cls(
+            capacity=int(os.getenv('PAYMENT_FILTER_CAPACITY', '1000000')),
+            error_rate=float(os.getenv('PAYMENT_FILTER_ERROR_RATE', '0.001')),
+            recent_size=int(os.getenv('PAYMENT_FILTER_RECENT', '10000')),
+        )
+
+    def load(self, batch_size=10000):
+        """Seed the filter with every recorded signature, oldest first."""
+        last_id = 0
+        loaded = 0
+        while True:
+            with read_session() as session:
+                rows = session.query(Payment.id, Payment.signature).filter(
+                    Payment.id > last_id
+                ).order_by(Payment.id).limit(batch_size).all()
+            if not rows:
+                break
+            for _, signature in rows:
+                self.filter.add(signature)
+            last_id = rows[-1][0]
+            loaded += len(rows)
+        self.loaded = True
+        logger.info(f"Payment ledger filter loaded with {loaded} signatures")
+
+    def new_signatures(self, signatures):
+        """
+        Return the signatures that are not in the ledger, in their original order.
+        """
+        maybe = []
+        seen = set()
+        for signature in signatures:
+            state = self.filter.check(signature)
+            if state:
+                seen.add(signature)
+                self.rejected_in_memory += 1
+            elif state is None:
+                maybe.append(signature)
+            else:
+                self.passed_in_memory += 1
+
+        for start in range(0, len(maybe), LOOKUP_CHUNK):
+            chunk = maybe[start:start + LOOKUP_CHUNK]
+            self.db_checks += 1
+            with read_session() as session:
+                recorded = {
+                    signature for (signature,) in
+                    session.query(Payment.signature).filter(Payment.signature.in_(chunk))
+                }
+            seen |= recorded
+        return [signature for signature in signatures if signature not in seen]
+
+    def remember(self, signatures):
+        """Add committed signatures to the filter."""
+        for signature in signatures:
+            self.filter.add(signature)
+
+    def stats(self):
+        return {
+            **self.filter.stats(),
+            'rejected_in_memory': self.rejected_in_memory,
+            'passed_in_memory': self.passed_in_memory,
+            'db_checks': self.db_checks,
+        }
+
+
+payment_ledger = PaymentLedger.from_env()
+stats_registry.register('payment_ledger', payment_ledger.stats)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+
+import aiohttp
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import MonitorCursor, ParkedPayment
+from rpc_gateway import get_rpc_gateway
+from storage import db_writer, read_session
+from request_scheduler import set_background_priority
+from blockchain_monitor import block_time_of, credit_payment, get_bot_wallet_address, settle
+from payment_attribution import AttributedPayment, attribute, decode_transfers, wallet_index
+from payment_ledger import payment_ledger
+from plan_pricing import plan_pricing
+
+logger = logging.getLogger(__name__)
+
+CURSOR_NAME = 'payment_watcher'
+
+# Parked payments retried per catch-up
+PARKED_BATCH = 500
+
+
+class PaymentWatcher:
+    """
+    Follow the bot wallet and credit subscription payments as they land.
+
+    New signatures are paged from a persisted cursor with
+    getSignaturesForAddress. When a websocket endpoint is configured, a
+    logsSubscribe stream wakes the watcher as soon as a transaction that
+    mentions the wallet is confirmed; otherwise it polls on a short interval.
+
+    Payments whose block time has no SOL/USD rate, for example during a
+    price source outage, are parked instead of holding the cursor back.
+    Every catch-up retries them once their time can be priced.
+    """
+
+    def __init__(self, wallet_address, rpc=None, ws_url=None, commitment='confirmed',
+                 poll_interval=5.0, resync_interval=60.0, page_limit=100):
+        self.wallet_address = wallet_address
+        self.rpc = rpc or get_rpc_gateway()
+        self.ws_url = ws_url
+        self.commitment = commitment
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.page_limit = page_limit
+        self._session = None
+        self._catch_up_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a watcher from environment variables."""
+        return cls(
+            wallet_address=get_bot_wallet_address(),
+            ws_url=os.getenv('SOLANA_WS_ENDPOINT'),
+            commitment=os.getenv('PAYMENT_WATCHER_COMMITMENT', 'confirmed'),
+            poll_interval=float(os.getenv('PAYMENT_WATCHER_POLL_INTERVAL', '5')),
+        )
+
+    async def run(self):
+        """Run the watcher until cancelled."""
+        set_background_priority()
+        if not self.wallet_address:
+            logger.error("BOT_SOLANA_WALLET_ADDRESS is not set, payment watcher disabled.")
+            return
+
+        self._session = aiohttp.ClientSession()
+        try:
+            while True:
+                try:
+                    await self.catch_up()
+                    if self.ws_url:
+                        await self._follow_logs()
+                    else:
+                        await asyncio.sleep(self.poll_interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Payment watcher error: {str(e)}")
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            await self._session.close()
+            self._session = None
+
+    async def _follow_logs(self):
+        """Wake on logsSubscribe notifications, resyncing periodically as a safety net."""
+        async with self._session.ws_connect(self.ws_url, heartbeat=30) as ws:
+            await ws.send_json({
+                'jsonrpc': '2.0',
+                'id': 1,
+                'method': 'logsSubscribe',
+                'params': [{'mentions': [self.wallet_address]}, {'commitment': self.commitment}],
+            })
+            logger.info(f"Subscribed to logs for {self.wallet_address}")
+
+            while True:
+                try:
+                    message = await ws.receive(timeout=self.resync_interval)
+                except asyncio.TimeoutError:
+                    await self.catch_up()
+                    continue
+
+                if message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    logger.warning("Log subscription closed, reconnecting")
+                    return
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                data = json.loads(message.data)
+                if data.get('method') == 'logsNotification':
+                    await self.catch_up()
+
+    async def fetch_new_signatures(self, until):
+        """
+        Page signatures newer than the cursor.
+
+        Args:
+            until (str): Last processed signature, or None
+
+        Returns:
+            list: Signature records, oldest first
+        """
+        signatures = []
+        before = None
+        while True:
+            options = {'limit': self.page_limit, 'commitment': self.commitment}
+            if until:
+                options['until'] = until
+            if before:
+                options['before'] = before
+            page = await self.rpc.call('getSignaturesForAddress', [self.wallet_address, options])
+            signatures.extend(page)
+
+            # Without a cursor only the newest page is needed to establish one
+            if not until or len(page) < self.page_limit:
+                break
+            before = page[-1]['signature']
+
+        signatures.reverse()
+        return signatures
+
+    async def catch_up(self):
+        """Process every signature since the persisted cursor."""
+        async with self._catch_up_lock:
+            await self.retry_parked()
+            cursor = load_cursor(CURSOR_NAME)
+            signatures = await self.fetch_new_signatures(cursor)
+            if not signatures:
+                return
+
+            if cursor is None:
+                # First run starts from the current tip instead of replaying history
+                tip = signatures[-1]['signature']
+                await db_writer.write(lambda session: save_cursor(session, CURSOR_NAME, tip))
+                logger.info(f"Payment watcher cursor initialised at {tip}")
+                return
+
+            # Already credited signatures are skipped without fetching them
+            confirmed = payment_ledger.new_signatures(
+                [record['signature'] for record in signatures if record.get('err') is None]
+            )
+            transactions = dict(zip(confirmed, await self.rpc.get_transactions(confirmed, self.commitment)))
+
+            # A lagging endpoint may not have indexed a confirmed transaction yet; stop the
+            # page before it so the cursor never moves past a payment that was not read
+            unavailable = next((
+                index for index, record in enumerate(signatures)
+                if record['signature'] in transactions and transactions[record['signature']] is None
+            ), None)
+            if unavailable is not None:
+                logger.info(f"Transaction {signatures[unavailable]['signature']} is not available yet, retrying later")
+                signatures = signatures[:unavailable]
+                if not signatures:
+                    return
+
+            transfers = decode_transfers(
+                ((record['signature'], transactions.get(record['signature'])) for record in signatures),
+                self.wallet_address
+            )
+            attributed, unattributed = attribute(transfers, wallet_index)
+            for transfer in unattributed:
+                logger.warning(f"Payment {transfer.signature} from unknown wallet {transfer.source_address}")
+
+            # Amounts are priced at block time; rates are filled once for the whole page
+            payments = [
+                (payment, block_time_of(transactions.get(payment.signature)))
+                for payment in attributed
+            ]
+            uncovered = set(await plan_pricing.ensure(paid_at for _, paid_at in payments))
+            parked = [(payment, paid_at) for payment, paid_at in payments if paid_at in uncovered]
+            payments = [(payment, paid_at) for payment, paid_at in payments if paid_at not in uncovered]
+            for payment, _ in parked:
+                logger.warning(f"No SOL/USD rate for payment {payment.signature} yet, parking it")
+
+            # Credits, parked payments and the cursor move commit together
+            credited = await db_writer.write(
+                lambda session: apply_payments(session, payments, cursor, signatures[-1]['signature'], parked)
+            )
+            if credited is None:
+                logger.info("Payment cursor advanced by another worker, skipping page")
+                return
+            payment_ledger.remember(payment.signature for payment, _ in payments)
+            settle(credited)
+
+    async def retry_parked(self):
+        """Credit parked payments whose block time can now be priced."""
+        parked = load_parked_payments(PARKED_BATCH)
+        if not parked:
+            return
+        uncovered = set(await plan_pricing.ensure(paid_at for _, _, paid_at in parked))
+        ready = [(row_id, payment, paid_at) for row_id, payment, paid_at in parked if paid_at not in uncovered]
+        if not ready:
+            return
+        credited = await db_writer.write(lambda session: credit_parked_payments(session, ready))
+        payment_ledger.remember(payment.signature for _, payment, _ in ready)
+        logger.info(f"Retried {len(ready)} parked payments, {len(credited)} credited")
+        settle(credited)
+
+
+def load_cursor(name):
+    """Return the last processed signature for a cursor."""
+    with read_session() as session:
+        cursor = session.get(MonitorCursor, name)
+        return cursor.last_signature if cursor else None
+
+
+def save_cursor(session, name, signature):
+    """Persist the last processed signature for a cursor without committing."""
+    cursor = session.get(MonitorCursor, name)
+    if not cursor:
+        cursor = MonitorCursor(name=name)
+        session.add(cursor)
+    cursor.last_signature = signature
+
+
+def claim_cursor(session, name, expected_signature):
+    """
+    Lock a cursor row and check it still points at `expected_signature`.
+
+    The row lock makes concurrent workers that fetched the same page queue
+    up here; only the first one finds the cursor unchanged.
+    """
+    cursor = session.query(MonitorCursor).filter_by(name=name).with_for_update().first()
+    return cursor is not None and cursor.last_signature == expected_signature
+
+
+def apply_payments(session, payments, expected_cursor, last_signature, parked=()):
+    """
+    Credit a page of payments and advance the cursor without committing.
+
+    Args:
+        session: Writer session
+        payments (list): (AttributedPayment, block time) per transfer
+        expected_cursor (str): Cursor the page was fetched from
+        last_signature (str): Newest signature in the page
+        parked (list): (AttributedPayment, block time) pairs without a rate yet
+
+    Returns:
+        list: CreditedPayment for every credited payment, or None if another
+            worker already processed the page
+    """
+    if not claim_cursor(session, CURSOR_NAME, expected_cursor):
+        return None
+
+    credited = []
+    for payment, paid_at in payments:
+        credit = credit_payment(session, payment, paid_at)
+        if credit:
+            credited.append(credit)
+    park_payments(session, parked)
+    save_cursor(session, CURSOR_NAME, last_signature)
+    return credited
+
+
+def park_payments(session, parked):
+    """Store payments that cannot be priced yet without committing."""
+    if not parked:
+        return
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    session.execute(dialect.insert(ParkedPayment).values([{
+        'signature': payment.signature,
+        'telegram_id': payment.telegram_id,
+        'source_address': payment.source_address,
+        'amount': payment.amount,
+        'paid_at': paid_at,
+    } for payment, paid_at in parked]).on_conflict_do_nothing(index_elements=['signature', 'telegram_id']))
+
+
+def load_parked_payments(limit):
+    """
+    Returns:
+        list: (row id, AttributedPayment, block time) for the oldest parked payments
+    """
+    with read_session() as session:
+        rows = session.query(ParkedPayment).order_by(ParkedPayment.id).limit(limit).all()
+        return [
+            (row.id, AttributedPayment(row.telegram_id, row.source_address, row.amount, row.signature), row.paid_at)
+            for row in rows
+        ]
+
+
+def credit_parked_payments(session, ready):
+    """
+    Credit parked payments and remove them without committing.
+
+    A row is credited only by the worker whose delete removed it, so two
+    workers retrying the same row cannot both credit it.
+
+    Returns:
+        list: CreditedPayment for every credited payment
+    """
+    credited = []
+    for row_id, payment, paid_at in ready:
+        if session.query(ParkedPayment).filter_by(id=row_id).delete(synchronize_session=False) != 1:
+            continue
+        credit = credit_payment(session, payment, paid_at)
+        if credit:
+            credited.append(credit)
+    return credited
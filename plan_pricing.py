@@ -0,0 +1,320 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import aiohttp
+
+from request_scheduler import set_background_priority
+from token_registry import SOL, token_registry
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_URL = 'https://api.coingecko.com/api/v3/coins/solana/market_chart/range'
+
+# Missing timestamps closer together than this are fetched as one range
+RANGE_MERGE_SECONDS = 86400
+
+# Longest range per request; CoinGecko returns hourly samples up to 90 days
+MAX_RANGE_SECONDS = 30 * 86400
+
+
+@dataclass(frozen=True)
+class Plan:
+    """A subscription plan priced in USD."""
+
+    name: str
+    price_usd: float
+    duration_days: int
+
+
+WEEKLY_PLAN = Plan('weekly', 5.0, 7)
+ANNUAL_PLAN = Plan('annual', 1000.0, 365)
+PLANS = (WEEKLY_PLAN, ANNUAL_PLAN)
+
+
+class RateUnavailable(Exception):
+    """Raised when no SOL/USD rate can be found for a payment time."""
+
+
+def to_epoch(value):
+    """Convert a naive UTC datetime, aware datetime or epoch seconds to epoch seconds."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class RateHistory:
+    """
+    SOL/USD rates in fixed-width time buckets.
+
+    Each bucket holds the latest sample that fell into it. A lookup returns
+    the rate of the nearest bucket within `max_gap` seconds, so payments
+    that land close together share one rate.
+    """
+
+    def __init__(self, bucket_seconds=300, max_gap=3600):
+        self.bucket_seconds = bucket_seconds
+        self.max_gap = max_gap
+        self._rates = {}
+        self._buckets = []
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    def record(self, timestamp, rate):
+        bucket = self._bucket(timestamp)
+        if bucket not in self._rates:
+            bisect.insort(self._buckets, bucket)
+        self._rates[bucket] = rate
+
+    def rate_at(self, timestamp):
+        """
+        Returns:
+            float: USD per SOL at the nearest bucket, or None if none is within max_gap
+        """
+        bucket = self._bucket(timestamp)
+        rate = self._rates.get(bucket)
+        if rate is not None:
+            return rate
+        position = bisect.bisect_left(self._buckets, bucket)
+        nearest = [
+            candidate for candidate in self._buckets[max(0, position - 1):position + 1]
+            if abs(candidate - bucket) <= self.max_gap
+        ]
+        if not nearest:
+            return None
+        return self._rates[min(nearest, key=lambda candidate: abs(candidate - bucket))]
+
+    def prune(self, before):
+        """Drop buckets older than `before` (epoch seconds)."""
+        cutoff = bisect.bisect_left(self._buckets, self._bucket(before))
+        for bucket in self._buckets[:cutoff]:
+            del self._rates[bucket]
+        del self._buckets[:cutoff]
+
+    def to_json(self):
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'rates': [[bucket, self._rates[bucket]] for bucket in self._buckets],
+        }
+
+    def load_json(self, data):
+        for timestamp, rate in data.get('rates', []):
+            self.record(timestamp, rate)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CoinGeckoRateSource:
+    """Historical SOL/USD rates from CoinGecko's market chart range API."""
+
+    def __init__(self, url=DEFAULT_RATE_URL, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def fetch_range(self, start, end):
+        """
+        Returns:
+            list: (epoch seconds, USD per SOL) samples between start and end
+        """
+        params = {'vs_currency': 'usd', 'from': int(start), 'to': int(end)}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            async with session.get(self.url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+        return [(milliseconds / 1000, float(price)) for milliseconds, price in data.get('prices', [])]
+
+
+class StaticRateSource:
+    """A fixed SOL/USD rate, for local runs and tests without network access."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.requests = 0
+
+    async def fetch_range(self, start, end):
+        self.requests += 1
+        return [(start, self.rate), (end, self.rate)]
+
+
+class PlanPricing:
+    """
+    Matches SOL payments to USD-priced plans.
+
+    Rates live in a RateHistory persisted to a small JSON file. The current
+    rate is sampled from the token registry's SOL quote once per bucket by
+    run(); older payment times are filled by ensure(), which fetches each
+    missing span once for a whole batch. match() itself only reads memory,
+    so it can run inside writer transactions without a network call.
+    """
+
+    def __init__(self, source, cache_path=None, bucket_seconds=300, max_gap=3600,
+                 tolerance=0.05, retention_days=400):
+        self.source = source
+        self.cache_path = cache_path
+        self.tolerance = tolerance
+        self.retention_days = retention_days
+        self.history = RateHistory(bucket_seconds, max_gap)
+        self.range_fetches = 0
+        self.fetch_errors = 0
+        self._fetch_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a pricing oracle from environment variables."""
+        fixed_rate = os.getenv('SOL_USD_RATE')
+        if fixed_rate:
+            source = StaticRateSource(float(fixed_rate))
+        else:
+            source = CoinGeckoRateSource(os.getenv('SOL_USD_RATE_URL', DEFAULT_RATE_URL))
+        return cls(
+            source,
+            cache_path=os.getenv('PLAN_RATE_CACHE_PATH', 'sol_usd_rates.json'),
+            bucket_seconds=int(os.getenv('PLAN_RATE_BUCKET_SECONDS', '300')),
+            max_gap=int(os.getenv('PLAN_RATE_MAX_GAP', '3600')),
+            tolerance=float(os.getenv('PLAN_PRICE_TOLERANCE', '0.05')),
+        )
+
+    def load(self):
+        """Read cached rate buckets from disk, if any."""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as cache:
+                self.history.load_json(json.load(cache))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable rate cache {self.cache_path}: {str(e)}")
+            return
+        logger.info(f"Plan pricing loaded {len(self.history)} rate buckets")
+
+    def save(self):
+        """Write rate buckets to disk atomically."""
+        if not self.cache_path:
+            return
+        temporary = f"{self.cache_path}.tmp"
+        with open(temporary, 'w') as cache:
+            json.dump(self.history.to_json(), cache)
+        os.replace(temporary, self.cache_path)
+
+    def rate_at(self, paid_at):
+        return self.history.rate_at(to_epoch(paid_at))
+
+    def expected_amount(self, plan, paid_at=None):
+        """
+        Returns:
+            float: SOL price of a plan at a time, or None without a rate
+        """
+        rate = self.rate_at(paid_at if paid_at is not None else time.time())
+        return plan.price_usd / rate if rate else None
+
+    def match(self, amount, paid_at):
+        """
+        Find the plan a SOL amount pays for at a given time.
+
+        Only reads rates already in memory; call ensure() first for times
+        that may not be covered.
+
+        Args:
+            amount (float): Amount paid in SOL
+            paid_at: Payment time as a naive UTC datetime or epoch seconds
+
+        Returns:
+            Plan: The plan within tolerance of the amount, or None
+        """
+        rate = self.rate_at(paid_at)
+        if not rate:
+            return None
+        paid_usd = amount * rate
+        for plan in PLANS:
+            if abs(paid_usd - plan.price_usd) <= plan.price_usd * self.tolerance:
+                return plan
+        return None
+
+    def _missing_spans(self, timestamps):
+        missing = sorted(timestamp for timestamp in timestamps if self.history.rate_at(timestamp) is None)
+        spans = []
+        for timestamp in missing:
+            if (spans and timestamp - spans[-1][1] <= RANGE_MERGE_SECONDS
+                    and timestamp - spans[-1][0] <= MAX_RANGE_SECONDS):
+                spans[-1][1] = timestamp
+            else:
+                spans.append([timestamp, timestamp])
+        return spans
+
+    async def ensure(self, paid_at_times):
+        """
+        Fetch rates for payment times that are not covered yet, once per missing span.
+
+        A failed fetch is logged and counted instead of raised, so a payment
+        whose time cannot be priced does not hold up the rest of a batch.
+
+        Returns:
+            list: The payment times that still have no rate
+        """
+        paid_at_times = list(paid_at_times)
+        timestamps = {to_epoch(paid_at) for paid_at in paid_at_times}
+        if self._missing_spans(timestamps):
+            async with self._fetch_lock:
+                now = time.time()
+                if any(timestamp >= now - self.history.max_gap for timestamp in timestamps):
+                    await self.refresh_current()
+                # Another caller may have fetched the same span while this one waited
+                fetched = False
+                for start, end in self._missing_spans(timestamps):
+                    self.range_fetches += 1
+                    try:
+                        samples = await self.source.fetch_range(
+                            start - self.history.max_gap, min(now, end + self.history.max_gap)
+                        )
+                    except Exception as e:
+                        self.fetch_errors += 1
+                        logger.warning(f"SOL/USD rates unavailable for {int(start)}-{int(end)}: {str(e)}")
+                        continue
+                    for timestamp, rate in samples:
+                        self.history.record(timestamp, rate)
+                    fetched = True
+                if fetched:
+                    self.save()
+        return [paid_at for paid_at in paid_at_times if self.rate_at(paid_at) is None]
+
+    async def refresh_current(self):
+        """Record the current SOL/USD rate from the token registry's quote cache."""
+        quote = await token_registry.quote(SOL)
+        if quote:
+            self.history.record(time.time(), quote.price)
+
+    async def run(self, save_interval=600.0):
+        """Sample the current rate once per bucket and save periodically until cancelled."""
+        set_background_priority()
+        last_save = time.monotonic()
+        try:
+            while True:
+                await self.refresh_current()
+                if time.monotonic() - last_save >= save_interval:
+                    last_save = time.monotonic()
+                    self.history.prune(time.time() - self.retention_days * 86400)
+                    self.save()
+                await asyncio.sleep(self.history.bucket_seconds)
+        finally:
+            self.save()
+
+    def stats(self):
+        return {
+            'buckets': len(self.history),
+            'current_rate': self.rate_at(time.time()),
+            'range_fetches': self.range_fetches,
+            'fetch_errors': self.fetch_errors,
+        }
+
+
+plan_pricing = PlanPricing.from_env()
+stats_registry.register('plan_pricing', plan_pricing.stats)
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import aliased
+
+from models import ReferralClosure, User
+from storage import read_session
+from health import stats_registry
+
+
+def link_subtree(session, parent_id, child_id):
+    """Attach child_id's subtree under parent_id and every ancestor of it, without committing."""
+    ancestors = aliased(ReferralClosure)
+    descendants = aliased(ReferralClosure)
+    pairs = select(
+        ancestors.ancestor_id, descendants.descendant_id, ancestors.depth + descendants.depth + 1
+    ).where(ancestors.descendant_id == parent_id, descendants.ancestor_id == child_id)
+    session.execute(
+        insert(ReferralClosure).from_select(['ancestor_id', 'descendant_id', 'depth'], pairs)
+    )
+
+
+def add_user(session, telegram_id, referrer_id=None):
+    """
+    Index a newly created user in the referral tree without committing.
+
+    Users who registered earlier with this user's referral code before it
+    existed are attached underneath as well, matching the migration's
+    backfill from users.referrer_id.
+    """
+    session.add(ReferralClosure(ancestor_id=telegram_id, descendant_id=telegram_id, depth=0))
+    session.flush()
+    if referrer_id and referrer_id != telegram_id:
+        link_subtree(session, referrer_id, telegram_id)
+    orphans = session.query(User.telegram_id).filter(
+        User.referrer_id == telegram_id, User.telegram_id != telegram_id
+    ).all()
+    for (orphan_id,) in orphans:
+        link_subtree(session, telegram_id, orphan_id)
+
+
+def subtree_totals(session, telegram_id, max_depth=None):
+    """
+    Aggregate everyone below a user in the referral tree.
+
+    Args:
+        telegram_id (int): Root of the subtree
+        max_depth (int): Only count users at most this many levels down
+
+    Returns:
+        tuple: (users, total paid amount in SOL)
+    """
+    query = session.query(
+        func.count(ReferralClosure.descendant_id), func.coalesce(func.sum(User.total_paid_amount), 0.0)
+    ).join(User, User.telegram_id == ReferralClosure.descendant_id).filter(
+        ReferralClosure.ancestor_id == telegram_id, ReferralClosure.depth > 0
+    )
+    if max_depth is not None:
+        query = query.filter(ReferralClosure.depth <= max_depth)
+    count, paid = query.one()
+    return count, paid
+
+
+def upline(session, telegram_id, max_depth=None):
+    """
+    Return a user's referrers, nearest first.
+
+    Returns:
+        list: (telegram_id, depth) tuples
+    """
+    query = session.query(ReferralClosure.ancestor_id, ReferralClosure.depth).filter(
+        ReferralClosure.descendant_id == telegram_id, ReferralClosure.depth > 0
+    )
+    if max_depth is not None:
+        query = query.filter(ReferralClosure.depth <= max_depth)
+    return [tuple(row) for row in query.order_by(ReferralClosure.depth)]
+
+
+def downline_by_depth(session, telegram_id, max_depth=None):
+    """
+    Count a user's referrals per level.
+
+    Returns:
+        dict: depth -> number of users at that depth
+    """
+    query = session.query(ReferralClosure.depth, func.count()).filter(
+        ReferralClosure.ancestor_id == telegram_id, ReferralClosure.depth > 0
+    )
+    if max_depth is not None:
+        query = query.filter(ReferralClosure.depth <= max_depth)
+    return dict(query.group_by(ReferralClosure.depth).all())
+
+
+def leaderboard(session, limit=10, max_depth=None):
+    """
+    Rank users by paid volume in their referral subtree.
+
+    Returns:
+        list: (telegram_id, users, total paid amount) tuples, largest volume first
+    """
+    volume = func.sum(User.total_paid_amount)
+    query = session.query(
+        ReferralClosure.ancestor_id, func.count(ReferralClosure.descendant_id), volume
+    ).join(User, User.telegram_id == ReferralClosure.descendant_id).filter(ReferralClosure.depth > 0)
+    if max_depth is not None:
+        query = query.filter(ReferralClosure.depth <= max_depth)
+    rows = query.group_by(ReferralClosure.ancestor_id).order_by(volume.desc()).limit(limit).all()
+    return [tuple(row) for row in rows]
+
+
+@dataclass(frozen=True)
+class ReferralNetwork:
+    """A user's place in the referral tree, as shown by /referral."""
+
+    users: int
+    paid_volume: float
+    levels: dict
+    upline_depth: int
+
+
+def network_of(telegram_id, max_depth=None):
+    """Load a user's subtree totals, per-level counts and upline depth in one read session."""
+    with read_session() as session:
+        users, paid_volume = subtree_totals(session, telegram_id, max_depth)
+        return ReferralNetwork(
+            users=users,
+            paid_volume=paid_volume or 0.0,
+            levels=downline_by_depth(session, telegram_id, max_depth),
+            upline_depth=len(upline(session, telegram_id)),
+        )
+
+
+class LeaderboardCache:
+    """
+    The referral leaderboard with usernames, recomputed at most every `ttl` seconds.
+
+    Ranking aggregates the whole closure table, so /referral serves a shared
+    copy instead of running it for every request.
+    """
+
+    def __init__(self, size=5, ttl=300.0, max_depth=None):
+        self.size = size
+        self.ttl = ttl
+        self.max_depth = max_depth
+        self.refreshes = 0
+        self._entries = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a leaderboard cache from environment variables."""
+        max_depth = os.getenv('REFERRAL_NETWORK_DEPTH')
+        return cls(
+            size=int(os.getenv('REFERRAL_LEADERBOARD_SIZE', '5')),
+            ttl=float(os.getenv('REFERRAL_LEADERBOARD_TTL', '300')),
+            max_depth=int(max_depth) if max_depth else None,
+        )
+
+    def get(self):
+        """
+        Returns:
+            list: (telegram_id, username, users, total paid amount) tuples, largest volume first
+        """
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._entries = self._load()
+                self._loaded_at = time.monotonic()
+                self.refreshes += 1
+            return self._entries
+
+    def _load(self):
+        with read_session() as session:
+            ranked = leaderboard(session, self.size, self.max_depth)
+            names = dict(session.query(User.telegram_id, User.username).filter(
+                User.telegram_id.in_([telegram_id for telegram_id, _, _ in ranked])
+            ).all()) if ranked else {}
+        return [(telegram_id, names.get(telegram_id), users, paid or 0.0) for telegram_id, users, paid in ranked]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._loaded_at = None
+
+    def stats(self):
+        return {'entries': len(self._entries), 'refreshes': self.refreshes, 'ttl': self.ttl}
+
+
+leaderboard_cache = LeaderboardCache.from_env()
+stats_registry.register('referral_leaderboard', leaderboard_cache.stats)
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from models import ReferralBaseline, ReferralEvent, User
+from storage import db_writer
+from user_cache import invalidate_user
+from message_dispatcher import message_dispatcher
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+SIGNUP_REWARD = 5.00  # Base reward for a referred signup
+TIER_MULTIPLIERS = {0: 1.0, 1: 1.1, 2: 1.15, 3: 1.2}
+# Share of a referred user's payment paid to the referrer, by tier
+REWARD_PERCENTAGES = {0: 5, 1: 10, 2: 15, 3: 20}
+MAX_TIER = 3
+REFERRALS_PER_TIER = 100
+
+
+def record_signup(session, referrer_id, referred_id):
+    """Append a signup event for a referrer without committing."""
+    session.add(ReferralEvent(kind='signup', referrer_id=referrer_id, referred_id=referred_id))
+
+
+def record_payment(session, referrer_id, referred_id, payment_amount):
+    """Append a referred user's payment for a referrer without committing."""
+    session.add(ReferralEvent(
+        kind='payment', referrer_id=referrer_id, referred_id=referred_id, payment_amount=payment_amount
+    ))
+
+
+class ReferralTotals:
+    """
+    A referrer's referral stats, folded from events in log order.
+
+    Rewards depend on the tier reached so far, so events must be applied in
+    the order they were recorded.
+    """
+
+    FIELDS = ('total_referrals', 'paid_referrals', 'referral_rewards', 'referral_tier',
+              'referral_tier_multiplier', 'first_referral_reward_claimed')
+
+    def __init__(self, total_referrals=0, paid_referrals=0, referral_rewards=0.0, referral_tier=0,
+                 referral_tier_multiplier=1.0, first_referral_reward_claimed=False):
+        self.total_referrals = total_referrals or 0
+        self.paid_referrals = paid_referrals or 0
+        self.referral_rewards = referral_rewards or 0.0
+        self.referral_tier = referral_tier or 0
+        self.referral_tier_multiplier = referral_tier_multiplier or 1.0
+        self.first_referral_reward_claimed = bool(first_referral_reward_claimed)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{field: getattr(row, field) for field in cls.FIELDS})
+
+    def apply(self, event):
+        """
+        Fold one event into the totals.
+
+        Returns:
+            float: Reward credited for the event
+        """
+        if event.kind == 'signup':
+            current_tier = min(self.referral_tier, MAX_TIER)
+            reward = SIGNUP_REWARD * TIER_MULTIPLIERS[current_tier]
+            self.total_referrals += 1
+            if self.total_referrals % REFERRALS_PER_TIER == 0:
+                self.referral_tier = min(self.referral_tier + 1, MAX_TIER)
+            self.referral_tier_multiplier = TIER_MULTIPLIERS[current_tier]
+        elif event.kind == 'payment':
+            percentage = REWARD_PERCENTAGES[min(self.referral_tier, MAX_TIER)]
+            reward = event.payment_amount * (percentage / 100)
+            if not self.first_referral_reward_claimed:
+                # First paid referral earns a 100% bonus
+                self.first_referral_reward_claimed = True
+                reward *= 2
+            self.paid_referrals += 1
+            if self.paid_referrals % REFERRALS_PER_TIER == 0:
+                self.referral_tier = min(self.referral_tier + 1, MAX_TIER)
+        else:
+            raise ValueError(f"Unknown referral event kind: {event.kind}")
+        self.referral_rewards += reward
+        return reward
+
+
+def aggregate_events(session, limit=1000):
+    """
+    Fold the oldest unprocessed events into referrer rows without committing.
+
+    Counters are applied as atomic SQL increments, one UPDATE per referrer
+    for the whole batch. Rewards are computed from the referrer's totals as
+    of the batch and stored on each event.
+
+    On PostgreSQL the batch is claimed with FOR UPDATE SKIP LOCKED, so
+    aggregators in several workers fold disjoint events. Referrer rows are
+    locked in id order, so a concurrent batch for the same referrer waits
+    and then reads the committed totals. Both clauses are no-ops on SQLite,
+    where the writer thread already serialises batches.
+
+    Returns:
+        list: Processed events as (referrer_id, kind, reward) tuples
+    """
+    events = session.query(ReferralEvent).filter(
+        ReferralEvent.processed.is_(False)
+    ).order_by(ReferralEvent.id).limit(limit).with_for_update(skip_locked=True).all()
+    if not events:
+        return []
+
+    referrer_ids = {event.referrer_id for event in events}
+    totals = {
+        row.telegram_id: ReferralTotals.from_row(row)
+        for row in session.query(User).filter(
+            User.telegram_id.in_(referrer_ids)
+        ).order_by(User.telegram_id).with_for_update()
+    }
+    before = {referrer_id: ReferralTotals.from_row(state) for referrer_id, state in totals.items()}
+
+    processed = []
+    event_updates = []
+    for event in events:
+        state = totals.get(event.referrer_id)
+        reward = state.apply(event) if state else 0.0
+        if not state:
+            logger.warning(f"Referral event {event.id} for unknown referrer {event.referrer_id}")
+        event_updates.append({'id': event.id, 'reward': reward, 'processed': True})
+        processed.append((event.referrer_id, event.kind, reward))
+    session.bulk_update_mappings(ReferralEvent, event_updates)
+
+    for referrer_id, state in totals.items():
+        start = before[referrer_id]
+        session.query(User).filter(User.telegram_id == referrer_id).update({
+            User.total_referrals: User.total_referrals + (state.total_referrals - start.total_referrals),
+            User.paid_referrals: User.paid_referrals + (state.paid_referrals - start.paid_referrals),
+            User.referral_rewards: User.referral_rewards + (state.referral_rewards - start.referral_rewards),
+            User.referral_tier: state.referral_tier,
+            User.referral_tier_multiplier: state.referral_tier_multiplier,
+            User.first_referral_reward_claimed: state.first_referral_reward_claimed,
+        }, synchronize_session=False)
+    return processed
+
+
+def recompute(session, referrer_id):
+    """
+    Rebuild a referrer's stats from their baseline and processed events without committing.
+
+    Stored rewards on the events are rewritten as well, so the log and the
+    totals agree afterwards.
+
+    Returns:
+        ReferralTotals: The recomputed totals
+    """
+    baseline = session.get(ReferralBaseline, referrer_id)
+    state = ReferralTotals.from_row(baseline) if baseline else ReferralTotals()
+    events = session.query(ReferralEvent).filter(
+        ReferralEvent.referrer_id == referrer_id,
+        ReferralEvent.processed.is_(True)
+    ).order_by(ReferralEvent.id).all()
+    session.bulk_update_mappings(ReferralEvent, [
+        {'id': event.id, 'reward': state.apply(event)} for event in events
+    ])
+    session.query(User).filter(User.telegram_id == referrer_id).update(
+        {getattr(User, field): getattr(state, field) for field in ReferralTotals.FIELDS},
+        synchronize_session=False
+    )
+    return state
+
+
+class ReferralAggregator:
+    """
+    Background fold of the referral event log into per-referrer totals.
+
+    Signups and payments only append to `referral_events`, so a popular
+    referrer's row is not rewritten by every request that mentions it. The
+    aggregator runs on the writer thread, which serialises it with
+    recompute(), and invalidates cached snapshots of the referrers it
+    touched.
+    """
+
+    def __init__(self, writer=db_writer, interval=2.0, batch_size=1000):
+        self.writer = writer
+        self.interval = interval
+        self.batch_size = batch_size
+        self.processed = 0
+        self.batches = 0
+
+    @classmethod
+    def from_env(cls):
+        """Build an aggregator from environment variables."""
+        return cls(
+            interval=float(os.getenv('REFERRAL_AGGREGATE_INTERVAL', '2')),
+            batch_size=int(os.getenv('REFERRAL_AGGREGATE_BATCH', '1000')),
+        )
+
+    async def aggregate(self):
+        """Fold one batch of events. Returns the number processed."""
+        processed = await self.writer.write(lambda session: aggregate_events(session, self.batch_size))
+        if not processed:
+            return 0
+        self.processed += len(processed)
+        self.batches += 1
+        invalidate_user(*{referrer_id for referrer_id, _, _ in processed})
+        for referrer_id, kind, reward in processed:
+            if kind == 'payment' and reward:
+                message_dispatcher.notify(referrer_id, f"🎁 You earned a referral reward of {reward:.4f} SOL.")
+        return len(processed)
+
+    async def recompute(self, referrer_id):
+        """Rebuild one referrer's stats exactly from the event log."""
+        state = await self.writer.write(lambda session: recompute(session, referrer_id))
+        invalidate_user(referrer_id)
+        return state
+
+    async def run(self):
+        """Aggregate events until cancelled."""
+        while True:
+            try:
+                if await self.aggregate() >= self.batch_size:
+                    # Backlog: keep going without sleeping
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Referral aggregation failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {'processed': self.processed, 'batches': self.batches}
+
+
+referral_aggregator = ReferralAggregator.from_env()
+stats_registry.register('referrals', referral_aggregator.stats)
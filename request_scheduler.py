@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Tasks inherit the priority of the task that created them; background loops
+# lower their own so user commands are served first when a budget runs dry.
+request_priority = contextvars.ContextVar('request_priority', default=PRIORITY_INTERACTIVE)
+
+# Upper bounds in seconds; the last bucket catches everything above
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def set_background_priority():
+    """Mark the current task's requests as background work."""
+    request_priority.set(PRIORITY_BACKGROUND)
+
+
+class Histogram:
+    """Fixed-bucket histogram of wait times."""
+
+    def __init__(self, bounds=WAIT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.samples = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.samples += 1
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in self.bounds] + ['le_inf']
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.samples,
+            'mean': self.total / self.samples if self.samples else 0.0,
+        }
+
+
+class Budget:
+    """
+    Token bucket that queues callers instead of rejecting them.
+
+    Tokens refill at `rate` per second up to `burst`. A caller that finds the
+    bucket empty waits in a priority queue (lower value first, FIFO within a
+    priority); a single timer wakes the queue when enough tokens for the
+    head have accumulated.
+    """
+
+    def __init__(self, name, rate, burst=None):
+        if rate <= 0:
+            raise ValueError(f"Budget {name} needs a positive rate")
+        self.name = name
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.granted = 0
+        self.max_queue_depth = 0
+        self.wait_times = Histogram()
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def queue_depth(self):
+        return sum(1 for *_, future, _ in self._waiters if not future.done())
+
+    async def acquire(self, cost=1, priority=None):
+        """
+        Wait until `cost` tokens are available and take them.
+
+        A cost above the bucket's capacity can never be available at once, so
+        it is taken in capacity-sized parts; a large batch is paced at `rate`
+        for its full cost instead of being charged one bucketful.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        priority = request_priority.get() if priority is None else priority
+        waited = 0.0
+        while cost > self.capacity:
+            waited += await self._acquire(self.capacity, priority)
+            cost -= self.capacity
+        return waited + await self._acquire(cost, priority)
+
+    async def _acquire(self, cost, priority):
+        self._refill()
+        if not self._waiters and self.tokens >= cost:
+            self.tokens -= cost
+            self.granted += 1
+            self.wait_times.observe(0.0)
+            return 0.0
+
+        enqueued_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), cost, future, enqueued_at))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The heap entry is skipped by the next dispatch
+            self._schedule()
+            raise
+        waited = time.monotonic() - enqueued_at
+        self.wait_times.observe(waited)
+        return waited
+
+    def _schedule(self):
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+        if self._timer is not None or not self._waiters:
+            return
+        self._refill()
+        deficit = max(0.0, self._waiters[0][2] - self.tokens)
+        self._timer = asyncio.get_running_loop().call_later(deficit / self.rate, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, cost, future, _ = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.tokens < cost:
+                break
+            heapq.heappop(self._waiters)
+            self.tokens -= cost
+            self.granted += 1
+            future.set_result(None)
+        self._schedule()
+
+    def stats(self):
+        self._refill()
+        return {
+            'rate': self.rate,
+            'burst': self.capacity,
+            'tokens': self.tokens,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'granted': self.granted,
+            'wait_seconds': self.wait_times.snapshot(),
+        }
+
+
+def parse_method_limits(value):
+    """Parse 'method=rate,method=rate' into a dict."""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            method, rate = item.split('=', 1)
+            limits[method.strip()] = float(rate)
+    return limits
+
+
+class RequestScheduler:
+    """
+    Shared request budgets for outbound APIs.
+
+    RPC calls draw from a global `rpc` budget (one token per request in a
+    batch) and, when configured, from a per-method budget. Telegram sends
+    are limited separately by TelegramRateLimiter using the budgets
+    created here.
+    """
+
+    def __init__(self, rpc_rate=40.0, rpc_burst=None, rpc_method_limits=None):
+        self.budgets = {}
+        self.rpc = self.add('rpc', rpc_rate, rpc_burst)
+        self.rpc_methods = {
+            method: self.add(f"rpc:{method}", rate)
+            for method, rate in (rpc_method_limits or {}).items()
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Build a scheduler from environment variables."""
+        burst = os.getenv('SOLANA_RPC_RATE_BURST')
+        return cls(
+            rpc_rate=float(os.getenv('SOLANA_RPC_RATE_LIMIT', '40')),
+            rpc_burst=float(burst) if burst else None,
+            rpc_method_limits=parse_method_limits(os.getenv('SOLANA_RPC_METHOD_LIMITS')),
+        )
+
+    def add(self, name, rate, burst=None):
+        budget = self.budgets[name] = Budget(name, rate, burst)
+        return budget
+
+    async def acquire_rpc(self, methods):
+        """Wait for budget to send the given RPC methods in one HTTP request."""
+        for method, count in Counter(methods).items():
+            budget = self.rpc_methods.get(method)
+            if budget is not None:
+                await budget.acquire(count)
+        await self.rpc.acquire(len(methods))
+
+    def stats(self):
+        return {name: budget.stats() for name, budget in self.budgets.items()}
+
+
+request_scheduler = RequestScheduler.from_env()
+stats_registry.register('budgets', request_scheduler.stats)
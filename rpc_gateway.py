@@ -0,0 +1,287 @@
+import asyncio
+import base64
+import logging
+import os
+
+import aiohttp
+
+from health import stats_registry
+from request_scheduler import request_scheduler, set_background_priority
+from rpc_router import RpcRouter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPC_ENDPOINT = 'https://api.mainnet-beta.solana.com'
+
+LAMPORTS_PER_SOL = 1_000_000_000
+
+
+class RpcError(Exception):
+    """Raised when the Solana RPC node returns a JSON-RPC error."""
+
+
+# Methods that must not be duplicated by a hedged request
+NON_HEDGED_METHODS = {'sendTransaction', 'requestAirdrop'}
+
+
+class RpcGateway:
+    """
+    Process-wide Solana JSON-RPC client.
+
+    One keep-alive connection pool is shared by every caller, the number of
+    in-flight HTTP requests is capped by a semaphore, and many calls can be
+    sent in a single JSON-RPC batch round trip. Requests are routed across
+    the configured endpoints by an RpcRouter.
+    """
+
+    def __init__(self, endpoint, max_connections=20, max_concurrency=8,
+                 batch_size=50, timeout=30.0, keepalive_timeout=60.0, router=None, scheduler=None):
+        self.endpoint = endpoint
+        self.router = router or RpcRouter([endpoint])
+        self.scheduler = scheduler
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._semaphore = None
+        self._request_id = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a gateway from environment variables.
+
+        SOLANA_RPC_ENDPOINTS takes a comma-separated list of endpoints and
+        falls back to the single SOLANA_RPC_ENDPOINT.
+        """
+        endpoints = [url.strip() for url in os.getenv('SOLANA_RPC_ENDPOINTS', '').split(',') if url.strip()]
+        if not endpoints:
+            endpoints = [os.getenv('SOLANA_RPC_ENDPOINT', DEFAULT_RPC_ENDPOINT)]
+        router = RpcRouter(
+            endpoints,
+            failure_threshold=int(os.getenv('SOLANA_RPC_FAILURE_THRESHOLD', '5')),
+            cooldown=float(os.getenv('SOLANA_RPC_BREAKER_COOLDOWN', '30')),
+            hedge=os.getenv('SOLANA_RPC_HEDGE', 'true').lower() == 'true',
+            max_slot_lag=int(os.getenv('SOLANA_RPC_MAX_SLOT_LAG', '50')),
+            probe_interval=float(os.getenv('SOLANA_RPC_PROBE_INTERVAL', '10')),
+        )
+        return cls(
+            endpoint=endpoints[0],
+            max_connections=int(os.getenv('SOLANA_RPC_MAX_CONNECTIONS', '20')),
+            max_concurrency=int(os.getenv('SOLANA_RPC_MAX_CONCURRENCY', '8')),
+            batch_size=int(os.getenv('SOLANA_RPC_BATCH_SIZE', '50')),
+            timeout=float(os.getenv('SOLANA_RPC_TIMEOUT', '30')),
+            router=router,
+            scheduler=request_scheduler,
+        )
+
+    def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def _payload(self, method, params):
+        self._request_id += 1
+        return {'jsonrpc': '2.0', 'id': self._request_id, 'method': method, 'params': params or []}
+
+    async def _send(self, url, payload):
+        session = self._ensure_session()
+        async with self._semaphore:
+            async with session.post(url, json=payload) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def _post(self, payload):
+        requests = payload if isinstance(payload, list) else [payload]
+        hedge = not any(request['method'] in NON_HEDGED_METHODS for request in requests)
+        if self.scheduler is not None:
+            # Queue for provider rate limits; user commands go ahead of background work
+            await self.scheduler.acquire_rpc([request['method'] for request in requests])
+        return await self.router.request(self._send, payload, hedge=hedge)
+
+    async def run_health_checks(self):
+        """Probe endpoint slots and health until cancelled."""
+        set_background_priority()
+        await self.router.run(self._send)
+
+    async def call(self, method, params=None):
+        """
+        Send a single JSON-RPC request.
+
+        Args:
+            method (str): RPC method name
+            params (list): RPC parameters
+
+        Returns:
+            The `result` field of the response
+        """
+        body = await self._post(self._payload(method, params))
+        if body.get('error'):
+            raise RpcError(f"{method} failed: {body['error']}")
+        return body.get('result')
+
+    async def batch(self, calls, return_exceptions=False):
+        """
+        Send many requests as JSON-RPC batches.
+
+        Args:
+            calls (list): (method, params) tuples
+            return_exceptions (bool): Return RpcError instances in place of
+                failed results instead of raising the first error
+
+        Returns:
+            list: Results in the same order as `calls`
+        """
+        calls = list(calls)
+        chunks = []
+        for start in range(0, len(calls), self.batch_size):
+            chunks.append([self._payload(method, params) for method, params in calls[start:start + self.batch_size]])
+
+        responses = await asyncio.gather(*(self._post(chunk) for chunk in chunks))
+
+        results = []
+        for chunk, body in zip(chunks, responses):
+            if isinstance(body, list):
+                by_id = {item.get('id'): item for item in body if isinstance(item, dict)}
+            else:
+                # Nodes answer a batch they reject as a whole, e.g. when rate
+                # limited, with a single error object; it applies to every call
+                error = (body.get('error') if isinstance(body, dict) else None) or f"unexpected response {body!r}"
+                by_id = {payload['id']: {'error': error} for payload in chunk}
+            for payload in chunk:
+                item = by_id.get(payload['id'], {})
+                if item.get('error') or 'result' not in item:
+                    error = RpcError(f"{payload['method']} failed: {item.get('error', 'missing response')}")
+                    if not return_exceptions:
+                        raise error
+                    results.append(error)
+                else:
+                    results.append(item['result'])
+        return results
+
+    async def is_connected(self):
+        """Return whether the node reports itself healthy."""
+        try:
+            return await self.call('getHealth') == 'ok'
+        except Exception as e:
+            logger.warning(f"Solana RPC health check failed: {str(e)}")
+            return False
+
+    async def get_balance(self, address, commitment='confirmed'):
+        """Return the balance of an address in lamports."""
+        result = await self.call('getBalance', [address, {'commitment': commitment}])
+        return result['value']
+
+    async def get_balances(self, addresses, commitment='confirmed'):
+        """Return balances in lamports for many addresses in one round trip."""
+        results = await self.batch([('getBalance', [address, {'commitment': commitment}]) for address in addresses])
+        return [result['value'] for result in results]
+
+    async def get_multiple_accounts(self, addresses, commitment='confirmed'):
+        """
+        Return (slot, accounts) for up to 100 addresses in one request.
+
+        Account data is sliced to zero bytes since only lamports are needed;
+        missing accounts are None.
+        """
+        result = await self.call('getMultipleAccounts', [
+            list(addresses),
+            {'commitment': commitment, 'encoding': 'base64', 'dataSlice': {'offset': 0, 'length': 0}},
+        ])
+        return result['context']['slot'], result['value']
+
+    async def get_transaction(self, signature, commitment='confirmed'):
+        """Return a jsonParsed transaction, or None if it is not known yet."""
+        return await self.call('getTransaction', [signature, self._transaction_options(commitment)])
+
+    async def get_transactions(self, signatures, commitment='confirmed', return_exceptions=False):
+        """Return jsonParsed transactions for many signatures in one round trip."""
+        options = self._transaction_options(commitment)
+        return await self.batch(
+            [('getTransaction', [signature, options]) for signature in signatures],
+            return_exceptions=return_exceptions
+        )
+
+    async def get_signature_statuses(self, signatures, search_history=False):
+        """
+        Return status dicts (or None if unknown) for many signatures.
+
+        The node accepts up to 256 signatures per request; larger lists are
+        split into several requests sent as one JSON-RPC batch.
+        """
+        signatures = list(signatures)
+        chunks = [signatures[start:start + 256] for start in range(0, len(signatures), 256)]
+        results = await self.batch([
+            ('getSignatureStatuses', [chunk, {'searchTransactionHistory': search_history}])
+            for chunk in chunks
+        ])
+        return [status for result in results for status in result['value']]
+
+    async def get_block_height(self, commitment='confirmed'):
+        return await self.call('getBlockHeight', [{'commitment': commitment}])
+
+    async def get_latest_blockhash(self, commitment='confirmed'):
+        """Return (blockhash, last_valid_block_height)."""
+        result = await self.call('getLatestBlockhash', [{'commitment': commitment}])
+        return result['value']['blockhash'], result['value']['lastValidBlockHeight']
+
+    @staticmethod
+    def _transaction_options(commitment):
+        return {'encoding': 'jsonParsed', 'commitment': commitment, 'maxSupportedTransactionVersion': 0}
+
+    async def send_transaction(self, transaction, skip_preflight=False, max_retries=None):
+        """
+        Submit a serialized transaction.
+
+        Args:
+            transaction: Transaction object exposing serialize(), or raw bytes
+            skip_preflight (bool): Skip the node's simulation step
+            max_retries (int): How often the node itself rebroadcasts; None
+                leaves the node default
+
+        Returns:
+            str: Transaction signature
+        """
+        raw = transaction if isinstance(transaction, (bytes, bytearray)) else transaction.serialize()
+        encoded = base64.b64encode(bytes(raw)).decode('ascii')
+        options = {'encoding': 'base64', 'skipPreflight': skip_preflight}
+        if max_retries is not None:
+            options['maxRetries'] = max_retries
+        return await self.call('sendTransaction', [encoded, options])
+
+    async def close(self):
+        """Close the connection pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_gateway = None
+
+
+def get_rpc_gateway():
+    """Return the process-wide RPC gateway, creating it on first use."""
+    global _gateway
+    if _gateway is None:
+        _gateway = RpcGateway.from_env()
+        stats_registry.register('rpc', _gateway.router.stats)
+    return _gateway
+
+
+async def close_rpc_gateway():
+    """Close the process-wide RPC gateway if it was created."""
+    global _gateway
+    if _gateway is not None:
+        await _gateway.close()
+        _gateway = None
+        stats_registry.unregister('rpc')
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# JSON-RPC errors caused by the request itself rather than the endpoint: invalid
+# request, unknown method, invalid params, preflight and signature failures
+REQUEST_ERROR_CODES = {-32600, -32601, -32602, -32002, -32003}
+
+
+class ErrorResponse(Exception):
+    """An endpoint answered with a JSON-RPC error that reflects on the endpoint."""
+
+    def __init__(self, body):
+        super().__init__(str(body.get('error')))
+        self.body = body
+
+
+def endpoint_error(body):
+    """Whether a response body is an error that counts against the endpoint."""
+    if not isinstance(body, dict) or not body.get('error'):
+        return False
+    error = body['error']
+    return not (isinstance(error, dict) and error.get('code') in REQUEST_ERROR_CODES)
+
+
+def redact_url(url):
+    """Reduce an endpoint URL to scheme and host; provider API keys live in the path or query."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.hostname}" + (f":{parts.port}" if parts.port else '')
+
+
+class EndpointHealth:
+    """Rolling health statistics and circuit breaker state for one endpoint."""
+
+    def __init__(self, url, alpha=0.2, window=200):
+        self.url = url
+        self.label = redact_url(url)
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=window)
+        self.slot = None
+        self.slot_lag = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.requests = 0
+        self.failures = 0
+
+    def record_latency(self, latency):
+        self.samples.append(latency)
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+
+    def record_success(self, latency):
+        self.requests += 1
+        self.record_latency(latency)
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self, failure_threshold, now):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Opening circuit for RPC endpoint {self.label}")
+            # A failed half-open trial keeps the circuit open for another cooldown
+            self.opened_at = now
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def is_available(self, now, cooldown):
+        """Closed, or open long enough to allow a half-open trial."""
+        return self.opened_at is None or now - self.opened_at >= cooldown
+
+    def stats(self):
+        return {
+            'endpoint': self.label,
+            'latency_ewma': self.latency,
+            'latency_p95': self.percentile(0.95),
+            'error_rate': self.error_rate,
+            'slot_lag': self.slot_lag,
+            'circuit': 'closed' if self.opened_at is None else 'open',
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+class RpcRouter:
+    """
+    Route JSON-RPC requests across several endpoints.
+
+    Endpoints are ranked by latency EWMA, penalised by their recent error
+    rate and by how many slots they trail the highest slot seen. Requests go
+    to the best ranked endpoint; a read that takes longer than that
+    endpoint's p95 latency is hedged to the runner-up and the first answer
+    wins. A failed request fails over to the next endpoint. After
+    `failure_threshold` consecutive failures an endpoint's circuit opens
+    and it is skipped until `cooldown` seconds pass, when one request is let
+    through to test it.
+
+    An HTTP 200 carrying a JSON-RPC error that is not about the request
+    itself (rate limiting, a node that is behind, internal errors) counts as
+    a failure and fails over like a transport error. A hedged attempt that
+    loses the race still records how long it ran, so a slow endpoint's p95
+    is not computed from its fast answers only.
+    """
+
+    def __init__(self, endpoints, failure_threshold=5, cooldown=30.0, hedge=True,
+                 min_hedge_delay=0.05, default_hedge_delay=0.5, max_slot_lag=50,
+                 slot_lag_penalty=0.02, probe_interval=10.0):
+        if not endpoints:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = [EndpointHealth(url) for url in endpoints]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.max_slot_lag = max_slot_lag
+        self.slot_lag_penalty = slot_lag_penalty
+        self.probe_interval = probe_interval
+        self.hedged = 0
+        self.hedges_won = 0
+        self.failovers = 0
+
+    def _score(self, endpoint):
+        latency = endpoint.latency if endpoint.latency is not None else self.default_hedge_delay
+        return latency * (1 + 4 * endpoint.error_rate) + endpoint.slot_lag * self.slot_lag_penalty
+
+    def ranked(self):
+        """Return endpoints best first; open circuits only if nothing else is left."""
+        now = time.monotonic()
+        available = [
+            endpoint for endpoint in self.endpoints
+            if endpoint.is_available(now, self.cooldown) and endpoint.slot_lag <= self.max_slot_lag
+        ]
+        if not available:
+            available = [endpoint for endpoint in self.endpoints if endpoint.is_available(now, self.cooldown)]
+        if not available:
+            # Everything is open: try whichever circuit opened first
+            return sorted(self.endpoints, key=lambda endpoint: endpoint.opened_at)
+        return sorted(available, key=self._score)
+
+    async def _attempt(self, send, endpoint, payload):
+        started = time.monotonic()
+        try:
+            result = await send(endpoint.url, payload)
+        except asyncio.CancelledError:
+            # The losing side of a hedge ran at least this long
+            endpoint.record_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            endpoint.record_failure(self.failure_threshold, time.monotonic())
+            raise
+        if endpoint_error(result):
+            endpoint.record_failure(self.failure_threshold, time.monotonic())
+            raise ErrorResponse(result)
+        endpoint.record_success(time.monotonic() - started)
+        return result
+
+    async def request(self, send, payload, hedge=True):
+        """
+        Send a payload through the best endpoint.
+
+        Args:
+            send: Coroutine function send(url, payload) performing one request
+            payload: JSON-RPC request or batch
+            hedge (bool): Whether a duplicate request is safe for this payload
+
+        Returns:
+            The decoded response body; an error body if every endpoint tried answered with one
+        """
+        try:
+            return await self._request(send, payload, hedge)
+        except ErrorResponse as e:
+            return e.body
+
+    async def _request(self, send, payload, hedge):
+        ranked = self.ranked()
+        primary = ranked[0]
+        if len(ranked) == 1:
+            return await self._attempt(send, primary, payload)
+        backup = ranked[1]
+
+        first = asyncio.ensure_future(self._attempt(send, primary, payload))
+        delay = None
+        if hedge and self.hedge:
+            delay = max(self.min_hedge_delay, primary.percentile(0.95) or self.default_hedge_delay)
+        done, _ = await asyncio.wait({first}, timeout=delay)
+
+        if done:
+            if first.exception() is None:
+                return first.result()
+            self.failovers += 1
+            return await self._attempt(send, backup, payload)
+
+        # The primary is slower than its p95: race it against the backup
+        self.hedged += 1
+        second = asyncio.ensure_future(self._attempt(send, backup, payload))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def probe(self, send):
+        """Refresh every endpoint's slot, latency and circuit state with getSlot."""
+        payload = {'jsonrpc': '2.0', 'id': 0, 'method': 'getSlot', 'params': [{'commitment': 'confirmed'}]}
+        results = await asyncio.gather(
+            *(self._attempt(send, endpoint, payload) for endpoint in self.endpoints),
+            return_exceptions=True
+        )
+        slots = {}
+        for endpoint, body in zip(self.endpoints, results):
+            if not isinstance(body, Exception) and isinstance(body, dict) and 'result' in body:
+                endpoint.slot = body['result']
+                slots[endpoint.url] = endpoint.slot
+        if slots:
+            highest = max(slots.values())
+            for endpoint in self.endpoints:
+                endpoint.slot_lag = highest - endpoint.slot if endpoint.url in slots else endpoint.slot_lag
+
+    async def run(self, send):
+        """Probe endpoints on an interval until cancelled."""
+        if len(self.endpoints) == 1:
+            return
+        while True:
+            try:
+                await self.probe(send)
+            except Exception as e:
+                logger.warning(f"RPC endpoint probe failed: {str(e)}")
+            await asyncio.sleep(self.probe_interval)
+
+    def stats(self):
+        return {
+            'hedged': self.hedged,
+            'hedges_won': self.hedges_won,
+            'failovers': self.failovers,
+            'endpoints': [endpoint.stats() for endpoint in self.endpoints],
+        }
@@ -2,9 +2,11 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from abilities import flask_app_authenticator
+from storage import database_url, engine_options, install_sqlite_pragmas
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bot.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY')
 
@@ -17,4 +19,6 @@ app.before_request(flask_app_authenticator(
     session_expiry=None
 ))
 
+install_sqlite_pragmas()
+
 db = SQLAlchemy(app)
\ No newline at end of file
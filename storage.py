@@ -0,0 +1,351 @@
+import asyncio
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'foreign_keys': 'ON',
+}
+
+# Cleared while migrations rebuild tables that other tables reference
+_enforce_foreign_keys = True
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas=None):
+    """Apply the SQLite performance profile to a DB-API connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in (pragmas or SQLITE_PRAGMAS).items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas():
+    """Apply the SQLite profile to every connection any engine opens."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_sqlite_pragmas(dbapi_connection)
+            if not _enforce_foreign_keys:
+                apply_sqlite_pragmas(dbapi_connection, {'foreign_keys': 'OFF'})
+
+
+@contextlib.contextmanager
+def sqlite_foreign_keys_disabled(engine):
+    """
+    Open the engine's connections without foreign key enforcement.
+
+    SQLite only honours the pragma outside a transaction, so the pool is
+    emptied on entry and exit to reconnect with the other setting.
+    """
+    global _enforce_foreign_keys
+    _enforce_foreign_keys = False
+    engine.dispose()
+    try:
+        yield engine
+    finally:
+        _enforce_foreign_keys = True
+        engine.dispose()
+
+
+def database_url():
+    """Return the configured database URL, defaulting to the local SQLite file."""
+    url = os.getenv('DATABASE_URL', 'sqlite:///bot.db')
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    """SQLAlchemy engine options for the configured backend."""
+    if url.startswith('sqlite'):
+        return sqlite_engine_options()
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_engine_options():
+    """SQLAlchemy engine options for a file-backed SQLite database."""
+    return {
+        'connect_args': {
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+            'check_same_thread': False,
+        },
+        'pool_size': int(os.getenv('SQLITE_POOL_SIZE', '8')),
+        'max_overflow': 0,
+        'pool_pre_ping': False,
+    }
+
+
+_read_engine = None
+_read_sessionmaker = None
+
+
+def read_only_url(url):
+    """
+    Return a read-only URI for the SQLite file an engine URL points at.
+
+    Args:
+        url (sqlalchemy.engine.URL): URL of the writer engine, whose relative
+            paths Flask-SQLAlchemy has already resolved against the instance folder
+    """
+    return f"sqlite:///file:{os.path.abspath(url.database)}?mode=ro&uri=true"
+
+
+@contextlib.contextmanager
+def read_session():
+    """
+    Yield a session from the read pool.
+
+    Reads on SQLite go through a separate read-only engine so they never wait
+    behind the writer's connection; other backends share the main engine.
+    """
+    global _read_engine, _read_sessionmaker
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from shared_resources import app, db
+
+    if _read_sessionmaker is None:
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            _read_engine = create_engine(
+                read_only_url(engine.url),
+                pool_size=int(os.getenv('SQLITE_READ_POOL_SIZE', '8')),
+                max_overflow=0,
+                connect_args={'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False},
+            )
+        else:
+            _read_engine = engine
+        _read_sessionmaker = sessionmaker(bind=_read_engine, expire_on_commit=False)
+
+    session = _read_sessionmaker()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@contextlib.contextmanager
+def flask_session_scope():
+    """Yield the Flask-SQLAlchemy session inside an application context."""
+    from shared_resources import app, db
+
+    with app.app_context():
+        yield db.session
+
+
+class AdvisoryLease:
+    """
+    Elects one worker to run a job that must not run on several at once.
+
+    On PostgreSQL the holder keeps a session-level advisory lock on a
+    dedicated connection, which the server releases if the worker dies.
+    SQLite deployments run a single worker, which always holds the lease.
+
+    Args:
+        key (int): Advisory lock key, unique per job
+        name (str): Job name for log messages
+    """
+
+    def __init__(self, key, name='Advisory'):
+        self.key = key
+        self.name = name
+        self.shared = False
+        self.held = False
+        self._connection = None
+
+    def acquire(self):
+        """Try to take the lease without waiting. Returns True if this worker holds it."""
+        if self.held:
+            return True
+        from sqlalchemy import text
+        from shared_resources import app, db
+
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != 'postgresql':
+            self.held = True
+            return True
+        self.shared = True
+        try:
+            if self._connection is None:
+                self._connection = engine.connect()
+            self.held = bool(self._connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {'key': self.key}
+            ).scalar())
+            # The lock outlives the transaction; don't sit idle in one
+            self._connection.commit()
+        except Exception as e:
+            logger.error(f"{self.name} lease check failed: {str(e)}")
+            self._reset()
+        return self.held
+
+    def check(self):
+        """Confirm the lease connection is alive. Returns False once the lease is lost."""
+        if not self.shared or not self.held:
+            return self.held
+        from sqlalchemy import text
+
+        try:
+            self._connection.execute(text("SELECT 1"))
+            self._connection.commit()
+        except Exception as e:
+            logger.error(f"{self.name} lease lost: {str(e)}")
+            self._reset()
+        return self.held
+
+    def release(self):
+        if self.shared and self.held:
+            from sqlalchemy import text
+
+            try:
+                self._connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': self.key})
+                self._connection.commit()
+            except Exception as e:
+                logger.warning(f"Failed to release {self.name.lower()} lease: {str(e)}")
+        self._reset()
+
+    def _reset(self):
+        self.held = False
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+class DatabaseWriter:
+    """
+    Single writer thread that group-commits queued write jobs.
+
+    Jobs are callables taking the session. Every job queued while the previous
+    commit was in flight is applied in one transaction, so many logical
+    writes share a single fsync. If the group fails, each job is retried in
+    its own transaction so one bad write cannot fail the others.
+    """
+
+    _STOP = object()
+
+    def __init__(self, session_scope=flask_session_scope, max_batch=256):
+        self.session_scope = session_scope
+        self.max_batch = max_batch
+        self.commits = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Flush queued jobs and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, fn):
+        """
+        Queue a write job.
+
+        Args:
+            fn: Callable taking the session; its return value resolves the future
+
+        Returns:
+            concurrent.futures.Future: Resolved after the job is committed
+        """
+        if self._thread is None:
+            self.start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    async def write(self, fn):
+        """Queue a write job and wait for its commit."""
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is self._STOP:
+                return
+            batch = [job]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is self._STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch):
+        with self.session_scope() as session:
+            try:
+                results = [fn(session) for fn, _ in batch]
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    return
+                logger.warning(f"Group commit of {len(batch)} writes failed, retrying individually: {str(e)}")
+                for fn, future in batch:
+                    self._commit_one(session, fn, future)
+                return
+
+            self.commits += 1
+            self.jobs += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _commit_one(self, session, fn, future):
+        try:
+            result = fn(session)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            future.set_exception(e)
+            return
+        self.commits += 1
+        self.jobs += 1
+        future.set_result(result)
+
+
+db_writer = DatabaseWriter(max_batch=int(os.getenv('DB_WRITER_MAX_BATCH', '256')))
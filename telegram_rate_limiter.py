@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from request_scheduler import Budget, request_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Queue Bot API requests to stay under Telegram's send limits.
+
+    Every request that targets a chat draws from a global budget (about 30
+    messages per second per bot) and from that chat's own budget (about one
+    per second in private chats, 20 per minute in groups). Requests wait in
+    priority order instead of failing, so replies to user commands go ahead
+    of background notifications. A RetryAfter from Telegram is honoured and
+    the request retried up to `max_retries` times.
+
+    `rate_limit_args` may be an int priority, or a dict with optional
+    'priority' and 'max_retries' keys. Callers that handle RetryAfter
+    themselves pass {'max_retries': 0} so the pause is not applied twice.
+    """
+
+    def __init__(self, scheduler=request_scheduler, global_rate=30.0, private_chat_rate=1.0,
+                 group_chat_rate=20 / 60, max_chats=10000, max_retries=3):
+        self.scheduler = scheduler
+        self.global_budget = scheduler.add('telegram', global_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.max_chats = max_chats
+        self.max_retries = max_retries
+        self.retries = 0
+        self._chats = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        """Build a rate limiter from environment variables."""
+        return cls(
+            global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE_LIMIT', '30')),
+            private_chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE_LIMIT', '1')),
+            group_chat_rate=float(os.getenv('TELEGRAM_GROUP_RATE_LIMIT', str(20 / 60))),
+        )
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_budget(self, chat_id):
+        budget = self._chats.get(chat_id)
+        if budget is None:
+            # Negative ids are groups and channels
+            rate = self.group_chat_rate if str(chat_id).startswith('-') else self.private_chat_rate
+            budget = self._chats[chat_id] = Budget(f"telegram:{chat_id}", rate)
+            while len(self._chats) > self.max_chats:
+                oldest = next(iter(self._chats))
+                if self._chats[oldest].queue_depth:
+                    # Least recently used chat still has queued sends
+                    break
+                del self._chats[oldest]
+        else:
+            self._chats.move_to_end(chat_id)
+        return budget
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        max_retries = self.max_retries
+        if isinstance(rate_limit_args, dict):
+            priority = rate_limit_args.get('priority')
+            max_retries = rate_limit_args.get('max_retries', max_retries)
+        else:
+            priority = rate_limit_args if isinstance(rate_limit_args, int) else None
+
+        for attempt in range(max_retries + 1):
+            if chat_id is not None:
+                await self._chat_budget(chat_id).acquire(priority=priority)
+                await self.global_budget.acquire(priority=priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                self.retries += 1
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"Telegram rate limit hit on {endpoint}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            'chats': len(self._chats),
+            'retries': self.retries,
+            'queued_chats': sum(1 for budget in self._chats.values() if budget.queue_depth),
+        }
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Module singletons read these when first imported; keep them off the network and the working tree
+_scratch = tempfile.mkdtemp(prefix='bot-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_scratch, 'bot.db')}")
+os.environ.setdefault('PLAN_RATE_CACHE_PATH', '')
+os.environ.setdefault('SOL_USD_RATE', '100')
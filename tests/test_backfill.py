@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+from backfill import FixtureRpcClient, PaymentBackfill, decode_page
+
+BOT_WALLET = 'BotWallet1111111111111111111111111111111111'
+
+
+def transfer(source, lamports, destination=BOT_WALLET, block_time=1709294400, err=None):
+    return {
+        'blockTime': block_time,
+        'meta': {'err': err, 'innerInstructions': []},
+        'transaction': {'message': {'instructions': [{
+            'program': 'system',
+            'parsed': {'type': 'transfer', 'info': {
+                'source': source, 'destination': destination, 'lamports': lamports,
+            }},
+        }]}},
+    }
+
+
+@pytest.fixture
+def fixture_path(tmp_path):
+    """Seven signatures, newest first: one failed, one unavailable, one to another wallet."""
+    transactions = {
+        'sig7': transfer('alice', 50_000_000),
+        'sig6': transfer('bob', 10_000_000_000),
+        'sig5': transfer('carol', 1_000, destination='SomeoneElse'),
+        'sig3': transfer('alice', 50_000_000),
+        'sig2': transfer('dave', 25_000_000),
+        'sig1': transfer('erin', 50_000_000),
+    }
+    signatures = [
+        {'signature': f"sig{n}", 'err': {'InstructionError': [0, 'Custom']} if n == 4 else None}
+        for n in range(7, 0, -1)
+    ]
+    # sig2 was listed but its transaction is not recorded
+    del transactions['sig2']
+    path = tmp_path / 'history.json'
+    path.write_text(json.dumps({'signatures': signatures, 'transactions': transactions}))
+    return str(path)
+
+
+def test_fixture_pages_backwards_like_the_rpc(fixture_path):
+    rpc = FixtureRpcClient(fixture_path)
+
+    async def pages():
+        first = await rpc.call('getSignaturesForAddress', [BOT_WALLET, {'limit': 3}])
+        second = await rpc.call('getSignaturesForAddress', [BOT_WALLET, {'limit': 3, 'before': 'sig5'}])
+        bounded = await rpc.call('getSignaturesForAddress', [BOT_WALLET, {'until': 'sig4'}])
+        return first, second, bounded
+
+    first, second, bounded = asyncio.run(pages())
+
+    assert [record['signature'] for record in first] == ['sig7', 'sig6', 'sig5']
+    assert [record['signature'] for record in second] == ['sig4', 'sig3', 'sig2']
+    assert [record['signature'] for record in bounded] == ['sig7', 'sig6', 'sig5']
+
+
+def test_fixture_rejects_unrecorded_methods(fixture_path):
+    with pytest.raises(ValueError):
+        asyncio.run(FixtureRpcClient(fixture_path).call('getBalance', [BOT_WALLET]))
+
+
+def test_decode_page_keeps_transfers_to_the_wallet_with_block_times(fixture_path):
+    rpc = FixtureRpcClient(fixture_path)
+    signatures = ['sig7', 'sig5', 'sig2']
+    transactions = asyncio.run(rpc.get_transactions(signatures))
+
+    decoded = decode_page(list(zip(signatures, transactions)), BOT_WALLET)
+
+    assert [(item.signature, item.source_address, item.lamports, block_time) for item, block_time in decoded] == [
+        ('sig7', 'alice', 50_000_000, 1709294400)
+    ]
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_dry_run_walks_the_whole_history(fixture_path, concurrency):
+    backfill = PaymentBackfill(
+        BOT_WALLET, rpc=FixtureRpcClient(fixture_path), page_limit=3, concurrency=concurrency, dry_run=True
+    )
+
+    stats = asyncio.run(backfill.run(report_interval=0))
+
+    assert stats.pages == 3
+    assert stats.signatures == 7
+    # The failed signature is never fetched
+    assert stats.transactions == 6
+    # Transfers to the bot wallet from transactions that are available
+    assert stats.transfers == 4
+    assert stats.credited == 0
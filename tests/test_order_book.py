@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+
+from order_book import MatchingEngine, Order, OrderBook
+
+NOW = datetime(2024, 3, 1, 12, 0)
+
+
+def order(order_id, side, price, amount, user_id=1):
+    return Order(order_id, user_id, 'BONK', side, price, amount, timestamp=NOW)
+
+
+def test_partial_fill_leaves_the_maker_resting():
+    book = OrderBook('BONK')
+    maker = order(1, 'sell', 10.0, 5.0)
+    assert book.submit(maker, NOW) == []
+
+    fills = book.submit(order(2, 'buy', 11.0, 3.0), NOW)
+
+    assert [(fill.maker.order_id, fill.taker.order_id, fill.price, fill.amount) for fill in fills] == [(1, 2, 10.0, 3.0)]
+    assert maker.status == 'partially_filled'
+    assert maker.remaining == 2.0
+    assert book.best_ask() == 10.0
+    assert book.depth() == 1
+
+
+def test_partially_filled_taker_rests_its_remainder():
+    book = OrderBook('BONK')
+    book.submit(order(1, 'sell', 10.0, 2.0), NOW)
+    taker = order(2, 'buy', 10.5, 5.0)
+
+    fills = book.submit(taker, NOW)
+
+    assert [fill.amount for fill in fills] == [2.0]
+    assert taker.status == 'partially_filled'
+    assert taker.remaining == 3.0
+    assert book.best_bid() == 10.5
+    assert book.best_ask() is None
+    assert [resting.order_id for resting in book.open_orders()] == [2]
+
+
+def test_taker_walks_the_book_in_price_time_priority():
+    book = OrderBook('BONK')
+    book.submit(order(1, 'sell', 10.0, 1.0), NOW)
+    book.submit(order(2, 'sell', 9.0, 1.0), NOW)
+    book.submit(order(3, 'sell', 10.0, 1.0), NOW)
+    book.submit(order(4, 'sell', 12.0, 1.0), NOW)
+
+    fills = book.submit(order(5, 'buy', 10.0, 2.5), NOW)
+
+    assert [(fill.maker.order_id, fill.price, fill.amount) for fill in fills] == [
+        (2, 9.0, 1.0), (1, 10.0, 1.0), (3, 10.0, 0.5)
+    ]
+    assert book.orders[3].remaining == 0.5
+    assert 1 not in book.orders and 2 not in book.orders
+    assert book.best_ask() == 10.0
+
+
+def test_completed_orders_leave_the_book():
+    book = OrderBook('BONK')
+    maker = order(1, 'buy', 10.0, 2.0)
+    book.submit(maker, NOW)
+
+    fills = book.submit(order(2, 'sell', 9.5, 2.0), NOW)
+
+    assert fills[0].buy_order is maker
+    assert maker.status == 'completed'
+    assert fills[0].taker.status == 'completed'
+    assert book.depth() == 0
+    assert book.best_bid() is None
+
+
+def test_orders_that_do_not_cross_rest():
+    book = OrderBook('BONK')
+    book.submit(order(1, 'sell', 11.0, 1.0), NOW)
+
+    assert book.submit(order(2, 'buy', 10.0, 1.0), NOW) == []
+    assert (book.best_bid(), book.best_ask()) == (10.0, 11.0)
+
+
+def test_cancelled_orders_are_skipped_by_matching():
+    book = OrderBook('BONK')
+    book.submit(order(1, 'sell', 9.0, 1.0), NOW)
+    book.submit(order(2, 'sell', 10.0, 1.0), NOW)
+
+    assert book.cancel(1).status == 'cancelled'
+    assert book.cancel(1) is None
+    fills = book.submit(order(3, 'buy', 10.0, 1.0), NOW)
+
+    assert [fill.maker.order_id for fill in fills] == [2]
+
+
+def test_replay_fill_applies_a_journaled_partial_fill():
+    book = OrderBook('BONK')
+    book.rest(order(1, 'buy', 10.0, 4.0))
+
+    book.replay_fill(1, 1.5)
+    assert book.orders[1].status == 'partially_filled'
+    book.replay_fill(1, 2.5)
+
+    assert book.depth() == 0
+
+
+def test_engine_keeps_a_book_per_token():
+    engine = MatchingEngine()
+    engine.submit(Order(1, 1, 'BONK', 'sell', 10.0, 1.0, timestamp=NOW))
+
+    assert engine.submit(Order(2, 2, 'JUP', 'buy', 10.0, 1.0, timestamp=NOW)) == []
+    assert len(engine.submit(Order(3, 2, 'BONK', 'buy', 10.0, 1.0, timestamp=NOW))) == 1
+    assert [resting.order_id for resting in engine.open_orders()] == [2]
+
+
+def test_invalid_side_is_rejected():
+    with pytest.raises(ValueError):
+        order(1, 'hold', 10.0, 1.0)
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+
+from order_book import MatchingEngine, Order
+from order_journal import OrderJournal, cancel_event, fill_event, order_event
+
+NOW = datetime(2024, 3, 1, 12, 0)
+
+
+def submit(engine, journal, order):
+    """Journal an order and its fills the way the trade engine does."""
+    journal.append(order_event(order))
+    fills = engine.submit(order, NOW)
+    return [journal.append(fill_event(fill)) for fill in fills]
+
+
+def new_journal(tmp_path):
+    return OrderJournal(str(tmp_path), fsync=False)
+
+
+def test_recover_returns_none_without_a_journal(tmp_path):
+    assert new_journal(tmp_path).recover() is None
+
+
+def test_recover_replays_partial_fills(tmp_path):
+    engine, journal = MatchingEngine(), new_journal(tmp_path)
+    submit(engine, journal, Order(1, 10, 'BONK', 'sell', 10.0, 5.0, timestamp=NOW))
+    submit(engine, journal, Order(2, 20, 'BONK', 'buy', 10.0, 2.0, timestamp=NOW))
+    submit(engine, journal, Order(3, 30, 'BONK', 'buy', 9.0, 1.0, timestamp=NOW))
+    journal.close()
+
+    state = new_journal(tmp_path).recover()
+
+    resting = {order.order_id: order for order in state.engine.open_orders()}
+    assert set(resting) == {1, 3}
+    assert resting[1].remaining == 3.0
+    assert resting[1].status == 'partially_filled'
+    assert state.max_order_id == 3
+    assert state.last_sequence == 4
+    assert [(fill.maker.order_id, fill.taker.order_id, fill.amount) for fill in state.unflushed_fills] == [(1, 2, 2.0)]
+
+
+def test_flushed_fills_and_cancels_are_not_returned_again(tmp_path):
+    engine, journal = MatchingEngine(), new_journal(tmp_path)
+    submit(engine, journal, Order(1, 10, 'BONK', 'sell', 10.0, 5.0, timestamp=NOW))
+    flushed = submit(engine, journal, Order(2, 20, 'BONK', 'buy', 10.0, 1.0, timestamp=NOW))
+    journal.mark_flushed(flushed[-1])
+    submit(engine, journal, Order(3, 30, 'BONK', 'buy', 10.0, 1.5, timestamp=NOW))
+    journal.append(cancel_event(engine.cancel('BONK', 1)))
+    journal.close()
+
+    state = new_journal(tmp_path).recover()
+
+    assert [fill.taker.order_id for fill in state.unflushed_fills] == [3]
+    assert [order.order_id for order in state.unflushed_cancels] == [1]
+    assert state.engine.open_orders() == []
+
+
+def test_recover_resumes_from_a_snapshot(tmp_path):
+    engine, journal = MatchingEngine(), new_journal(tmp_path)
+    submit(engine, journal, Order(1, 10, 'BONK', 'sell', 10.0, 5.0, timestamp=NOW))
+    submit(engine, journal, Order(2, 20, 'BONK', 'buy', 10.0, 1.0, timestamp=NOW))
+    journal.snapshot(engine, max_order_id=2)
+    submit(engine, journal, Order(3, 30, 'BONK', 'buy', 10.0, 1.0, timestamp=NOW))
+    journal.close()
+
+    state = new_journal(tmp_path).recover()
+
+    assert state.replayed == 2
+    assert state.max_order_id == 3
+    assert [(order.order_id, order.remaining) for order in state.engine.open_orders()] == [(1, 3.0)]
+    assert [fill.taker.order_id for fill in state.unflushed_fills] == [3]
+
+
+def test_recover_truncates_a_torn_record(tmp_path):
+    engine, journal = MatchingEngine(), new_journal(tmp_path)
+    submit(engine, journal, Order(1, 10, 'BONK', 'sell', 10.0, 5.0, timestamp=NOW))
+    submit(engine, journal, Order(2, 20, 'BONK', 'sell', 11.0, 5.0, timestamp=NOW))
+    journal.close()
+    segment = journal._segments()[-1]
+    intact = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00partial')
+
+    recovered = new_journal(tmp_path)
+    state = recovered.recover()
+
+    assert [order.order_id for order in state.engine.open_orders()] == [1, 2]
+    assert os.path.getsize(segment) == intact
+
+    recovered.append(order_event(Order(3, 30, 'BONK', 'buy', 9.0, 1.0, timestamp=NOW)))
+    recovered.close()
+    assert new_journal(tmp_path).recover().last_sequence == 3
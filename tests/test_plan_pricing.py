@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from plan_pricing import ANNUAL_PLAN, WEEKLY_PLAN, PlanPricing, StaticRateSource, to_epoch
+
+# Old enough that ensure() never samples the current rate from the token registry
+PAID_AT = datetime(2024, 3, 1, 12, 0)
+
+
+class FailingRateSource:
+    def __init__(self):
+        self.requests = 0
+
+    async def fetch_range(self, start, end):
+        self.requests += 1
+        raise OSError("rate source down")
+
+
+class HourlyRateSource(StaticRateSource):
+    """Hourly samples across the requested range, like the CoinGecko chart API."""
+
+    async def fetch_range(self, start, end):
+        self.requests += 1
+        return [(timestamp, self.rate) for timestamp in range(int(start), int(end) + 3600, 3600)]
+
+
+class GatedRateSource(StaticRateSource):
+    def __init__(self, rate):
+        super().__init__(rate)
+        self.release = asyncio.Event()
+
+    async def fetch_range(self, start, end):
+        await self.release.wait()
+        return await super().fetch_range(start, end)
+
+
+def pricing_at(rate, **options):
+    pricing = PlanPricing(StaticRateSource(rate), cache_path=None, **options)
+    pricing.history.record(to_epoch(PAID_AT), rate)
+    return pricing
+
+
+def test_match_converts_sol_to_usd_at_the_payment_time():
+    pricing = pricing_at(100.0)
+
+    assert pricing.match(0.05, PAID_AT) == WEEKLY_PLAN
+    assert pricing.match(10.0, PAID_AT) == ANNUAL_PLAN
+    assert pricing.match(1.0, PAID_AT) is None
+
+
+def test_match_allows_the_configured_tolerance():
+    pricing = pricing_at(100.0, tolerance=0.05)
+
+    assert pricing.match(0.0524, PAID_AT) == WEEKLY_PLAN
+    assert pricing.match(0.0476, PAID_AT) == WEEKLY_PLAN
+    assert pricing.match(0.0530, PAID_AT) is None
+
+
+def test_match_without_a_rate_returns_none():
+    pricing = pricing_at(100.0, max_gap=3600)
+
+    assert pricing.match(0.05, PAID_AT + timedelta(hours=3)) is None
+    assert pricing.match(0.05, PAID_AT + timedelta(minutes=30)) == WEEKLY_PLAN
+
+
+def test_expected_amount_uses_the_rate_at_a_time():
+    pricing = pricing_at(200.0)
+
+    assert pricing.expected_amount(WEEKLY_PLAN, PAID_AT) == 0.025
+    assert pricing.expected_amount(WEEKLY_PLAN, PAID_AT - timedelta(days=2)) is None
+
+
+def test_ensure_fetches_nearby_times_as_one_range():
+    pricing = PlanPricing(HourlyRateSource(50.0), cache_path=None)
+    times = [PAID_AT + timedelta(hours=hours) for hours in (0, 2, 5, 20)]
+
+    uncovered = asyncio.run(pricing.ensure(times))
+
+    assert uncovered == []
+    assert pricing.source.requests == 1
+    assert pricing.range_fetches == 1
+    assert all(pricing.match(0.1, paid_at) == WEEKLY_PLAN for paid_at in times)
+
+
+def test_ensure_fetches_distant_times_separately():
+    pricing = PlanPricing(StaticRateSource(50.0), cache_path=None)
+
+    asyncio.run(pricing.ensure([PAID_AT, PAID_AT + timedelta(days=10)]))
+
+    assert pricing.source.requests == 2
+
+
+def test_ensure_skips_times_already_covered():
+    pricing = pricing_at(100.0)
+
+    assert asyncio.run(pricing.ensure([PAID_AT, PAID_AT + timedelta(minutes=10)])) == []
+    assert pricing.source.requests == 0
+
+
+def test_ensure_returns_times_it_could_not_price():
+    pricing = PlanPricing(FailingRateSource(), cache_path=None)
+    times = [PAID_AT, PAID_AT + timedelta(days=10)]
+
+    assert asyncio.run(pricing.ensure(times)) == times
+    assert pricing.fetch_errors == 2
+    assert pricing.match(0.05, PAID_AT) is None
+
+
+def test_concurrent_ensures_fetch_a_span_once():
+    async def scenario():
+        pricing = PlanPricing(GatedRateSource(100.0), cache_path=None)
+        callers = [asyncio.ensure_future(pricing.ensure([PAID_AT])) for _ in range(5)]
+        await asyncio.sleep(0)
+        pricing.source.release.set()
+        return pricing, await asyncio.gather(*callers)
+
+    pricing, results = asyncio.run(scenario())
+
+    assert results == [[]] * 5
+    assert pricing.source.requests == 1
+
+
+def test_ensure_saves_fetched_rates(tmp_path):
+    cache_path = str(tmp_path / 'rates.json')
+    pricing = PlanPricing(StaticRateSource(100.0), cache_path=cache_path)
+    asyncio.run(pricing.ensure([PAID_AT]))
+
+    reloaded = PlanPricing(StaticRateSource(100.0), cache_path=cache_path)
+    reloaded.load()
+
+    assert reloaded.match(0.05, PAID_AT) == WEEKLY_PLAN
@@ -0,0 +1,141 @@
+import asyncio
+
+from token_registry import DEFAULT_TOKENS, QuoteCache, StaticPriceSource, TokenIndex, edit_distance
+
+
+def index_of(*symbols):
+    return TokenIndex.from_records([
+        {'address': f"mint-{symbol}", 'symbol': symbol, 'decimals': 6} for symbol in symbols
+    ])
+
+
+def symbols(tokens):
+    return [token.symbol for token in tokens]
+
+
+class GatedPriceSource(StaticPriceSource):
+    """Holds every fetch until `release` is set, so callers can pile up on one request."""
+
+    def __init__(self, prices):
+        super().__init__(prices)
+        self.release = asyncio.Event()
+
+    async def fetch(self, mints):
+        await self.release.wait()
+        return await super().fetch(mints)
+
+
+def test_get_matches_symbol_case_insensitively_and_mint():
+    index = TokenIndex.from_records(DEFAULT_TOKENS)
+
+    assert index.get(' usdc ').symbol == 'USDC'
+    assert index.get('DezXAZ8z7PnrnRJjz3wXBoRgixCa6xjnB7YaB1pPB263').symbol == 'BONK'
+    assert index.get('NOPE') is None
+
+
+def test_first_record_wins_a_shared_symbol():
+    index = TokenIndex.from_records([
+        {'address': 'first', 'symbol': 'DUP', 'decimals': 6},
+        {'address': 'second', 'symbol': 'dup', 'decimals': 9},
+    ])
+
+    assert index.get('DUP').mint == 'first'
+    assert len(index) == 2
+
+
+def test_prefix_is_alphabetical_and_limited():
+    index = index_of('SOL', 'SOLA', 'SOLB', 'SAMO', 'SOLC')
+
+    assert symbols(index.prefix('sol')) == ['SOL', 'SOLA', 'SOLB', 'SOLC']
+    assert symbols(index.prefix('SOL', limit=2)) == ['SOL', 'SOLA']
+    assert index.prefix('X') == []
+    assert index.prefix('  ') == []
+
+
+def test_fuzzy_orders_by_distance_then_symbol():
+    index = index_of('BONK', 'BONE', 'BOOK', 'MONK', 'JUP')
+
+    assert symbols(index.fuzzy('BONKK', max_distance=1)) == ['BONK']
+    assert symbols(index.fuzzy('BONX', max_distance=1)) == ['BONE', 'BONK']
+    assert symbols(index.fuzzy('BONX', max_distance=2)) == ['BONE', 'BONK', 'BOOK', 'MONK']
+    assert index.fuzzy('ZZZZZZ') == []
+
+
+def test_suggest_puts_prefix_matches_before_fuzzy_ones():
+    index = index_of('USDC', 'USDT', 'USDE', 'UST')
+
+    assert symbols(index.suggest('USD', limit=3)) == ['USDC', 'USDE', 'USDT']
+    assert symbols(index.suggest('USD', limit=4)) == ['USDC', 'USDE', 'USDT', 'UST']
+    assert symbols(index.suggest('USTT', limit=2)) == ['USDT', 'UST']
+
+
+def test_edit_distance_stops_past_the_limit():
+    assert edit_distance('KITTEN', 'SITTING', 3) == 3
+    assert edit_distance('KITTEN', 'SITTING', 2) == 3
+    assert edit_distance('A', 'ABCDEF', 2) == 3
+
+
+def test_concurrent_misses_share_one_upstream_request():
+    async def scenario():
+        source = GatedPriceSource({'mint-a': 1.5})
+        cache = QuoteCache(source, ttl=10.0, max_stale=60.0)
+        waiters = [asyncio.ensure_future(cache.get('mint-a')) for _ in range(20)]
+        await asyncio.sleep(0)
+        source.release.set()
+        quotes = await asyncio.gather(*waiters)
+        return cache, source, quotes
+
+    cache, source, quotes = asyncio.run(scenario())
+
+    assert source.requests == 1
+    assert cache.upstream_requests == 1
+    assert cache.misses == 20
+    assert {quote.price for quote in quotes} == {1.5}
+
+
+def test_fresh_quotes_are_served_from_memory():
+    async def scenario():
+        source = StaticPriceSource({'mint-a': 2.0})
+        cache = QuoteCache(source, ttl=10.0)
+        await cache.get('mint-a')
+        quote = await cache.get('mint-a')
+        return cache, source, quote
+
+    cache, source, quote = asyncio.run(scenario())
+
+    assert quote.price == 2.0
+    assert source.requests == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stale_quote_is_served_while_one_refresh_runs():
+    async def scenario():
+        source = GatedPriceSource({'mint-a': 3.0})
+        source.release.set()
+        cache = QuoteCache(source, ttl=0.0, max_stale=60.0)
+        await cache.get('mint-a')
+
+        source.release.clear()
+        source.prices['mint-a'] = 4.0
+        stale = [await cache.get('mint-a') for _ in range(5)]
+        await asyncio.sleep(0)
+        in_flight = len(cache._inflight)
+        source.release.set()
+        await asyncio.sleep(0.01)
+        return cache, source, stale, in_flight
+
+    cache, source, stale, in_flight = asyncio.run(scenario())
+
+    assert {quote.price for quote in stale} == {3.0}
+    assert cache.stale_hits == 5
+    assert in_flight == 1
+    assert source.requests == 2
+    assert cache._quotes['mint-a'].price == 4.0
+
+
+def test_missing_price_returns_none():
+    async def scenario():
+        cache = QuoteCache(StaticPriceSource({}))
+        return await cache.get('unknown')
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook_server import SECRET_TOKEN_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}}}
+
+
+def post_updates(server, *requests):
+    """POST each (headers, body) to a server whose queue has no workers draining it."""
+    async def scenario():
+        server._queue = asyncio.Queue(maxsize=server.queue_size)
+        async with TestClient(TestServer(server.build_app())) as client:
+            responses = []
+            for headers, body in requests:
+                response = await client.post(server.path, headers=headers, data=body)
+                responses.append((response.status, response.headers.get('Retry-After')))
+            return responses
+
+    return asyncio.run(scenario())
+
+
+def signed(secret=SECRET):
+    return {SECRET_TOKEN_HEADER: secret, 'Content-Type': 'application/json'}
+
+
+def body(update_id=1):
+    return json.dumps({**UPDATE, 'update_id': update_id})
+
+
+def test_wrong_or_missing_secret_is_forbidden():
+    server = WebhookServer(application=None, secret_token=SECRET)
+
+    responses = post_updates(
+        server,
+        (signed('wrong'), body()),
+        ({'Content-Type': 'application/json'}, body()),
+    )
+
+    assert [status for status, _ in responses] == [403, 403]
+    assert server.accepted == 0
+    assert server._queue.qsize() == 0
+
+
+def test_full_queue_asks_telegram_to_retry():
+    server = WebhookServer(application=None, secret_token=SECRET, queue_size=2, enqueue_timeout=0.05)
+
+    responses = post_updates(server, *[(signed(), body(update_id)) for update_id in range(3)])
+
+    assert responses == [(200, None), (200, None), (429, '1')]
+    assert (server.accepted, server.rejected) == (2, 1)
+    assert server.stats()['queue_depth'] == 2
+
+
+def test_invalid_json_is_a_bad_request():
+    server = WebhookServer(application=None, secret_token=SECRET)
+
+    assert post_updates(server, (signed(), 'not json')) == [(400, None)]
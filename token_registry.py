@@ -0,0 +1,424 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+from request_scheduler import set_background_priority
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+
+# Used when TOKEN_LIST_PATH is not set, in priority order
+DEFAULT_TOKENS = [
+    {'address': SOL_MINT, 'symbol': 'SOL', 'decimals': 9, 'name': 'Wrapped SOL'},
+    {'address': 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v', 'symbol': 'USDC', 'decimals': 6, 'name': 'USD Coin'},
+    {'address': 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB', 'symbol': 'USDT', 'decimals': 6, 'name': 'USDT'},
+    {'address': 'JUPyiwrYJFskUPiHa7hkeR8VUtAeFoSYbKedZNsDvCN', 'symbol': 'JUP', 'decimals': 6, 'name': 'Jupiter'},
+    {'address': 'DezXAZ8z7PnrnRJjz3wXBoRgixCa6xjnB7YaB1pPB263', 'symbol': 'BONK', 'decimals': 5, 'name': 'Bonk'},
+]
+
+DEFAULT_PRICE_URL = 'https://api.jup.ag/price/v2'
+
+# Mints per upstream price request
+MAX_IDS_PER_REQUEST = 100
+
+
+@dataclass(frozen=True)
+class Token:
+    """A token mint with its display symbol and decimals."""
+
+    mint: str
+    symbol: str
+    decimals: int
+    name: str = ''
+
+
+SOL = Token(SOL_MINT, 'SOL', 9, 'Wrapped SOL')
+
+
+@dataclass(frozen=True)
+class Quote:
+    """A token's USD price as of `fetched_at` (monotonic seconds)."""
+
+    mint: str
+    price: float
+    fetched_at: float
+
+    def age(self, now=None):
+        return (now or time.monotonic()) - self.fetched_at
+
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance between two strings, or limit + 1 once it is exceeded.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TokenIndex:
+    """
+    Immutable symbol and mint index over a token list.
+
+    Symbols are kept in one sorted tuple so prefix lookups are a bisect
+    and a slice; fuzzy lookups only compare symbols whose length is within
+    the allowed distance. When several mints share a symbol, the first one
+    in the list wins, so lists should be ordered by priority.
+    """
+
+    def __init__(self, tokens=()):
+        self._by_mint = {}
+        self._by_symbol = {}
+        for token in tokens:
+            self._by_mint.setdefault(token.mint, token)
+            self._by_symbol.setdefault(token.symbol, token)
+        self._symbols = tuple(sorted(self._by_symbol))
+        self._by_length = {}
+        for symbol in self._symbols:
+            self._by_length.setdefault(len(symbol), []).append(symbol)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build an index from token list records.
+
+        Args:
+            records: Dicts with address (or mint), symbol, decimals and optional name
+
+        Returns:
+            TokenIndex: Index over every record with a symbol
+        """
+        tokens = []
+        for record in records:
+            symbol = (record.get('symbol') or '').strip().upper()
+            mint = record.get('address') or record.get('mint')
+            if not symbol or not mint:
+                continue
+            tokens.append(Token(mint, symbol, int(record.get('decimals', 0)), record.get('name') or ''))
+        return cls(tokens)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a JSON token list, either a bare list or {"tokens": [...]}."""
+        with open(path) as token_list:
+            data = json.load(token_list)
+        return cls.from_records(data['tokens'] if isinstance(data, dict) else data)
+
+    def get(self, text):
+        """Return the token with this symbol or mint address, if any."""
+        return self._by_symbol.get(text.strip().upper()) or self._by_mint.get(text.strip())
+
+    def prefix(self, text, limit=5):
+        """Return up to `limit` tokens whose symbol starts with `text`, alphabetically."""
+        prefix = text.strip().upper()
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._symbols, prefix)
+        matches = []
+        for symbol in self._symbols[start:]:
+            if not symbol.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(self._by_symbol[symbol])
+        return matches
+
+    def fuzzy(self, text, limit=5, max_distance=2):
+        """Return up to `limit` tokens with the closest symbols within `max_distance` edits."""
+        query = text.strip().upper()
+        scored = []
+        for length in range(max(1, len(query) - max_distance), len(query) + max_distance + 1):
+            for symbol in self._by_length.get(length, ()):
+                distance = edit_distance(query, symbol, max_distance)
+                if distance <= max_distance:
+                    scored.append((distance, symbol))
+        scored.sort()
+        return [self._by_symbol[symbol] for _, symbol in scored[:limit]]
+
+    def suggest(self, text, limit=3):
+        """Return likely intended tokens for an unknown symbol: prefix matches, then fuzzy ones."""
+        suggestions = self.prefix(text, limit)
+        for token in self.fuzzy(text, limit):
+            if len(suggestions) >= limit:
+                break
+            if token not in suggestions:
+                suggestions.append(token)
+        return suggestions
+
+    def __len__(self):
+        return len(self._by_mint)
+
+
+class JupiterPriceSource:
+    """USD prices from the Jupiter price API."""
+
+    def __init__(self, url=DEFAULT_PRICE_URL, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+        self._session = None
+
+    async def fetch(self, mints):
+        """
+        Returns:
+            dict: mint -> USD price for every mint the upstream priced
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.get(self.url, params={'ids': ','.join(mints)}) as response:
+            response.raise_for_status()
+            data = (await response.json()).get('data') or {}
+        return {
+            mint: float(entry['price'])
+            for mint, entry in data.items()
+            if entry and entry.get('price') is not None
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class StaticPriceSource:
+    """Fixed prices, for local runs and tests without network access."""
+
+    def __init__(self, prices):
+        self.prices = dict(prices)
+        self.requests = 0
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a JSON object of mint -> USD price."""
+        with open(path) as prices:
+            return cls(json.load(prices))
+
+    async def fetch(self, mints):
+        self.requests += 1
+        return {mint: self.prices[mint] for mint in mints if mint in self.prices}
+
+    async def close(self):
+        pass
+
+
+class QuoteCache:
+    """
+    TTL cache of USD quotes in front of a pluggable price source.
+
+    A quote younger than `ttl` is served from memory. Up to `max_stale` it
+    is still served while a refresh runs in the background; past that the
+    caller waits for the upstream. Concurrent requests for a mint share one
+    in-flight fetch, so a burst of commands for one token costs a single
+    upstream request. Mints requested within `hot_ttl` seconds are kept
+    fresh by run() in batched requests.
+    """
+
+    def __init__(self, source, ttl=10.0, max_stale=60.0, refresh_interval=5.0, hot_ttl=300.0):
+        self.source = source
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.refresh_interval = refresh_interval
+        self.hot_ttl = hot_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self._quotes = {}
+        self._inflight = {}
+        self._requested = {}
+
+    async def get(self, mint):
+        """
+        Return the latest quote for a mint.
+
+        Returns:
+            Quote: The cached or fetched quote, or None if the upstream has no price
+        """
+        now = time.monotonic()
+        self._requested[mint] = now
+        quote = self._quotes.get(mint)
+        if quote is not None and quote.age(now) < self.ttl:
+            self.hits += 1
+            return quote
+        if quote is not None and quote.age(now) < self.max_stale:
+            self.stale_hits += 1
+            asyncio.ensure_future(self._refresh_quietly([mint]))
+            return quote
+        self.misses += 1
+        return (await self.refresh([mint])).get(mint)
+
+    async def get_many(self, mints):
+        """Return quotes for several mints; see get()."""
+        return dict(zip(mints, await asyncio.gather(*(self.get(mint) for mint in mints))))
+
+    async def refresh(self, mints):
+        """
+        Fetch quotes for mints, joining any fetch already in flight for them.
+
+        Returns:
+            dict: mint -> Quote or None
+        """
+        missing = [mint for mint in dict.fromkeys(mints) if mint not in self._inflight]
+        for start in range(0, len(missing), MAX_IDS_PER_REQUEST):
+            chunk = missing[start:start + MAX_IDS_PER_REQUEST]
+            task = asyncio.ensure_future(self._fetch(chunk))
+            for mint in chunk:
+                self._inflight[mint] = task
+            task.add_done_callback(lambda done, chunk=chunk: self._finish(chunk, done))
+        tasks = {self._inflight[mint] for mint in mints if mint in self._inflight}
+        await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+        return {mint: self._quotes.get(mint) for mint in mints}
+
+    def _finish(self, mints, task):
+        for mint in mints:
+            if self._inflight.get(mint) is task:
+                del self._inflight[mint]
+
+    async def _fetch(self, mints):
+        self.upstream_requests += 1
+        try:
+            prices = await self.source.fetch(mints)
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        fetched_at = time.monotonic()
+        for mint, price in prices.items():
+            self._quotes[mint] = Quote(mint, price, fetched_at)
+
+    async def _refresh_quietly(self, mints):
+        try:
+            await self.refresh(mints)
+        except Exception as e:
+            logger.warning(f"Quote refresh failed: {str(e)}")
+
+    async def run(self):
+        """Keep recently requested quotes fresh until cancelled."""
+        set_background_priority()
+        while True:
+            now = time.monotonic()
+            for mint in [mint for mint, at in self._requested.items() if now - at > self.hot_ttl]:
+                del self._requested[mint]
+                self._quotes.pop(mint, None)
+            due = [
+                mint for mint in self._requested
+                if mint not in self._quotes or self._quotes[mint].age(now) >= self.refresh_interval
+            ]
+            if due:
+                await self._refresh_quietly(due)
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            'upstream_requests': self.upstream_requests,
+            'upstream_errors': self.upstream_errors,
+            'cached': len(self._quotes),
+            'hot': len(self._requested),
+        }
+
+
+class TokenRegistry:
+    """
+    Resolves user-typed token symbols and prices them.
+
+    The token list is loaded into a TokenIndex once at startup; quotes go
+    through a QuoteCache so commands never wait on more than one shared
+    upstream request per token.
+    """
+
+    def __init__(self, source, token_list_path=None, quote_timeout=2.0, **cache_options):
+        self.token_list_path = token_list_path
+        self.quote_timeout = quote_timeout
+        self.index = TokenIndex.from_records(DEFAULT_TOKENS)
+        self.quotes = QuoteCache(source, **cache_options)
+
+    @classmethod
+    def from_env(cls):
+        """Build a registry from environment variables."""
+        prices_path = os.getenv('TOKEN_PRICES_PATH')
+        if prices_path:
+            source = StaticPriceSource.from_file(prices_path)
+        else:
+            source = JupiterPriceSource(os.getenv('TOKEN_PRICE_URL', DEFAULT_PRICE_URL))
+        return cls(
+            source,
+            token_list_path=os.getenv('TOKEN_LIST_PATH'),
+            quote_timeout=float(os.getenv('TOKEN_QUOTE_TIMEOUT', '2')),
+            ttl=float(os.getenv('TOKEN_QUOTE_TTL', '10')),
+            max_stale=float(os.getenv('TOKEN_QUOTE_MAX_STALE', '60')),
+            refresh_interval=float(os.getenv('TOKEN_QUOTE_REFRESH_INTERVAL', '5')),
+        )
+
+    def load(self):
+        """Load the configured token list, keeping the built-in list if there is none."""
+        if self.token_list_path:
+            self.index = TokenIndex.from_file(self.token_list_path)
+        logger.info(f"Token registry loaded with {len(self.index)} tokens")
+
+    def resolve(self, text):
+        """Return the token for a symbol or mint address, or None if it is unknown."""
+        return self.index.get(text)
+
+    def suggest(self, text, limit=3):
+        return self.index.suggest(text, limit)
+
+    async def quote(self, token):
+        """
+        Return a token's USD quote without waiting longer than `quote_timeout`.
+
+        A fetch that times out keeps running and fills the cache for the
+        next caller.
+
+        Returns:
+            Quote: The quote, or None if no price is available in time
+        """
+        try:
+            return await asyncio.wait_for(self.quotes.get(token.mint), self.quote_timeout)
+        except Exception as e:
+            logger.warning(f"No quote for {token.symbol}: {str(e) or type(e).__name__}")
+            return None
+
+    async def price_in_sol(self, token):
+        """
+        Return how many SOL one unit of a token is worth.
+
+        Returns:
+            float: Price in SOL, or None if either quote is unavailable
+        """
+        if token.mint == SOL_MINT:
+            return 1.0
+        token_quote, sol_quote = await asyncio.gather(self.quote(token), self.quote(SOL))
+        if not token_quote or not sol_quote or not sol_quote.price:
+            return None
+        return token_quote.price / sol_quote.price
+
+    async def run(self):
+        await self.quotes.run()
+
+    async def close(self):
+        await self.quotes.source.close()
+
+    def stats(self):
+        return {'tokens': len(self.index), **self.quotes.stats()}
+
+
+token_registry = TokenRegistry.from_env()
+stats_registry.register('tokens', token_registry.stats)
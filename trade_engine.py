@@ -0,0 +1,429 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import TradeFill, TradeOrder, User
+from order_book import MatchingEngine, Order
+from order_journal import OrderJournal, cancel_event, fill_event, order_event
+from storage import AdvisoryLease, db_writer, read_session
+from user_cache import invalidate_user
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_try_advisory_lock; its holder is the one matching worker
+MATCHING_LOCK_KEY = 7274115
+
+# Statuses of orders that can still be cancelled
+ACTIVE_STATUSES = ('routed', 'open', 'partially_filled')
+
+
+def insert_order(session, telegram_id, wallet_address, token, side, amount, price, status='open'):
+    """Insert an order and return its id. Runs inside a writer transaction."""
+    trade_order = TradeOrder(
+        user_id=telegram_id,
+        wallet_address=wallet_address,
+        token=token,
+        amount=amount,
+        price=price,
+        trade_type=side,
+        status=status,
+        filled_amount=0.0
+    )
+    session.add(trade_order)
+    session.flush()
+    return trade_order.id, trade_order.timestamp
+
+
+def claim_routed_orders(session, limit):
+    """
+    Mark the oldest routed orders open and return them. Runs inside a writer transaction.
+
+    Returns:
+        list: Order objects in id order
+    """
+    rows = session.query(TradeOrder).filter(
+        TradeOrder.status == 'routed'
+    ).order_by(TradeOrder.id).limit(limit).with_for_update(skip_locked=True).all()
+    orders = []
+    for row in rows:
+        row.status = 'open'
+        orders.append(Order(row.id, row.user_id, row.token, row.trade_type, row.price, row.amount,
+                            timestamp=row.timestamp))
+    return orders
+
+
+def cancel_routed_order(session, order_id):
+    """Cancel an order no worker has claimed yet. Returns whether it was still routed."""
+    return session.query(TradeOrder).filter(
+        TradeOrder.id == order_id,
+        TradeOrder.status == 'routed'
+    ).update({TradeOrder.status: 'cancelled'}, synchronize_session=False) == 1
+
+
+def request_cancel(session, order_id):
+    """Flag a resting order for the book owner to cancel. Returns whether it was still resting."""
+    return session.query(TradeOrder).filter(
+        TradeOrder.id == order_id,
+        TradeOrder.status.in_(('open', 'partially_filled'))
+    ).update({TradeOrder.cancel_requested: True}, synchronize_session=False) == 1
+
+
+def claim_cancel_requests(session, limit):
+    """
+    Clear the oldest cancel flags and return their orders. Runs inside a writer transaction.
+
+    Returns:
+        list: (order id, token) tuples
+    """
+    rows = session.query(TradeOrder).filter(
+        TradeOrder.cancel_requested.is_(True)
+    ).order_by(TradeOrder.id).limit(limit).with_for_update(skip_locked=True).all()
+    for row in rows:
+        row.cancel_requested = False
+    return [(row.id, row.token) for row in rows]
+
+
+def persist_matches(session, order_states, fills, now):
+    """
+    Write order-state changes and fills in one transaction.
+
+    Args:
+        order_states (list): Dicts with id, status and filled_amount
+        fills (list): Fill objects from the matching engine
+        now (datetime): Trade time recorded on the users
+
+    Returns:
+        list: Telegram ids whose trading stats changed
+    """
+    if order_states:
+        session.bulk_update_mappings(TradeOrder, order_states)
+    if fills:
+        session.bulk_insert_mappings(TradeFill, [{
+            'token': fill.token,
+            'buy_order_id': fill.buy_order.order_id,
+            'sell_order_id': fill.sell_order.order_id,
+            'buyer_id': fill.buy_order.user_id,
+            'seller_id': fill.sell_order.user_id,
+            'price': fill.price,
+            'amount': fill.amount,
+            'timestamp': fill.timestamp,
+        } for fill in fills])
+
+    trades = Counter()
+    for fill in fills:
+        trades[fill.buy_order.user_id] += 1
+        trades[fill.sell_order.user_id] += 1
+    for telegram_id, count in trades.items():
+        session.query(User).filter(User.telegram_id == telegram_id).update({
+            User.total_trades: User.total_trades + count,
+            User.last_trade_date: now,
+            User.is_trading_enabled: True,
+        }, synchronize_session=False)
+    return list(trades)
+
+
+class TradeEngine:
+    """
+    Matching engine for P2P trade orders backed by `trade_orders`.
+
+    Orders are inserted before they enter the book so fills can reference
+    their ids. Matching happens in memory on the event loop; the resulting
+    order-state changes and fills are buffered and written by a background
+    flush in one transaction per interval instead of one per order.
+
+    With a journal, every book event is appended before the database sees
+    it, and startup rebuilds the books from the latest snapshot plus the
+    journal tail instead of scanning `trade_orders`.
+
+    Only the worker holding the matching lease keeps books. Other workers
+    insert orders as 'routed' and the owner claims and matches them every
+    `route_interval`, so several workers on one PostgreSQL database share a
+    single book instead of each matching its own subset. A cancel on a
+    follower flags the row and the owner cancels it on the same interval.
+    Followers retry the lease on the same interval; a worker that takes it
+    over rebuilds the books from `trade_orders`, since its journal may
+    predate the previous owner's fills.
+    """
+
+    def __init__(self, writer=db_writer, flush_interval=0.05, max_pending=1000, journal=None,
+                 lease=None, route_interval=1.0, route_batch=500):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.journal = journal
+        self.lease = lease or AdvisoryLease(MATCHING_LOCK_KEY, 'Matching')
+        self.route_interval = route_interval
+        self.route_batch = route_batch
+        self.matching = MatchingEngine()
+        self.max_order_id = 0
+        self.flushes = 0
+        self.routed_orders = 0
+        self._dirty = {}
+        self._fills = []
+        self._flush_now = None
+
+    @classmethod
+    def from_env(cls):
+        """Build an engine from environment variables."""
+        return cls(
+            flush_interval=float(os.getenv('TRADE_FLUSH_INTERVAL', '0.05')),
+            max_pending=int(os.getenv('TRADE_FLUSH_MAX_PENDING', '1000')),
+            journal=OrderJournal.from_env() if os.getenv('TRADE_JOURNAL_ENABLED', 'true').lower() == 'true' else None,
+            route_interval=float(os.getenv('TRADE_ROUTE_INTERVAL', '1.0')),
+        )
+
+    @property
+    def is_owner(self):
+        return self.lease.held
+
+    def load(self):
+        """Take the matching lease if free and rebuild the books when this worker owns them."""
+        if not self.lease.acquire():
+            logger.info("Order books are owned by another worker; new orders will be routed to it")
+            return
+        self._load_books()
+
+    def _load_books(self):
+        """Rebuild the books from the journal, or from the table on first start."""
+        state = self.journal.recover() if self.journal and not self.lease.shared else None
+        if state is None:
+            self._load_from_table()
+            if self.journal:
+                self.journal.snapshot(self.matching, self.max_order_id)
+            return
+
+        self.matching = state.engine
+        self.max_order_id = state.max_order_id
+        for fill in state.unflushed_fills:
+            self._mark(fill.maker)
+            self._mark(fill.taker)
+        self._fills.extend(state.unflushed_fills)
+        for order in state.unflushed_cancels:
+            self._mark(order)
+        self._match_unjournaled_orders()
+
+    def _load_from_table(self):
+        with read_session() as session:
+            rows = session.query(TradeOrder).filter(
+                TradeOrder.status.in_(('open', 'partially_filled'))
+            ).order_by(TradeOrder.timestamp, TradeOrder.id).all()
+            self.max_order_id = session.query(func.max(TradeOrder.id)).scalar() or 0
+
+        self.matching = MatchingEngine()
+        for row in rows:
+            self.matching.rest(Order(
+                row.id, row.user_id, row.token, row.trade_type, row.price, row.amount,
+                timestamp=row.timestamp,
+                remaining=row.amount - (row.filled_amount or 0.0),
+                status=row.status
+            ))
+        logger.info(f"Order books loaded with {len(rows)} resting orders")
+
+    def _match_unjournaled_orders(self):
+        """
+        Match orders committed to the table after the last journaled order.
+
+        The insert commits before the order is journaled, so a crash in
+        between leaves rows the journal never saw. None of them have fills
+        yet, since fills reach the table only after the journal is synced.
+        """
+        with read_session() as session:
+            rows = session.query(TradeOrder).filter(
+                TradeOrder.id > self.max_order_id,
+                TradeOrder.status == 'open'
+            ).order_by(TradeOrder.id).all()
+        for row in rows:
+            self._submit(Order(row.id, row.user_id, row.token, row.trade_type, row.price, row.amount,
+                               timestamp=row.timestamp))
+        if rows:
+            logger.info(f"Matched {len(rows)} orders missing from the journal")
+
+    async def place(self, telegram_id, wallet_address, token, side, amount, price):
+        """
+        Persist a new order and match it against the book.
+
+        On a worker that does not own the books the order is stored as
+        'routed' and returned without fills; the owner matches it later.
+
+        Returns:
+            tuple: (Order, list of Fill objects)
+        """
+        status = 'open' if self.is_owner else 'routed'
+        order_id, timestamp = await self.writer.write(
+            lambda session: insert_order(session, telegram_id, wallet_address, token, side, amount, price, status)
+        )
+        order = Order(order_id, telegram_id, token, side, price, amount, timestamp=timestamp, status=status)
+        if status == 'routed':
+            return order, []
+        return order, self._submit(order)
+
+    async def match_routed(self):
+        """Claim orders routed by other workers and match them in id order."""
+        while True:
+            orders = await self.writer.write(lambda session: claim_routed_orders(session, self.route_batch))
+            for order in orders:
+                self._submit(order)
+            self.routed_orders += len(orders)
+            if len(orders) < self.route_batch:
+                return
+
+    def _submit(self, order):
+        fills = self.matching.submit(order)
+        self.max_order_id = max(self.max_order_id, order.order_id)
+        if self.journal:
+            self.journal.append(order_event(order))
+            for fill in fills:
+                self.journal.append(fill_event(fill))
+        for fill in fills:
+            self._mark(fill.maker)
+        if fills:
+            self._mark(order)
+            self._fills.extend(fills)
+            self._request_flush()
+        return fills
+
+    async def cancel_order(self, telegram_id, order_id):
+        """
+        Cancel one of a user's orders.
+
+        Returns:
+            str: 'cancelled', 'requested' if the worker owning the books will
+                cancel it on its next route, or None if the user has no such
+                active order
+        """
+        with read_session() as session:
+            row = session.query(TradeOrder.token, TradeOrder.status).filter(
+                TradeOrder.id == order_id,
+                TradeOrder.user_id == telegram_id
+            ).first()
+        if row is None or row.status not in ACTIVE_STATUSES:
+            return None
+        if row.status == 'routed' and await self.writer.write(lambda session: cancel_routed_order(session, order_id)):
+            return 'cancelled'
+        if self.is_owner:
+            return 'cancelled' if self.cancel(row.token, order_id) else None
+        if await self.writer.write(lambda session: request_cancel(session, order_id)):
+            return 'requested'
+        return None
+
+    async def cancel_requested(self):
+        """Cancel the orders other workers flagged."""
+        while True:
+            requests = await self.writer.write(lambda session: claim_cancel_requests(session, self.route_batch))
+            for order_id, token in requests:
+                self.cancel(token, order_id)
+            if len(requests) < self.route_batch:
+                return
+
+    def cancel(self, token, order_id):
+        """Cancel a resting order. Returns the order, or None if unknown or owned by another worker."""
+        order = self.matching.cancel(token, order_id)
+        if order is not None:
+            if self.journal:
+                self.journal.append(cancel_event(order))
+            self._mark(order)
+            self._request_flush()
+        return order
+
+    def _mark(self, order):
+        self._dirty[order.order_id] = order
+
+    def _request_flush(self):
+        if self._flush_now is not None and len(self._dirty) + len(self._fills) >= self.max_pending:
+            self._flush_now.set()
+
+    async def flush(self):
+        """Write buffered order states and fills in one transaction."""
+        if self.journal:
+            # The journal must never be behind the table
+            self.journal.sync()
+        if not self._dirty and not self._fills:
+            self._checkpoint()
+            return
+        dirty, fills = self._dirty, self._fills
+        self._dirty, self._fills = {}, []
+        journaled = self.journal.last_sequence if self.journal else None
+        # Capture state now; the orders keep changing while the write is queued
+        order_states = [
+            {'id': order.order_id, 'status': order.status, 'filled_amount': order.filled}
+            for order in dirty.values()
+        ]
+        try:
+            traders = await self.writer.write(
+                lambda session: persist_matches(session, order_states, fills, datetime.utcnow())
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist {len(fills)} fills: {str(e)}")
+            # Newer changes to the same orders win; keep fills in execution order
+            self._dirty = {**dirty, **self._dirty}
+            self._fills = fills + self._fills
+            return
+        self.flushes += 1
+        invalidate_user(*traders)
+        if self.journal:
+            self.journal.mark_flushed(journaled)
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Snapshot the books once enough events accumulated and nothing is pending."""
+        if self.journal and self.journal.snapshot_due() and not self._dirty and not self._fills:
+            self.journal.snapshot(self.matching, self.max_order_id)
+
+    async def run(self):
+        """Flush matches every interval, or sooner when the buffer fills up."""
+        self._flush_now = asyncio.Event()
+        next_route = time.monotonic()
+        try:
+            while True:
+                if not self.is_owner:
+                    await asyncio.sleep(self.route_interval)
+                    if self.lease.acquire():
+                        logger.info("Took over the order books")
+                        self._load_books()
+                    continue
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_now.clear()
+                if self.lease.shared and time.monotonic() >= next_route:
+                    next_route = time.monotonic() + self.route_interval
+                    await self._route()
+                await self.flush()
+        finally:
+            if self.is_owner:
+                await self.flush()
+            if self.journal:
+                self.journal.close()
+            self.lease.release()
+
+    async def _route(self):
+        if not self.lease.check():
+            # Another worker may take the books over now; stop matching here
+            logger.error("Matching lease lost; dropping the local order books")
+            await self.flush()
+            self.matching = MatchingEngine()
+            return
+        try:
+            await self.match_routed()
+            await self.cancel_requested()
+        except Exception as e:
+            logger.error(f"Failed to claim routed orders: {str(e)}")
+
+    def stats(self):
+        return {
+            'owner': self.is_owner,
+            'resting_orders': sum(book.depth() for book in self.matching.books.values()),
+            'routed_orders': self.routed_orders,
+            'flushes': self.flushes,
+        }
+
+
+trade_engine = TradeEngine.from_env()
+stats_registry.register('trades', trade_engine.stats)
@@ -0,0 +1,364 @@
+import asyncio
+import base64
+import inspect
+import logging
+import os
+import time
+from datetime import datetime
+
+from solders.signature import Signature
+
+from models import OutboxTransaction, UnsignedTransaction
+from rpc_gateway import get_rpc_gateway
+from storage import AdvisoryLease, db_writer, read_session
+from request_scheduler import set_background_priority
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+COMMITMENT_LEVELS = {'processed': 0, 'confirmed': 1, 'finalized': 2}
+
+# Arbitrary key for pg_try_advisory_lock; its holder is the one polling worker
+OUTBOX_LOCK_KEY = 7274118
+
+# Placeholder an unsigned transaction carries in its signature slots
+UNSIGNED_SIGNATURE = str(Signature.default())
+
+
+def signature_of(raw_transaction):
+    """
+    Return the fee payer signature of a serialized transaction.
+
+    The wire format starts with a compact-u16 signature count followed by
+    64-byte signatures; the first one identifies the transaction.
+    """
+    return str(Signature.from_bytes(bytes(raw_transaction[1:65])))
+
+
+class PendingTransaction:
+    """In-memory copy of a `tx_outbox` row."""
+
+    __slots__ = ('signature', 'telegram_id', 'chat_id', 'kind', 'token', 'amount',
+                 'raw_transaction', 'last_valid_block_height', 'status', 'attempts',
+                 'error', 'last_sent', 'slot')
+
+    def __init__(self, signature, telegram_id, chat_id, kind, token, amount, raw_transaction,
+                 last_valid_block_height, status='pending', attempts=0, error=None):
+        self.signature = signature
+        self.telegram_id = telegram_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.token = token
+        self.amount = amount
+        self.raw_transaction = raw_transaction
+        self.last_valid_block_height = last_valid_block_height
+        self.status = status
+        self.attempts = attempts
+        self.error = error
+        self.last_sent = 0.0
+        self.slot = None
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.signature, row.telegram_id, row.chat_id, row.kind, row.token, row.amount,
+                   row.raw_transaction, row.last_valid_block_height, row.status, row.attempts, row.error)
+
+
+def insert_outbox_row(session, pending):
+    session.add(OutboxTransaction(
+        signature=pending.signature,
+        telegram_id=pending.telegram_id,
+        chat_id=pending.chat_id,
+        kind=pending.kind,
+        token=pending.token,
+        amount=pending.amount,
+        raw_transaction=pending.raw_transaction,
+        last_valid_block_height=pending.last_valid_block_height,
+        status='pending'
+    ))
+
+
+def update_outbox_rows(session, states):
+    """
+    Settle many pending outbox rows. Runs inside a writer transaction.
+
+    Returns:
+        set: Signatures of the rows this call settled; rows another worker
+            already settled are left alone
+    """
+    now = datetime.utcnow()
+    updated = set()
+    for signature, status, attempts, error in states:
+        if session.query(OutboxTransaction).filter(
+            OutboxTransaction.signature == signature,
+            OutboxTransaction.status == 'pending'
+        ).update({
+            OutboxTransaction.status: status,
+            OutboxTransaction.attempts: attempts,
+            OutboxTransaction.error: error,
+            OutboxTransaction.updated_at: now,
+        }, synchronize_session=False):
+            updated.add(signature)
+    return updated
+
+
+def save_unsigned(session, telegram_id, chat_id, kind, token, amount, message, last_valid_block_height):
+    """
+    Store a user's transaction awaiting signature, replacing any earlier one. Runs inside a writer transaction.
+
+    Args:
+        message (bytes): Serialized message the user's wallet must sign
+    """
+    session.merge(UnsignedTransaction(
+        telegram_id=telegram_id,
+        chat_id=chat_id,
+        kind=kind,
+        token=token,
+        amount=amount,
+        message=base64.b64encode(message).decode('ascii'),
+        last_valid_block_height=last_valid_block_height,
+        created_at=datetime.utcnow(),
+    ))
+
+
+def load_unsigned(telegram_id):
+    """Return a user's transaction awaiting signature, or None."""
+    with read_session() as session:
+        return session.get(UnsignedTransaction, telegram_id)
+
+
+def delete_unsigned(session, telegram_id, message):
+    """Drop a user's transaction awaiting signature unless a newer one replaced it. Runs inside a writer transaction."""
+    session.query(UnsignedTransaction).filter(
+        UnsignedTransaction.telegram_id == telegram_id,
+        UnsignedTransaction.message == message
+    ).delete(synchronize_session=False)
+
+
+class TransactionOutbox:
+    """
+    Durable submission pipeline for signed transactions.
+
+    A transaction is written to `tx_outbox` before it is broadcast, so a
+    restart never loses track of it. One background loop polls every
+    pending signature with batched getSignatureStatuses calls, rebroadcasts
+    the same bytes while the blockhash is still valid (resending an
+    identical transaction is idempotent), and settles it as confirmed,
+    failed or expired. Settlement callbacks notify users asynchronously.
+
+    Only the worker holding the outbox lease polls, so several workers on
+    one PostgreSQL database don't each settle and announce every
+    transaction. Other workers persist and broadcast their submissions and
+    the holder picks the rows up on its next poll. Settling a row is a
+    conditional update from 'pending', so a transaction is announced once
+    even while the lease changes hands.
+    """
+
+    def __init__(self, rpc=None, writer=db_writer, commitment='confirmed',
+                 poll_interval=2.0, rebroadcast_interval=4.0, lease=None):
+        if commitment not in COMMITMENT_LEVELS:
+            raise ValueError(f"Invalid commitment level: {commitment}")
+        self.rpc = rpc
+        self.writer = writer
+        self.commitment = commitment
+        self.poll_interval = poll_interval
+        self.rebroadcast_interval = rebroadcast_interval
+        self.lease = lease or AdvisoryLease(OUTBOX_LOCK_KEY, 'Outbox')
+        self.settled = {'confirmed': 0, 'failed': 0, 'expired': 0}
+        self._pending = {}
+        self._callbacks = []
+        self._wakeup = None
+
+    @classmethod
+    def from_env(cls):
+        """Build an outbox from environment variables."""
+        return cls(
+            commitment=os.getenv('TX_CONFIRMATION_COMMITMENT', 'confirmed'),
+            poll_interval=float(os.getenv('TX_POLL_INTERVAL', '2')),
+            rebroadcast_interval=float(os.getenv('TX_REBROADCAST_INTERVAL', '4')),
+        )
+
+    @property
+    def client(self):
+        return self.rpc or get_rpc_gateway()
+
+    def on_settled(self, callback):
+        """
+        Register a callback for settled transactions.
+
+        Args:
+            callback: Called as callback(pending) once the status is final;
+                may be async
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def load(self):
+        """Take the outbox lease if free and resume tracking transactions that were pending at shutdown."""
+        if not self.lease.acquire():
+            logger.info("Transaction outbox is polled by another worker")
+            return
+        self._pending = {}
+        resumed = self._track_pending_rows()
+        logger.info(f"Transaction outbox resumed {resumed} pending transactions")
+
+    def _track_pending_rows(self):
+        """Start tracking pending rows this worker does not know yet. Returns how many were added."""
+        with read_session() as session:
+            rows = session.query(OutboxTransaction).filter(OutboxTransaction.status == 'pending').all()
+        added = 0
+        for row in rows:
+            if row.signature not in self._pending:
+                self._pending[row.signature] = PendingTransaction.from_row(row)
+                added += 1
+        return added
+
+    async def submit(self, telegram_id, chat_id, kind, transaction, last_valid_block_height,
+                     token=None, amount=None):
+        """
+        Persist a transaction, broadcast it and track it until it settles.
+
+        Args:
+            transaction: Signed transaction, serialized or as an object
+
+        Returns:
+            str: Transaction signature
+
+        Raises:
+            ValueError: If the transaction carries no fee payer signature
+        """
+        raw = transaction if isinstance(transaction, (bytes, bytearray)) else transaction.serialize()
+        signature = signature_of(raw)
+        if signature == UNSIGNED_SIGNATURE:
+            raise ValueError("Transaction is not signed")
+        pending = PendingTransaction(
+            signature, telegram_id, chat_id, kind, token, amount,
+            base64.b64encode(bytes(raw)).decode('ascii'), last_valid_block_height
+        )
+        await self.writer.write(lambda session: insert_outbox_row(session, pending))
+        if self.lease.held:
+            self._pending[pending.signature] = pending
+
+        # The row is durable, so a failed first send is retried by the poll loop
+        try:
+            await self._broadcast(pending)
+        except Exception as e:
+            logger.warning(f"Initial broadcast of {pending.signature} failed: {str(e)}")
+        return pending.signature
+
+    async def _broadcast(self, pending):
+        pending.attempts += 1
+        pending.last_sent = time.monotonic()
+        await self.client.send_transaction(
+            base64.b64decode(pending.raw_transaction), skip_preflight=True, max_retries=0
+        )
+
+    def _reached(self, status):
+        level = status.get('confirmationStatus') or 'processed'
+        return COMMITMENT_LEVELS.get(level, 0) >= COMMITMENT_LEVELS[self.commitment]
+
+    async def poll(self):
+        """Check every pending signature once and settle the ones that are final."""
+        if not self._pending:
+            return
+        pending = list(self._pending.values())
+        statuses = await self.client.get_signature_statuses([tx.signature for tx in pending])
+
+        unknown = [tx for tx, status in zip(pending, statuses) if status is None]
+        block_height = await self.client.get_block_height(self.commitment) if unknown else None
+        expiring = [
+            tx for tx in unknown
+            if tx.last_valid_block_height is not None and block_height > tx.last_valid_block_height
+        ]
+        if expiring:
+            # Without history the node only answers from its recent status cache, so a
+            # transaction that landed and aged out of it would look expired
+            history = await self.client.get_signature_statuses(
+                [tx.signature for tx in expiring], search_history=True
+            )
+            found = {tx.signature: status for tx, status in zip(expiring, history) if status is not None}
+            statuses = [
+                status if status is not None else found.get(tx.signature)
+                for tx, status in zip(pending, statuses)
+            ]
+
+        settled = []
+        resend = []
+        for tx, status in zip(pending, statuses):
+            if status is not None:
+                tx.slot = status.get('slot')
+                if status.get('err') is not None:
+                    tx.status, tx.error = 'failed', str(status['err'])
+                    settled.append(tx)
+                elif self._reached(status):
+                    tx.status = 'confirmed'
+                    settled.append(tx)
+            elif tx.last_valid_block_height is not None and block_height > tx.last_valid_block_height:
+                # The blockhash expired, so this signature can never land
+                tx.status, tx.error = 'expired', 'blockhash expired'
+                settled.append(tx)
+            elif time.monotonic() - tx.last_sent >= self.rebroadcast_interval:
+                resend.append(tx)
+
+        results = await asyncio.gather(*(self._broadcast(tx) for tx in resend), return_exceptions=True)
+        for tx, result in zip(resend, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Rebroadcast of {tx.signature} failed: {str(result)}")
+
+        if not settled:
+            return
+        states = [(tx.signature, tx.status, tx.attempts, tx.error) for tx in settled]
+        updated = await self.writer.write(lambda session: update_outbox_rows(session, states))
+        for tx in settled:
+            del self._pending[tx.signature]
+            if tx.signature not in updated:
+                continue
+            self.settled[tx.status] += 1
+            await self._fire(tx)
+
+    async def _fire(self, pending):
+        for callback in self._callbacks:
+            try:
+                result = callback(pending)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Settlement callback failed for {pending.signature}: {str(e)}")
+
+    async def run(self):
+        """Poll pending transactions until cancelled."""
+        set_background_priority()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    if self._hold_lease():
+                        await self.poll()
+                except Exception as e:
+                    logger.error(f"Transaction status poll failed: {str(e)}")
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.lease.release()
+
+    def _hold_lease(self):
+        """Keep or take the outbox lease, tracking the rows other workers submitted while holding it."""
+        if self.lease.check():
+            if self.lease.shared:
+                self._track_pending_rows()
+            return True
+        self._pending = {}
+        if not self.lease.acquire():
+            return False
+        logger.info(f"Took over the transaction outbox with {self._track_pending_rows()} pending transactions")
+        return True
+
+    def stats(self):
+        return {'pending': len(self._pending), **self.settled}
+
+
+tx_outbox = TransactionOutbox.from_env()
+stats_registry.register('outbox', tx_outbox.stats)
@@ -0,0 +1,81 @@
+import collections
+import logging
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently with a global and a per-user bound.
+
+    Different users are served in parallel up to `max_concurrent_updates`,
+    while each user runs at most `max_per_user` handlers at a time so their
+    commands keep their order. Updates from a user who is already at that
+    bound wait in the user's own queue without holding a global slot; the
+    handlers running for that user take them in order when they finish, so
+    one chat never occupies more than `max_per_user` global slots. A user
+    with `max_pending_per_user` updates already queued has further updates
+    dropped.
+    """
+
+    def __init__(self, max_concurrent_updates, max_per_user=1, max_pending_per_user=5):
+        super().__init__(max_concurrent_updates)
+        self.max_per_user = max_per_user
+        self.max_pending_per_user = max_pending_per_user
+        self._user_slots = {}
+
+    @classmethod
+    def from_env(cls):
+        """Build a processor from environment variables."""
+        return cls(
+            max_concurrent_updates=int(os.getenv('BOT_MAX_CONCURRENT_UPDATES', '64')),
+            max_per_user=int(os.getenv('BOT_MAX_UPDATES_PER_USER', '1')),
+            max_pending_per_user=int(os.getenv('BOT_MAX_PENDING_PER_USER', '5')),
+        )
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+
+        slot = self._user_slots.get(user.id)
+        if slot is None:
+            # Running handlers, queued coroutines
+            slot = self._user_slots[user.id] = [0, collections.deque()]
+        elif slot[0] >= self.max_per_user:
+            if len(slot[1]) >= self.max_pending_per_user:
+                logger.warning(f"Dropping update {update.update_id} from user {user.id}: too many pending")
+                coroutine.close()
+            else:
+                slot[1].append(coroutine)
+            return
+
+        slot[0] += 1
+        try:
+            while coroutine is not None:
+                try:
+                    await coroutine
+                except Exception as e:
+                    logger.error(f"Update from user {user.id} failed: {str(e)}")
+                # The user's next update runs in the global slot this one held
+                coroutine = slot[1].popleft() if slot[1] else None
+        finally:
+            slot[0] -= 1
+            if slot[0] == 0:
+                for queued in slot[1]:
+                    queued.close()
+                del self._user_slots[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        for _, queued in self._user_slots.values():
+            for coroutine in queued:
+                coroutine.close()
+        self._user_slots.clear()
@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from models import User
+from storage import read_session
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Read-only copy of the user fields handlers need."""
+
+    telegram_id: int
+    username: str
+    referrer_id: int
+    wallet_address: str
+    subscription_type: str
+    subscription_start_date: datetime
+    subscription_end_date: datetime
+    auto_renew: bool
+    referral_link: str
+    total_referrals: int
+    referral_rewards: float
+    referral_tier: int
+    referral_tier_multiplier: float
+    paid_referrals: int
+    total_paid_amount: float
+    total_trades: int
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            telegram_id=user.telegram_id,
+            username=user.username,
+            referrer_id=user.referrer_id,
+            wallet_address=user.wallet_address,
+            subscription_type=user.subscription_type,
+            subscription_start_date=user.subscription_start_date,
+            subscription_end_date=user.subscription_end_date,
+            auto_renew=bool(user.auto_renew),
+            referral_link=user.referral_link,
+            total_referrals=user.total_referrals or 0,
+            referral_rewards=user.referral_rewards or 0.0,
+            referral_tier=user.referral_tier or 0,
+            referral_tier_multiplier=user.referral_tier_multiplier or 1.0,
+            paid_referrals=user.paid_referrals or 0,
+            total_paid_amount=user.total_paid_amount or 0.0,
+            total_trades=user.total_trades or 0,
+        )
+
+    def is_subscription_active(self):
+        return bool(self.subscription_end_date and self.subscription_end_date > datetime.utcnow())
+
+
+class UserCache:
+    """
+    Bounded LRU cache of user snapshots keyed by telegram_id with a TTL.
+
+    Unknown users are cached too, so repeated messages from someone who has
+    not run /start do not reach the database. Code that writes a user row must
+    call invalidate() after committing.
+
+    invalidate() also bumps a per-key generation. A load that started before
+    the invalidation carries the old generation and is not stored, so a
+    snapshot read before a write cannot outlive the write for a whole TTL.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache from environment variables."""
+        return cls(
+            max_size=int(os.getenv('USER_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('USER_CACHE_TTL', '300')),
+        )
+
+    def get(self, telegram_id):
+        """
+        Return the snapshot for a user, loading it on a miss.
+
+        Args:
+            telegram_id (int): Telegram user id
+
+        Returns:
+            UserSnapshot: Snapshot, or None if the user is not registered
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return None if entry[1] is self._MISSING else entry[1]
+            self.misses += 1
+            generation = self._generations.get(telegram_id, 0)
+
+        snapshot = self._load(telegram_id)
+        self.put(telegram_id, snapshot, generation)
+        return snapshot
+
+    def put(self, telegram_id, snapshot, generation=None):
+        """
+        Store a snapshot, or None to record that the user does not exist.
+
+        Args:
+            generation (int): Generation the snapshot was loaded at; the put
+                is skipped if the key was invalidated since
+        """
+        with self._lock:
+            if generation is not None and self._generations.get(telegram_id, 0) != generation:
+                self.stale_loads += 1
+                return
+            value = self._MISSING if snapshot is None else snapshot
+            self._entries[telegram_id] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *telegram_ids):
+        """Drop cached snapshots after their rows were written."""
+        with self._lock:
+            for telegram_id in telegram_ids:
+                if telegram_id is None:
+                    continue
+                self._generations[telegram_id] = self._generations.get(telegram_id, 0) + 1
+                self._generations.move_to_end(telegram_id)
+                if self._entries.pop(telegram_id, None) is not None:
+                    self.invalidations += 1
+            # A forgotten key restarts at 0, which only matters to a load that
+            # spans max_size other invalidations
+            while len(self._generations) > self.max_size:
+                self._generations.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'stale_loads': self.stale_loads,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _load(telegram_id):
+        with read_session() as session:
+            user = session.query(User).filter_by(telegram_id=telegram_id).first()
+            return UserSnapshot.from_user(user) if user else None
+
+
+user_cache = UserCache.from_env()
+stats_registry.register('user_cache', user_cache.stats)
+
+
+def get_user_snapshot(telegram_id):
+    """Return the cached snapshot for a user, or None if not registered."""
+    return user_cache.get(telegram_id)
+
+
+def invalidate_user(*telegram_ids):
+    """Invalidate cached snapshots for users whose rows changed."""
+    user_cache.invalidate(*telegram_ids)
@@ -7,12 +7,12 @@ logger = logging.getLogger(__name__)
 
 bot_username = None
 
-def get_bot_username():
+async def get_bot_username():
     global bot_username
     if bot_username is None:
         try:
-            bot = telegram.Bot(token=TELEGRAM_API_TOKEN)
-            bot_username = bot.get_me().username
+            async with telegram.Bot(token=TELEGRAM_API_TOKEN) as bot:
+                bot_username = (await bot.get_me()).username
         except Exception as e:
             logger.error(f"Failed to get bot username: {str(e)}, did you setup a correct telegram API key?")
     return bot_username
@@ -0,0 +1,139 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+
+from aiohttp import web
+from telegram import Update
+
+from health import stats_registry
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    Receive Telegram updates over HTTP and feed them to the bot.
+
+    Accepted updates go onto a bounded queue drained by worker tasks. When the
+    queue stays full for `enqueue_timeout` seconds the request is answered
+    with 429 so Telegram backs off and redelivers the update later.
+    """
+
+    def __init__(self, application, secret_token, public_url=None, host='0.0.0.0', port=8443,
+                 path='/telegram/webhook', queue_size=1000, workers=16, enqueue_timeout=2.0):
+        self.application = application
+        self.secret_token = secret_token
+        self.public_url = public_url
+        self.host = host
+        self.port = port
+        self.path = path
+        self.queue_size = queue_size
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self._queue = None
+        self._worker_tasks = []
+        self._runner = None
+
+    @classmethod
+    def from_env(cls, application):
+        """Build a webhook server from environment variables."""
+        return cls(
+            application,
+            secret_token=os.getenv('WEBHOOK_SECRET_TOKEN'),
+            public_url=os.getenv('WEBHOOK_URL'),
+            host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', '8443')),
+            path=os.getenv('WEBHOOK_PATH', '/telegram/webhook'),
+            queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+            workers=int(os.getenv('WEBHOOK_WORKERS', '16')),
+        )
+
+    def build_app(self):
+        """Return the aiohttp application serving the webhook routes."""
+        web_app = web.Application()
+        web_app.router.add_post(self.path, self.handle_update)
+        return web_app
+
+    async def start(self):
+        """Start the workers, the HTTP listener and register the webhook."""
+        if not self.secret_token:
+            raise ValueError("WEBHOOK_SECRET_TOKEN must be set in webhook mode")
+
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        stats_registry.register('webhook', self.stats)
+        logger.info(f"Webhook listening on {self.host}:{self.port}{self.path}")
+
+        if self.public_url:
+            await self.application.bot.set_webhook(
+                url=self.public_url,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook registered at {self.public_url}")
+
+    async def stop(self):
+        """Stop accepting updates, drain the queue and stop the workers."""
+        stats_registry.unregister('webhook')
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._queue is not None:
+            await self._queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def handle_update(self, request):
+        supplied = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(supplied, self.secret_token):
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self._queue.put(data), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning("Webhook queue full, asking Telegram to retry")
+            return web.Response(status=429, headers={'Retry-After': '1'})
+
+        self.accepted += 1
+        return web.Response(status=200)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'queue_size': self.queue_size,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'failed': self.failed,
+        }
+
+    async def _worker(self):
+        processor = self.application.update_processor
+        while True:
+            data = await self._queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                await processor.process_update(update, self.application.process_update(update))
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to process webhook update: {str(e)}")
+            finally:
+                self._queue.task_done()